@@ -4,6 +4,57 @@ from configs import simulation as SimulationConfig
 # FORWARD_PROJECTION_STEPS = int(SimulationConfig.STEPS_PER_SECOND * 0.25)
 FORWARD_PROJECTION_STEPS = 3
 
+# score each agent against only its k nearest opponents, 0 for all of them
+NEAREST_OPPONENTS = 0
+
+# "exhaustive", "coarse_to_fine", "cem" or "warm_start", see simulation/mdp.py
+PLANNER = "exhaustive"
+# grid steps coarse_to_fine halves its lattice spacing down to
+REFINE_STRIDE = 1
+# cem rounds, actions sampled each round and best of them refitted to
+CEM_ITERATIONS = 4
+CEM_SAMPLES = 24
+CEM_ELITES = 6
+# grid steps around its last action warm_start scores
+LOCAL_RADIUS = 1
+# decisions between warm_start's full scans
+RESCAN_INTERVAL = 20
+# fall in reward, as a fraction of the last, that makes warm_start scan again
+RESCAN_DROP = 0.5
+# seeds each agent's sampling, so runs are reproducible
+PLANNER_SEED = 0
+
+# ticks an agent holds its action for at most, 1 to decide every step
+DECISION_INTERVAL = 1
+# range (m) to the nearest opponent within which agents decide every step
+DECISION_NEAR_RANGE = 2 * SimulationConfig.CAPTURE_RADIUS
+# range (m) beyond which agents hold for DECISION_INTERVAL, in proportion between
+DECISION_FAR_RANGE = 5000.0
+
+# "planner" or "distilled", the network fitted to the planner (simulation/distilled.py)
+POLICY = "planner"
+DISTILLED_POLICY = "results/distilled_policy.npz"
+# nearest opponents the distilled policy is shown
+DISTILLED_OPPONENTS = 2
+# range (m) to an opponent within which the planner still decides
+DISTILLED_FALLBACK_RANGE = 2 * SimulationConfig.CAPTURE_RADIUS
+
+# situations whose decisions are reused (simulation/cache.py), 0 for no cache
+DECISION_CACHE_SIZE = 0
+# ratio of each range and height bucket's width to the last's
+CACHE_RANGE_RATIO = 1.25
+# speed (m/s) and angle (rad) bucket widths
+CACHE_SPEED_STEP = 5.0
+CACHE_ANGLE_STEP = np.pi / 18
+# nearest opponents a cached situation covers
+CACHE_OPPONENTS = 2
+
+# score grid actions from tabulated motion (simulation/primitives.py)
+MOTION_PRIMITIVES = False
+# speeds, flight path angles, roll angles and attack angles tabulated
+PRIMITIVE_GRID = (4, 8, 12, 3)
+PRIMITIVE_DIRECTORY = "results/primitives"
+
 ACTION_THRUSTS = np.linspace(0.0, 0.9, 10)
 ACTION_ATTACK_ANGLE_RATES = np.array(
     [-1.0, -0.8, -0.6, -0.4, -0.2, 0.0, 0.2, 0.4, 0.6, 0.8]
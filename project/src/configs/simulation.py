@@ -14,8 +14,24 @@ MACH = 343
 CAPTURE_POINT_STEPS = int(2.0 * STEPS_PER_SECOND)
 CAPTURE_RADIUS = 500
 
+# ticks (1 / STEPS_PER_SECOND s) a step integrates at most, 1 for single ticks
+MAX_STEP_TICKS = 1
+# range (m) to the nearest opponent within which steps are single ticks
+STEP_NEAR_RANGE = 4 * CAPTURE_RADIUS
+# range (m) beyond which steps are MAX_STEP_TICKS ticks, in proportion between
+STEP_FAR_RANGE = 10_000.0
+
 M = MACH
 
 MAX_GS = 9.0
 CORNER_VELOCITY = 80.0
 K_DRAG = 0.05
+
+# "semi_implicit" Euler, "rk2" (midpoint) or "rk4" (classic Runge-Kutta)
+INTEGRATOR = "semi_implicit"
+# compile the kernels with fastmath, see studies.fastmath_drift
+FASTMATH = False
+# "float64" or "float32" agent state, see studies.precision_drift
+STATE_DTYPE = "float64"
+# worker threads for the compiled kernels, 0 for as many as numba allows
+THREADS = 0
@@ -59,6 +59,8 @@ class Display:
         agent_count = simulation.N
         hard_deck = SimulationConfig.HARD_DECK
         capture_buffer = simulation.capture_buffer
+        in_range = [tuple(pair) for pair in simulation.capture_pairs.tolist()]
+        nose_checks, asymmetry_checks = simulation.capture_checks.T
 
         values = [
             f"Timestep: {timestep}",
@@ -72,9 +74,9 @@ class Display:
             f"Roll Angle Ratio: {simulation.roll_angle_ratio}",
             f"",
             f"Capture Buffer: {capture_buffer}",
-            f"Distance Check: {simulation.distance_check}",
-            f"Nose Check: {simulation.nose_check}",
-            f"Asymmetry Check: {simulation.asymmetry_check}",
+            f"Distance Check: {in_range}",
+            f"Nose Check: {[p for p, c in zip(in_range, nose_checks) if c]}",
+            f"Asymmetry Check: {[p for p, c in zip(in_range, asymmetry_checks) if c]}",
             f"",
             f"Positions: {', '.join([f'({pos[0]:.1f}, {pos[1]:.1f}, {pos[2]:.1f})' for pos in simulation.positions])}",
             f"Speeds: {', '.join([f'{s:.1f}' for s in simulation.speeds])}",
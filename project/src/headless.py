@@ -0,0 +1,42 @@
+import logging
+from argparse import ArgumentParser
+
+from configs import simulation as SimulationConfig
+from configs.parameters import BASE
+from simulation.simulation import SimulationManager
+
+# Entry point for batch jobs: runs the simulation with plain logging and imports
+# nothing beyond the configs and the simulation itself (no rich, matplotlib,
+# pyvista or Qt), keeping short-lived processes quick to start
+
+logger = logging.getLogger("headless")
+
+parser = ArgumentParser(prog="Pursuit-Evasion Simulation (headless)")
+parser.add_argument(
+    "-t",
+    "--threads",
+    type=int,
+    default=SimulationConfig.THREADS,
+    help="Threads for the compiled simulation kernels, 0 for all (capped at NUMBA_NUM_THREADS).",
+)
+
+
+def run() -> tuple[int, list[tuple[int, int, int]]]:
+    simulation_manager = SimulationManager(logger)
+    simulation_manager.setup(BASE)
+    return simulation_manager.run()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    SimulationConfig.THREADS = args.threads
+    logging.basicConfig(
+        level="INFO", format="[%(asctime)s] %(levelname)s %(message)s", datefmt="%X"
+    )
+
+    steps, captures = run()
+    logger.info(
+        f"Captures {captures} by timestep {steps}."
+        if captures
+        else f"No capture by timestep {steps}."
+    )
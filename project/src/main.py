@@ -9,11 +9,13 @@ from rich.console import Console
 from rich.logging import RichHandler
 
 from configs import simulation as SimulationConfig
-from display import Display
-from outputs.base import OutputManager
 from simulation.simulation import Simulation, SimulationManager
 from configs.parameters import BASE
 
+# the dashboard (rich layouts), outputs (matplotlib) and visualisation
+# (pyvista/Qt) are imported only when their flags are set; headless.py skips
+# rich entirely
+
 console = Console()
 logging.basicConfig(
     level="INFO",
@@ -50,6 +52,19 @@ parser.add_argument(
     action="store_true",
     help="Display the live 3D Qt visualisation during the simulation run.",
 )
+parser.add_argument(
+    "-w",
+    "--warmup",
+    action="store_true",
+    help="Compile the simulation kernels, or load them from the on-disk cache, report how long each took and exit.",
+)
+parser.add_argument(
+    "-t",
+    "--threads",
+    type=int,
+    default=SimulationConfig.THREADS,
+    help="Threads for the compiled simulation kernels, 0 for all (capped at NUMBA_NUM_THREADS).",
+)
 
 
 def run(
@@ -60,10 +75,16 @@ def run(
     if vis_update:
         callbacks.append(vis_update)
 
-    output_manager = OutputManager(logger) if args.outputs else None
-    if output_manager:
+    output_manager = None
+    if args.outputs:
+        from outputs.base import OutputManager
+
+        output_manager = OutputManager(logger)
         callbacks.append(output_manager.add_agent_data)
 
+    if args.display:
+        from display import Display
+
     with Display(console) if args.display else nullcontext() as display:
         if display:
             callbacks.append(display.update)
@@ -82,13 +103,27 @@ def run(
     )
 
 
+def warmup() -> None:
+    from simulation.warmup import warmup as warmup_kernels
+
+    report = warmup_kernels()
+    for name, seconds, how in report:
+        logger.info(f"{name}: {seconds * 1000:.1f} ms ({how})")
+    logger.info(
+        f"Kernels ready in {sum(seconds for _, seconds, _ in report) * 1000:.1f} ms."
+    )
+
+
 if __name__ == "__main__":
     # setup args
     args = parser.parse_args()
+    SimulationConfig.THREADS = args.threads
 
     # the pyvista visualisation window MUST run in the main thread, so we run the simulation in a separate thread
     try:
-        if args.visualisation:
+        if args.warmup:
+            warmup()
+        elif args.visualisation:
             from visualisation import VisualisationManager
             from PyQt5.QtWidgets import QApplication
 
@@ -1,13 +1,16 @@
+from __future__ import annotations
+
 import os
-import matplotlib.pyplot as plt
 from collections import defaultdict
 from logging import Logger
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
 
 from configs import simulation as SimulationConfig
 from configs import output as OutputConfig
 
-from simulation.simulation import Simulation, Vector, Scalar
+if TYPE_CHECKING:
+    from simulation.simulation import Simulation, Vector, Scalar
 
 
 class OutputManager:
@@ -27,7 +30,8 @@ class OutputManager:
     # Called by simulation by callback after each step
     def add_agent_data(self, simulation: Simulation):
         for agent_idx in range(simulation.N):
-            position: Vector = simulation.positions[agent_idx]
+            # the simulation steps its arrays in place, so keep a copy
+            position: Vector = simulation.positions[agent_idx].copy()
             attack_angle: Scalar = simulation.attack_angles[agent_idx]
             flight_path_angle: Scalar = simulation.flight_path_angles[agent_idx]
             azimuth_angle: Scalar = simulation.azimuth_angles[agent_idx]
@@ -48,6 +52,8 @@ class BaseOutput(ABC):
     def __init__(self, logger: Logger, output_manager: OutputManager):
         self.logger = logger
         self.output_manager = output_manager
+        import matplotlib.pyplot as plt
+
         self.fig = plt.figure(figsize=OutputConfig.FIGSIZE)
         self.ax = self.fig.add_subplot(111, projection="3d")
 
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Mapping
+import numpy as np
+import numpy.typing as npt
+
+from configs import simulation as SimulationConfig
+from simulation.simulation import Simulation
+
+if TYPE_CHECKING:
+    from configs.parameters import SimulationParams
+    from simulation.params import Params
+
+
+class BatchSimulation(Simulation):
+    # B independent N-agent episodes stepped together, each episode's agents
+    # back to back in the state arrays (see episode_view)
+
+    def __init__(
+        self,
+        N: int,
+        episodes: list[SimulationParams],
+        params: Params | None = None,
+        dtype: npt.DTypeLike | None = None,
+    ):
+        self.B = len(episodes)
+        self.episode_agents = N
+        super().__init__(
+            self.B * N,
+            **{  # type: ignore
+                key: [value for episode in episodes for value in episode[key]]
+                for key in episodes[0]
+            },
+            params=params,
+            dtype=dtype,
+        )
+        self.groups = np.repeat(np.arange(self.B), N)
+
+        self.finished: npt.NDArray[np.bool_] = np.zeros(self.B, dtype=bool)
+        self.finish_timesteps: npt.NDArray[np.int64] = np.zeros(self.B, dtype=int)
+        self.captures: list[list[tuple[int, int, int]]] = [[] for _ in range(self.B)]
+
+    def episode_view(self, array: npt.NDArray) -> npt.NDArray:
+        return array.reshape(self.B, self.episode_agents, *array.shape[1:])
+
+    def step(self, decided: bool = False) -> list[tuple[int, int]]:
+        # Simulation.step, also recording each capture in its episode's
+        # captures with agent ids local to the episode
+        captures = super().step(decided)
+        for evader, pursuer in captures:
+            episode = evader // self.episode_agents
+            self.captures[episode].append(
+                (
+                    self.timestep,
+                    evader % self.episode_agents,
+                    pursuer % self.episode_agents,
+                )
+            )
+
+        # same termination as SimulationManager.run, per episode
+        alive = self.episode_view(self.active).sum(axis=1)
+        ended = ~self.finished & (
+            (alive <= 1) | (self.timestep >= SimulationConfig.MAX_TIMESTEPS)
+        )
+        if ended.any():
+            self.finished |= ended
+            self.finish_timesteps[ended] = self.timestep
+            np.logical_not(self.finished[self.groups], out=self.running)
+
+        return captures
+
+    def snapshot_arrays(self) -> dict[str, npt.NDArray]:
+        # Simulation.snapshot_arrays, with which episodes have finished, when,
+        # and every episode's captures as (episode, timestep, captured,
+        # capturer) rows
+        arrays = super().snapshot_arrays()
+        arrays["finished"] = self.finished
+        arrays["finish_timesteps"] = self.finish_timesteps
+        arrays["captures"] = np.array(
+            [
+                (episode, *capture)
+                for episode, captures in enumerate(self.captures)
+                for capture in captures
+            ],
+            dtype=int,
+        ).reshape(-1, 4)
+        return arrays
+
+    def restore_arrays(self, arrays: Mapping[str, npt.NDArray]):
+        super().restore_arrays(arrays)
+        self.finished = arrays["finished"].copy()
+        self.finish_timesteps = arrays["finish_timesteps"].copy()
+        self.captures = [[] for _ in range(self.B)]
+        for episode, timestep, captured, capturer in arrays["captures"].tolist():
+            self.captures[episode].append((timestep, captured, capturer))
+
+    def run(self) -> list[tuple[int, list[tuple[int, int, int]]]]:
+        # Steps until every episode has terminated, returning each episode's
+        # (timestep, captures) as SimulationManager.run does
+        while not self.finished.all():
+            self.step()
+
+        return [
+            (int(timestep), captures)
+            for timestep, captures in zip(self.finish_timesteps, self.captures)
+        ]
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+import numpy as np
+from numpy.typing import NDArray
+
+from simulation.distilled import opponent_geometry
+
+if TYPE_CHECKING:
+    from simulation.params import Params
+    from simulation.simulation import Simulation
+
+
+class DecisionCache:
+    # least recently used cache of grid actions, by decision_keys situation
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: OrderedDict[bytes, tuple[int, int, int]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: bytes) -> tuple[int, int, int] | None:
+        indices = self.entries.get(key)
+        if indices is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return indices
+
+    def put(self, key: bytes, indices: tuple[int, int, int]):
+        self.entries[key] = indices
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+def decision_keys(
+    simulation: Simulation, agents: NDArray[np.int64], params: Params
+) -> list[bytes]:
+    # Each agent's situation, quantised: its speed, flight path, roll and
+    # attack angles and height above the hard deck, then for each of its
+    # cache_opponents nearest opponents (see opponent_geometry) the range,
+    # bearing and elevation of its projected position and the heading and
+    # climb of its projected velocity, and last its action ratios and bounds.
+    # Ranges and heights fall in buckets growing by cache_range_ratio, speeds
+    # in buckets of cache_speed_step and angles of cache_angle_step
+    angle = params.cache_angle_step
+    log_ratio = np.log(params.cache_range_ratio)
+    heights = simulation.positions[agents, 2] - params.hard_deck
+    own = np.column_stack(
+        [
+            np.floor(simulation.speeds[agents] / params.cache_speed_step),
+            np.floor(simulation.flight_path_angles[agents] / angle),
+            np.floor(np.mod(simulation.roll_angles[agents], 2 * np.pi) / angle),
+            np.floor(simulation.attack_angles[agents] / angle),
+            np.sign(heights)
+            * np.floor(np.log(np.maximum(np.abs(heights), 1.0)) / log_ratio),
+        ]
+    )
+
+    present, offsets, velocities = opponent_geometry(
+        simulation, agents, params.cache_opponents
+    )
+    ranges = np.sqrt(np.sum(offsets**2, axis=2))
+    speeds = np.sqrt(np.sum(velocities**2, axis=2))
+    slots = np.stack(
+        [
+            present,
+            np.floor(np.log(np.maximum(ranges, 1.0)) / log_ratio),
+            np.floor(np.arctan2(offsets[..., 1], offsets[..., 0]) / angle),
+            np.floor(np.arcsin(offsets[..., 2] / np.maximum(ranges, 1e-9)) / angle),
+            np.floor(np.arctan2(velocities[..., 1], velocities[..., 0]) / angle),
+            np.floor(np.arcsin(velocities[..., 2] / np.maximum(speeds, 1e-9)) / angle),
+        ],
+        axis=2,
+    )
+    slots[~present] = 0
+
+    quantised = np.column_stack([own, slots.reshape(agents.shape[0], -1)])
+    kinds = np.column_stack(
+        [simulation.action_ratios[agents], *(b[agents] for b in simulation.bounds())]
+    )
+    return [
+        quantised[row].astype(np.int64).tobytes() + kinds[row].tobytes()
+        for row in range(agents.shape[0])
+    ]
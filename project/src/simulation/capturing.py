@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+import numpy as np
+import numpy.typing as npt
+from numba import njit
+
+from simulation.spatial import bucket_count, pairs_within_into
+
+if TYPE_CHECKING:
+    from simulation.params import Params
+    from simulation.simulation import Vectors, Scalars
+    from simulation.spatial import Indices, Pairs
+
+NOSE_ALIGNMENT = np.cos(np.deg2rad(50))
+ASYMMETRY_MARGIN = 0.2
+
+
+@njit(cache=True, error_model="numpy")
+def detect_captures_into(
+    positions: Vectors,
+    flight_path_angles: Scalars,
+    attack_angles: Scalars,
+    azimuth_angles: Scalars,
+    active: npt.NDArray[np.bool_],
+    groups: Indices,
+    capture_keys: Indices,
+    capture_counts: Indices,
+    cells: Pairs,
+    head: Indices,
+    following: Indices,
+    pairs: Pairs,
+    checks: npt.NDArray[np.bool_],
+    captures: Pairs,
+    captured: npt.NDArray[np.bool_],
+    keys: Indices,
+    counts: Indices,
+    ticks: int,
+    params: Params,
+) -> tuple[int, int, int]:
+    # The capture buffer is sparse: sorted keys (evader * N + pursuer) with how
+    # many ticks (nominal steps) they have been in position, holding only pairs
+    # that are currently in position; this step lasted ticks ticks.
+    # Writes the (evader, pursuer) captures between active agents of the same
+    # group in the order they were made, the new buffer into keys and counts
+    # (which must not be capture_keys and capture_counts), and the in-range
+    # (pursuer, evader) pairs with their nose and asymmetry checks, returning how
+    # many pairs, captures and buffer entries there are. If there are more pairs
+    # than pairs holds nothing else is written; retry with bigger pairs, checks,
+    # keys and counts
+    N = positions.shape[0]
+
+    # Distance check, only pairs inside the capture radius can ever capture
+    pair_count = pairs_within_into(
+        positions,
+        active,
+        groups,
+        params.capture_radius,
+        cells,
+        head,
+        following,
+        pairs,
+    )
+    if pair_count > pairs.shape[0]:
+        return pair_count, 0, 0
+
+    captured[:] = False
+    count = 0
+    kept = 0
+
+    for k in range(pair_count):
+        pursuer = pairs[k, 0]
+        evader = pairs[k, 1]
+        checks[k, 0] = False
+        checks[k, 1] = False
+        if captured[evader]:
+            continue
+
+        rx = positions[evader, 0] - positions[pursuer, 0]
+        ry = positions[evader, 1] - positions[pursuer, 1]
+        rz = positions[evader, 2] - positions[pursuer, 2]
+        d = np.sqrt(rx**2 + ry**2 + rz**2)
+        rx, ry, rz = rx / d, ry / d, rz / d
+
+        # Pursuer nose pointing at evader within 50 degrees
+        pitch = flight_path_angles[pursuer] + attack_angles[pursuer]
+        pursuer_alignment = (
+            np.cos(pitch) * np.cos(azimuth_angles[pursuer]) * rx
+            + np.cos(pitch) * np.sin(azimuth_angles[pursuer]) * ry
+            + np.sin(pitch) * rz
+        )
+        checks[k, 0] = pursuer_alignment >= NOSE_ALIGNMENT
+
+        # Pursuer has meaningfully better alignment than evader
+        pitch = flight_path_angles[evader] + attack_angles[evader]
+        evader_alignment = (
+            np.cos(pitch) * np.cos(azimuth_angles[evader]) * -rx
+            + np.cos(pitch) * np.sin(azimuth_angles[evader]) * -ry
+            + np.sin(pitch) * -rz
+        )
+        checks[k, 1] = pursuer_alignment > evader_alignment + ASYMMETRY_MARGIN
+
+        if not (checks[k, 0] and checks[k, 1]):
+            continue
+
+        # Pairs that fail any check drop out of the buffer, i.e. reset to 0
+        key = evader * N + pursuer
+        previous = np.searchsorted(capture_keys, key)
+        keys[kept] = key
+        counts[kept] = ticks
+        if previous < capture_keys.shape[0] and capture_keys[previous] == key:
+            counts[kept] += capture_counts[previous]
+        kept += 1
+
+        if counts[kept - 1] >= params.capture_point_steps:
+            captures[count, 0] = evader
+            captures[count, 1] = pursuer
+            captured[evader] = True
+            count += 1
+
+    # Drop every pair involving a captured agent, then insertion sort the rest
+    # (only pairs currently in position, so few) to keep the buffer sorted
+    entries = 0
+    for k in range(kept):
+        if not (captured[keys[k] // N] or captured[keys[k] % N]):
+            keys[entries] = keys[k]
+            counts[entries] = counts[k]
+            entries += 1
+    for a in range(1, entries):
+        key, key_count = keys[a], counts[a]
+        b = a
+        while b > 0 and keys[b - 1] > key:
+            keys[b] = keys[b - 1]
+            counts[b] = counts[b - 1]
+            b -= 1
+        keys[b] = key
+        counts[b] = key_count
+
+    return pair_count, count, entries
+
+
+@njit(cache=True)
+def detect_captures(
+    positions: Vectors,
+    flight_path_angles: Scalars,
+    attack_angles: Scalars,
+    azimuth_angles: Scalars,
+    active: npt.NDArray[np.bool_],
+    groups: Indices,
+    capture_keys: Indices,
+    capture_counts: Indices,
+    params: Params,
+) -> tuple[Pairs, Indices, Indices, Pairs, npt.NDArray[np.bool_]]:
+    # detect_captures_into fresh arrays, returning the captures, the new buffer
+    # and the in-range pairs with their checks
+    N = positions.shape[0]
+    cells = np.empty((N, 3), dtype=np.int64)
+    head = np.empty(bucket_count(N), dtype=np.int64)
+    following = np.empty(N, dtype=np.int64)
+    captures = np.empty((N, 2), dtype=np.int64)
+    captured = np.empty(N, dtype=np.bool_)
+
+    capacity = max(N, 1)
+    while True:
+        pairs = np.empty((capacity, 2), dtype=np.int64)
+        checks = np.empty((capacity, 2), dtype=np.bool_)
+        keys = np.empty(capacity, dtype=np.int64)
+        counts = np.empty(capacity, dtype=np.int64)
+        pair_count, count, entries = detect_captures_into(
+            positions,
+            flight_path_angles,
+            attack_angles,
+            azimuth_angles,
+            active,
+            groups,
+            capture_keys,
+            capture_counts,
+            cells,
+            head,
+            following,
+            pairs,
+            checks,
+            captures,
+            captured,
+            keys,
+            counts,
+            1,
+            params,
+        )
+        if pair_count <= capacity:
+            break
+        capacity = pair_count
+
+    return (
+        captures[:count],
+        keys[:entries],
+        counts[:entries],
+        pairs[:pair_count],
+        checks[:pair_count],
+    )
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, NamedTuple
+import numpy as np
+from numpy.typing import NDArray
+
+from configs import mdp as MDPConfig
+from simulation.params import POLICIES
+from simulation.spatial import nearest_neighbours_into
+
+if TYPE_CHECKING:
+    from simulation.params import Params
+    from simulation.simulation import Simulation
+
+
+class DistilledPolicy(NamedTuple):
+    # small network imitating the planner, from policy_features to grid indices
+
+    mean: NDArray[np.float64]
+    scale: NDArray[np.float64]
+    # every layer's weights and biases, the last layer's outputs being the
+    # thrust, then attack angle rate, then roll angle rate indices' logits
+    weights: tuple[NDArray[np.float64], ...]
+    biases: tuple[NDArray[np.float64], ...]
+    axis_sizes: tuple[int, int, int]
+    # nearest opponents the features describe
+    opponents: int
+
+
+def opponent_geometry(
+    simulation: Simulation, agents: NDArray[np.int64], opponents: int
+) -> tuple[NDArray[np.bool_], NDArray[np.float64], NDArray[np.float64]]:
+    # For each agent's live opponents whose projected positions are nearest its
+    # position (searched on the workspace's grid), nearest first: whether there
+    # is one, and its projected position relative to the agent and its
+    # projected velocity, both turned into the agent's heading (zero where
+    # there is none). Needs the workspace's projection, so call after
+    # Simulation.decide
+    workspace = simulation.workspace
+    N = simulation.positions.shape[0]
+    nearest = np.empty((N, opponents), dtype=np.int64)
+    nearest_neighbours_into(
+        simulation.positions,
+        workspace.projected_positions,
+        workspace.live,
+        simulation.groups,
+        workspace.cells,
+        workspace.head,
+        workspace.following,
+        nearest,
+        np.empty((N, opponents)),
+    )
+    # agents with fewer opponents than asked for have the rest empty
+    table = nearest[agents]
+    present = table >= 0
+    cos_azimuth = np.cos(simulation.azimuth_angles[agents])[:, None]
+    sin_azimuth = np.sin(simulation.azimuth_angles[agents])[:, None]
+    geometry = []
+    for vectors in (
+        workspace.projected_positions[table] - simulation.positions[agents][:, None],
+        workspace.projected_velocities[table],
+    ):
+        turned = np.zeros((*table.shape, 3))
+        turned[..., 0] = vectors[..., 0] * cos_azimuth + vectors[..., 1] * sin_azimuth
+        turned[..., 1] = vectors[..., 1] * cos_azimuth - vectors[..., 0] * sin_azimuth
+        turned[..., 2] = vectors[..., 2]
+        turned[~present] = 0.0
+        geometry.append(turned)
+    return present, geometry[0], geometry[1]
+
+
+def policy_features(
+    simulation: Simulation, agents: NDArray[np.int64], opponents: int
+) -> NDArray[np.float64]:
+    # One row per agent: its speed, flight path angle, roll angle (as sine and
+    # cosine), attack angle and altitude, then for each of its nearest
+    # opponents (see opponent_geometry) whether there is one, its relative
+    # position, its distance and its velocity
+    roll_angles = simulation.roll_angles[agents]
+    own = np.column_stack(
+        [
+            simulation.speeds[agents],
+            simulation.flight_path_angles[agents],
+            np.sin(roll_angles),
+            np.cos(roll_angles),
+            simulation.attack_angles[agents],
+            simulation.positions[agents, 2],
+        ]
+    )
+    present, offsets, velocities = opponent_geometry(simulation, agents, opponents)
+    slots = np.concatenate(
+        [
+            present[..., None].astype(np.float64),
+            offsets,
+            np.sqrt(np.sum(offsets**2, axis=2))[..., None],
+            velocities,
+        ],
+        axis=2,
+    )
+    return np.column_stack([own, slots.reshape(agents.shape[0], -1)])
+
+
+def action_indices(
+    actions: NDArray[np.float64], ratios: NDArray[np.float64], params: Params
+) -> NDArray[np.int64]:
+    # The grid index on each axis of each action, with the agent's ratios
+    axes = (
+        params.action_thrusts,
+        params.action_attack_angle_rates,
+        params.action_roll_angle_rates,
+    )
+    return np.column_stack(
+        [
+            np.argmin(np.abs(actions[:, [k]] - axes[k] * ratios[:, [k]]), axis=1)
+            for k in range(3)
+        ]
+    )
+
+
+def policy_indices(
+    policy: DistilledPolicy, features: NDArray[np.float64]
+) -> NDArray[np.int64]:
+    # Each feature row's most likely grid index on each action axis
+    logits = forward(policy, features)[-1]
+    bounds = np.cumsum((0, *policy.axis_sizes))
+    return np.column_stack(
+        [np.argmax(logits[:, bounds[k] : bounds[k + 1]], axis=1) for k in range(3)]
+    )
+
+
+def policy_actions(
+    policy: DistilledPolicy,
+    simulation: Simulation,
+    agents: NDArray[np.int64],
+    params: Params,
+) -> NDArray[np.float64]:
+    # The grid action the policy picks for each of the agents, with their ratios
+    indices = policy_indices(
+        policy, policy_features(simulation, agents, policy.opponents)
+    )
+    return (
+        np.column_stack(
+            [
+                params.action_thrusts[indices[:, 0]],
+                params.action_attack_angle_rates[indices[:, 1]],
+                params.action_roll_angle_rates[indices[:, 2]],
+            ]
+        )
+        * simulation.action_ratios[agents]
+    )
+
+
+def forward(
+    policy: DistilledPolicy, features: NDArray[np.float64]
+) -> list[NDArray[np.float64]]:
+    # Every layer's output, the standardised features first
+    layers = [(features - policy.mean) / policy.scale]
+    for weights, biases in zip(policy.weights[:-1], policy.biases[:-1]):
+        layers.append(np.tanh(layers[-1] @ weights + biases))
+    layers.append(layers[-1] @ policy.weights[-1] + policy.biases[-1])
+    return layers
+
+
+def record_decisions(
+    simulation: Simulation,
+    steps: int,
+    opponents: int = MDPConfig.DISTILLED_OPPONENTS,
+) -> tuple[NDArray[np.float64], NDArray[np.int64]]:
+    # Steps the simulation for up to steps steps, recording every decision
+    # its planner makes: the deciding agent's policy_features, and the grid
+    # index on each axis of the action chosen. The simulation steps with its
+    # own settings, so one already using the distilled policy records the
+    # planner's decisions (made aside, see Simulation.decide_aside) in the
+    # states that policy leads to, while one using the planner records the
+    # decisions it steps with
+    planner = simulation.params._replace(
+        policy=POLICIES.index("planner"), decision_cache_size=0
+    )
+    planning = simulation.params.policy == planner.policy
+    workspace = simulation.workspace
+    features: list[NDArray[np.float64]] = []
+    labels: list[NDArray[np.int64]] = []
+    for _ in range(steps):
+        if planning:
+            simulation.decide()
+        else:
+            simulation.decide_aside(planner)
+        agents = np.flatnonzero(workspace.deciding)
+        features.append(policy_features(simulation, agents, opponents))
+        labels.append(
+            action_indices(
+                workspace.actions[agents], simulation.action_ratios[agents], planner
+            )
+        )
+
+        simulation.step(decided=planning)
+        if np.sum(simulation.active) <= 1:
+            break
+
+    return np.concatenate(features), np.concatenate(labels)
+
+
+def fit_policy(
+    features: NDArray[np.float64],
+    labels: NDArray[np.int64],
+    params: Params,
+    hidden: tuple[int, ...] = (64, 64),
+    epochs: int = 200,
+    batch_size: int = 256,
+    learning_rate: float = 1e-3,
+    seed: int = 0,
+) -> DistilledPolicy:
+    # Fits a DistilledPolicy to recorded decisions by minimising each axis's
+    # softmax cross-entropy with Adam over shuffled minibatches
+    rng = np.random.default_rng(seed)
+    axis_sizes = (
+        params.action_thrusts.shape[0],
+        params.action_attack_angle_rates.shape[0],
+        params.action_roll_angle_rates.shape[0],
+    )
+    bounds = np.cumsum((0, *axis_sizes))
+    sizes = (features.shape[1], *hidden, bounds[-1])
+    policy = DistilledPolicy(
+        features.mean(axis=0),
+        np.maximum(features.std(axis=0), 1e-9),
+        tuple(
+            rng.normal(0.0, 1.0 / np.sqrt(n_in), (n_in, n_out))
+            for n_in, n_out in zip(sizes[:-1], sizes[1:])
+        ),
+        tuple(np.zeros(n_out) for n_out in sizes[1:]),
+        axis_sizes,
+        (features.shape[1] - 6) // 8,
+    )
+    parameters = [*policy.weights, *policy.biases]
+    moments = [np.zeros_like(p) for p in parameters]
+    squares = [np.zeros_like(p) for p in parameters]
+    layer_count = len(policy.weights)
+
+    update = 0
+    for _ in range(epochs):
+        order = rng.permutation(features.shape[0])
+        for start in range(0, order.shape[0], batch_size):
+            batch = order[start : start + batch_size]
+            layers = forward(policy, features[batch])
+
+            # softmax cross-entropy gradient on each axis's logits
+            gradient = np.empty_like(layers[-1])
+            for k in range(3):
+                logits = layers[-1][:, bounds[k] : bounds[k + 1]]
+                probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+                probabilities /= probabilities.sum(axis=1, keepdims=True)
+                probabilities[np.arange(batch.shape[0]), labels[batch, k]] -= 1.0
+                gradient[:, bounds[k] : bounds[k + 1]] = probabilities
+            gradient /= batch.shape[0]
+
+            gradients = [np.empty(0)] * (2 * layer_count)
+            for layer in range(layer_count - 1, -1, -1):
+                gradients[layer] = layers[layer].T @ gradient
+                gradients[layer_count + layer] = gradient.sum(axis=0)
+                if layer:
+                    gradient = (gradient @ policy.weights[layer].T) * (
+                        1.0 - layers[layer] ** 2
+                    )
+
+            update += 1
+            for p, g, m, v in zip(parameters, gradients, moments, squares):
+                m *= 0.9
+                m += 0.1 * g
+                v *= 0.999
+                v += 0.001 * g**2
+                p -= (
+                    learning_rate
+                    * (m / (1.0 - 0.9**update))
+                    / (np.sqrt(v / (1.0 - 0.999**update)) + 1e-8)
+                )
+
+    return policy
+
+
+def save_policy(
+    policy: DistilledPolicy, path: str = MDPConfig.DISTILLED_POLICY
+) -> None:
+    np.savez(
+        path,
+        mean=policy.mean,
+        scale=policy.scale,
+        axis_sizes=np.array(policy.axis_sizes),
+        opponents=np.array(policy.opponents),
+        **{f"weights_{layer}": w for layer, w in enumerate(policy.weights)},
+        **{f"biases_{layer}": b for layer, b in enumerate(policy.biases)},
+    )
+
+
+def load_policy(path: str = MDPConfig.DISTILLED_POLICY) -> DistilledPolicy:
+    with np.load(path) as saved:
+        layers = sum(name.startswith("weights_") for name in saved.files)
+        return DistilledPolicy(
+            saved["mean"],
+            saved["scale"],
+            tuple(saved[f"weights_{layer}"] for layer in range(layers)),
+            tuple(saved[f"biases_{layer}"] for layer in range(layers)),
+            tuple(int(size) for size in saved["axis_sizes"]),  # type: ignore
+            int(saved["opponents"]),
+        )
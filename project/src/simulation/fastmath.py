@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from types import FunctionType
+from typing import TYPE_CHECKING
+from numba import njit
+from numba.core.registry import CPUDispatcher
+
+if TYPE_CHECKING:
+    from simulation.params import Params
+
+# every fastmath flag but nnan and ninf: rewards start from -inf, and
+# coincident agents give nan rather than raising (see calculate_reward_scalars)
+FLAGS = {"reassoc", "contract", "arcp", "nsz", "afn"}
+
+# fastmath variants already built, by the kernel they were built from
+_variants: dict[CPUDispatcher, CPUDispatcher] = {}
+
+
+def fastmath_variant(kernel: CPUDispatcher) -> CPUDispatcher:
+    # kernel compiled with FLAGS, calling fastmath variants of the compiled
+    # functions it calls in turn, as fastmath applies per function. Variants
+    # are named after their kernel with a _fastmath suffix, so numba caches
+    # them apart from it
+    if kernel not in _variants:
+        function = kernel.py_func
+        namespace = dict(function.__globals__)
+        for name in function.__code__.co_names:
+            if isinstance(namespace.get(name), CPUDispatcher):
+                namespace[name] = fastmath_variant(namespace[name])
+        variant = FunctionType(
+            function.__code__,
+            namespace,
+            function.__name__,
+            function.__defaults__,
+            function.__closure__,
+        )
+        variant.__qualname__ = f"{function.__qualname__}_fastmath"
+        variant.__module__ = function.__module__
+        options = {
+            option: value
+            for option, value in kernel.targetoptions.items()
+            if option != "nopython"
+        }
+        _variants[kernel] = njit(**options, cache=True, fastmath=FLAGS)(variant)
+    return _variants[kernel]
+
+
+def kernel_for(kernel: CPUDispatcher, params: Params) -> CPUDispatcher:
+    # The kernel itself, or its fastmath variant if params say so
+    return fastmath_variant(kernel) if params.fastmath else kernel
@@ -0,0 +1,555 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+import numba
+import numpy as np
+import numpy.typing as npt
+from numba import njit, prange
+
+if TYPE_CHECKING:
+    from simulation.params import Params
+    from simulation.simulation import Vectors, Scalars
+
+
+def set_threads(threads: int = 0) -> int:
+    # Threads the parallel kernels use from the calling thread on, capped at
+    # NUMBA_NUM_THREADS (the pool size, fixed once numba starts), 0 for all of
+    # them. Returns the count actually set
+    limit = numba.config.NUMBA_NUM_THREADS
+    threads = limit if threads <= 0 else min(threads, limit)
+    numba.set_num_threads(threads)
+    return threads
+
+
+@njit(cache=True)
+def velocity_angles_scalars_to_vectors(
+    velocities: Scalars, flight_path_angles: Scalars, azimuth_angles: Scalars
+) -> Vectors:
+    vx = velocities * np.cos(flight_path_angles) * np.cos(azimuth_angles)
+    vy = velocities * np.cos(flight_path_angles) * np.sin(azimuth_angles)
+    vz = velocities * np.sin(flight_path_angles)
+
+    return np.stack((vx, vy, vz), axis=-1)
+
+
+@njit(cache=True)
+def step_agent(
+    x: float,
+    y: float,
+    z: float,
+    velocity: float,
+    attack_angle: float,
+    flight_path_angle: float,
+    roll_angle: float,
+    azimuth_angle: float,
+    thrust: float,
+    attack_angle_rate: float,
+    roll_angle_rate: float,
+    velocity_min: float,
+    velocity_max: float,
+    azimuth_rate_min: float,
+    azimuth_rate_max: float,
+    attack_angle_min: float,
+    attack_angle_max: float,
+    params: Params,
+) -> tuple[float, float, float, float, float, float, float, float, float, float, float]:
+    # One agent, one step: step_agents on scalars, so a thread can integrate an
+    # agent for many steps without touching shared arrays. Returns position,
+    # velocity vector, then the new speed and angles, integrated by the scheme
+    # params.integrator picks from INTEGRATORS
+    if params.integrator == 0:
+        return step_agent_semi_implicit(
+            x,
+            y,
+            z,
+            velocity,
+            attack_angle,
+            flight_path_angle,
+            roll_angle,
+            azimuth_angle,
+            thrust,
+            attack_angle_rate,
+            roll_angle_rate,
+            velocity_min,
+            velocity_max,
+            azimuth_rate_min,
+            azimuth_rate_max,
+            attack_angle_min,
+            attack_angle_max,
+            params,
+        )
+    return step_agent_runge_kutta(
+        x,
+        y,
+        z,
+        velocity,
+        attack_angle,
+        flight_path_angle,
+        roll_angle,
+        azimuth_angle,
+        thrust,
+        attack_angle_rate,
+        roll_angle_rate,
+        velocity_min,
+        velocity_max,
+        azimuth_rate_min,
+        azimuth_rate_max,
+        attack_angle_min,
+        attack_angle_max,
+        2 if params.integrator == 1 else 4,
+        params,
+    )
+
+
+@njit(cache=True)
+def step_agent_semi_implicit(
+    x: float,
+    y: float,
+    z: float,
+    velocity: float,
+    attack_angle: float,
+    flight_path_angle: float,
+    roll_angle: float,
+    azimuth_angle: float,
+    thrust: float,
+    attack_angle_rate: float,
+    roll_angle_rate: float,
+    velocity_min: float,
+    velocity_max: float,
+    azimuth_rate_min: float,
+    azimuth_rate_max: float,
+    attack_angle_min: float,
+    attack_angle_max: float,
+    params: Params,
+) -> tuple[float, float, float, float, float, float, float, float, float, float, float]:
+    # Semi-implicit Euler: each quantity is stepped from those already stepped,
+    # attack and roll angle, then speed, flight path angle, azimuth and position
+    dt = params.dt
+    g = params.g
+    attack_angle = min(
+        max(attack_angle + attack_angle_rate * dt, attack_angle_min), attack_angle_max
+    )
+    roll_angle = roll_angle + roll_angle_rate * dt
+
+    # Change 1: Calculate how many 'Gs' the plane can actually pull at this speed
+    # (This stops the "infinite turn" bug at low speeds)
+    v_ratio = velocity / params.corner_velocity
+    max_g_at_speed = min(params.max_gs, params.max_gs * (v_ratio**2))
+
+    # Change 2: Redefine nf as the actual G-load being pulled
+    # Your 'attack_angles' now acts as a 0.0 to 1.0 multiplier for those Gs
+    nf = attack_angle * max_g_at_speed
+
+    # Change 3: Update velocity rate to include "Turn Drag" (Induced Drag)
+    # This makes the agent lose speed when it turns hard
+    turn_drag = params.k_drag * (nf**2)
+    velocity_rate = g * (thrust - turn_drag - np.sin(flight_path_angle))
+
+    velocity = min(max(velocity + velocity_rate * dt, velocity_min), velocity_max)
+
+    flight_path_angle_rate = (g / velocity) * (
+        nf * np.cos(roll_angle) - np.cos(flight_path_angle)
+    )
+    flight_path_angle = min(
+        max(flight_path_angle + flight_path_angle_rate * dt, -1.4), 1.4
+    )
+
+    azimuth_angle_rate = min(
+        max(
+            (g * nf * np.sin(roll_angle))
+            / (velocity * max(np.cos(flight_path_angle), 1e-3)),
+            azimuth_rate_min,
+        ),
+        azimuth_rate_max,
+    )
+    azimuth_angle = azimuth_angle + azimuth_angle_rate * dt
+
+    vx = velocity * np.cos(flight_path_angle) * np.cos(azimuth_angle)
+    vy = velocity * np.cos(flight_path_angle) * np.sin(azimuth_angle)
+    vz = velocity * np.sin(flight_path_angle)
+
+    return (
+        x + vx * dt,
+        y + vy * dt,
+        z + vz * dt,
+        vx,
+        vy,
+        vz,
+        velocity,
+        attack_angle,
+        flight_path_angle,
+        roll_angle,
+        azimuth_angle,
+    )
+
+
+@njit(cache=True)
+def agent_rates(
+    velocity: float,
+    attack_angle: float,
+    flight_path_angle: float,
+    roll_angle: float,
+    azimuth_angle: float,
+    thrust: float,
+    azimuth_rate_min: float,
+    azimuth_rate_max: float,
+    params: Params,
+) -> tuple[float, float, float, float, float, float]:
+    # Rates of change of speed, flight path angle and azimuth, and the velocity
+    # vector, the same dynamics step_agent_semi_implicit steps
+    g = params.g
+    v_ratio = velocity / params.corner_velocity
+    nf = attack_angle * min(params.max_gs, params.max_gs * (v_ratio**2))
+    velocity_rate = g * (thrust - params.k_drag * (nf**2) - np.sin(flight_path_angle))
+    flight_path_angle_rate = (g / velocity) * (
+        nf * np.cos(roll_angle) - np.cos(flight_path_angle)
+    )
+    azimuth_angle_rate = min(
+        max(
+            (g * nf * np.sin(roll_angle))
+            / (velocity * max(np.cos(flight_path_angle), 1e-3)),
+            azimuth_rate_min,
+        ),
+        azimuth_rate_max,
+    )
+    return (
+        velocity_rate,
+        flight_path_angle_rate,
+        azimuth_angle_rate,
+        velocity * np.cos(flight_path_angle) * np.cos(azimuth_angle),
+        velocity * np.cos(flight_path_angle) * np.sin(azimuth_angle),
+        velocity * np.sin(flight_path_angle),
+    )
+
+
+@njit(cache=True)
+def step_agent_runge_kutta(
+    x: float,
+    y: float,
+    z: float,
+    velocity: float,
+    attack_angle: float,
+    flight_path_angle: float,
+    roll_angle: float,
+    azimuth_angle: float,
+    thrust: float,
+    attack_angle_rate: float,
+    roll_angle_rate: float,
+    velocity_min: float,
+    velocity_max: float,
+    azimuth_rate_min: float,
+    azimuth_rate_max: float,
+    attack_angle_min: float,
+    attack_angle_max: float,
+    order: int,
+    params: Params,
+) -> tuple[float, float, float, float, float, float, float, float, float, float, float]:
+    # Midpoint (order 2) or classic (order 4) Runge-Kutta. Attack and roll
+    # angles follow their rates exactly, and every stage and the result clip
+    # attack angle, speed and flight path angle as the semi-implicit step does
+    dt = params.dt
+    stages = 2 if order == 2 else 4
+
+    sum_velocity = sum_flight_path = sum_azimuth = 0.0
+    sum_x = sum_y = sum_z = 0.0
+    k_velocity = k_flight_path = k_azimuth = 0.0
+    k_x = k_y = k_z = 0.0
+    for stage in range(stages):
+        # stage times and weights: midpoint (0, 1/2), (0, 1); classic RK4
+        # (0, 1/2, 1/2, 1), (1/6, 1/3, 1/3, 1/6)
+        if stage == 0:
+            c = 0.0
+        elif stage == stages - 1 and order == 4:
+            c = 1.0
+        else:
+            c = 0.5
+        if order == 2:
+            b = 0.0 if stage == 0 else 1.0
+        else:
+            b = 1.0 / 6.0 if stage == 0 or stage == 3 else 1.0 / 3.0
+
+        (
+            k_velocity,
+            k_flight_path,
+            k_azimuth,
+            k_x,
+            k_y,
+            k_z,
+        ) = agent_rates(
+            min(max(velocity + c * dt * k_velocity, velocity_min), velocity_max),
+            min(
+                max(attack_angle + attack_angle_rate * c * dt, attack_angle_min),
+                attack_angle_max,
+            ),
+            min(max(flight_path_angle + c * dt * k_flight_path, -1.4), 1.4),
+            roll_angle + roll_angle_rate * c * dt,
+            azimuth_angle + c * dt * k_azimuth,
+            thrust,
+            azimuth_rate_min,
+            azimuth_rate_max,
+            params,
+        )
+        sum_velocity += b * k_velocity
+        sum_flight_path += b * k_flight_path
+        sum_azimuth += b * k_azimuth
+        sum_x += b * k_x
+        sum_y += b * k_y
+        sum_z += b * k_z
+
+    velocity = min(max(velocity + dt * sum_velocity, velocity_min), velocity_max)
+    flight_path_angle = min(max(flight_path_angle + dt * sum_flight_path, -1.4), 1.4)
+    azimuth_angle = azimuth_angle + dt * sum_azimuth
+    attack_angle = min(
+        max(attack_angle + attack_angle_rate * dt, attack_angle_min), attack_angle_max
+    )
+    roll_angle = roll_angle + roll_angle_rate * dt
+
+    return (
+        x + dt * sum_x,
+        y + dt * sum_y,
+        z + dt * sum_z,
+        velocity * np.cos(flight_path_angle) * np.cos(azimuth_angle),
+        velocity * np.cos(flight_path_angle) * np.sin(azimuth_angle),
+        velocity * np.sin(flight_path_angle),
+        velocity,
+        attack_angle,
+        flight_path_angle,
+        roll_angle,
+        azimuth_angle,
+    )
+
+
+@njit(cache=True, parallel=True)
+def integrate_into(
+    steps: int,
+    agents: npt.NDArray[np.bool_],
+    positions: Vectors,
+    velocities: Scalars,
+    attack_angles: Scalars,
+    flight_path_angles: Scalars,
+    roll_angles: Scalars,
+    azimuth_angles: Scalars,
+    thrusts: Scalars,
+    attack_angle_rates: Scalars,
+    roll_angle_rates: Scalars,
+    velocity_mins: Scalars,
+    velocity_maxs: Scalars,
+    azimuth_rate_mins: Scalars,
+    azimuth_rate_maxs: Scalars,
+    attack_angle_mins: Scalars,
+    attack_angle_maxs: Scalars,
+    out_positions: Vectors,
+    out_velocities_vectors: Vectors,
+    out_velocities: Scalars,
+    out_attack_angles: Scalars,
+    out_flight_path_angles: Scalars,
+    out_roll_angles: Scalars,
+    out_azimuth_angles: Scalars,
+    params: Params,
+) -> None:
+    # Integrates the agents in the mask for steps steps, writing their final
+    # state into the out arrays and leaving everyone else's untouched. An agent
+    # is read before it is written, so out arrays may be the state arrays
+    # themselves to step in place. Agents are independent within a step, so
+    # threads split the agents and each runs its agents' timesteps serially
+    for i in prange(agents.shape[0]):
+        if not agents[i]:
+            continue
+        x, y, z = positions[i, 0], positions[i, 1], positions[i, 2]
+        vx, vy, vz = 0.0, 0.0, 0.0
+        velocity = velocities[i]
+        attack_angle = attack_angles[i]
+        flight_path_angle = flight_path_angles[i]
+        roll_angle = roll_angles[i]
+        azimuth_angle = azimuth_angles[i]
+        for _ in range(steps):
+            (
+                x,
+                y,
+                z,
+                vx,
+                vy,
+                vz,
+                velocity,
+                attack_angle,
+                flight_path_angle,
+                roll_angle,
+                azimuth_angle,
+            ) = step_agent(
+                x,
+                y,
+                z,
+                velocity,
+                attack_angle,
+                flight_path_angle,
+                roll_angle,
+                azimuth_angle,
+                thrusts[i],
+                attack_angle_rates[i],
+                roll_angle_rates[i],
+                velocity_mins[i],
+                velocity_maxs[i],
+                azimuth_rate_mins[i],
+                azimuth_rate_maxs[i],
+                attack_angle_mins[i],
+                attack_angle_maxs[i],
+                params,
+            )
+
+        out_positions[i, 0], out_positions[i, 1], out_positions[i, 2] = x, y, z
+        out_velocities_vectors[i, 0] = vx
+        out_velocities_vectors[i, 1] = vy
+        out_velocities_vectors[i, 2] = vz
+        out_velocities[i] = velocity
+        out_attack_angles[i] = attack_angle
+        out_flight_path_angles[i] = flight_path_angle
+        out_roll_angles[i] = roll_angle
+        out_azimuth_angles[i] = azimuth_angle
+
+
+def integrate(
+    steps: int,
+    positions: Vectors,
+    velocities: Scalars,
+    attack_angles: Scalars,
+    flight_path_angles: Scalars,
+    roll_angles: Scalars,
+    azimuth_angles: Scalars,
+    thrusts: Scalars,
+    attack_angle_rates: Scalars,
+    roll_angle_rates: Scalars,
+    velocity_mins: Scalars,
+    velocity_maxs: Scalars,
+    azimuth_rate_mins: Scalars,
+    azimuth_rate_maxs: Scalars,
+    attack_angle_mins: Scalars,
+    attack_angle_maxs: Scalars,
+    params: Params,
+) -> tuple[Vectors, Vectors, Scalars, Scalars, Scalars, Scalars, Scalars]:
+    # integrate_into fresh arrays for every agent. Plain Python, like the
+    # other allocating wrappers around parallel kernels: numba crashes loading
+    # a cached kernel that calls a parallel one
+    new_positions = positions.copy()
+    velocities_vectors = np.zeros_like(positions, dtype=np.float64)
+    new_velocities = velocities.copy()
+    new_attack_angles = attack_angles.copy()
+    new_flight_path_angles = flight_path_angles.copy()
+    new_roll_angles = roll_angles.copy()
+    new_azimuth_angles = azimuth_angles.copy()
+
+    integrate_into(
+        steps,
+        np.ones(positions.shape[0], dtype=np.bool_),
+        positions,
+        velocities,
+        attack_angles,
+        flight_path_angles,
+        roll_angles,
+        azimuth_angles,
+        thrusts,
+        attack_angle_rates,
+        roll_angle_rates,
+        velocity_mins,
+        velocity_maxs,
+        azimuth_rate_mins,
+        azimuth_rate_maxs,
+        attack_angle_mins,
+        attack_angle_maxs,
+        new_positions,
+        velocities_vectors,
+        new_velocities,
+        new_attack_angles,
+        new_flight_path_angles,
+        new_roll_angles,
+        new_azimuth_angles,
+        params,
+    )
+
+    return (
+        new_positions,
+        velocities_vectors,
+        new_velocities,
+        new_attack_angles,
+        new_flight_path_angles,
+        new_roll_angles,
+        new_azimuth_angles,
+    )
+
+
+def step_agents(
+    positions: Vectors,
+    velocities: Scalars,
+    attack_angles: Scalars,
+    flight_path_angles: Scalars,
+    roll_angles: Scalars,
+    azimuth_angles: Scalars,
+    thrusts: Scalars,
+    attack_angle_rates: Scalars,
+    roll_angle_rates: Scalars,
+    velocity_mins: Scalars,
+    velocity_maxs: Scalars,
+    azimuth_rate_mins: Scalars,
+    azimuth_rate_maxs: Scalars,
+    attack_angle_mins: Scalars,
+    attack_angle_maxs: Scalars,
+    params: Params,
+) -> tuple[Vectors, Vectors, Scalars, Scalars, Scalars, Scalars, Scalars]:
+    return integrate(
+        1,
+        positions,
+        velocities,
+        attack_angles,
+        flight_path_angles,
+        roll_angles,
+        azimuth_angles,
+        thrusts,
+        attack_angle_rates,
+        roll_angle_rates,
+        velocity_mins,
+        velocity_maxs,
+        azimuth_rate_mins,
+        azimuth_rate_maxs,
+        attack_angle_mins,
+        attack_angle_maxs,
+        params,
+    )
+
+
+def forward_project(
+    steps: int,
+    positions: Vectors,
+    velocities: Scalars,
+    attack_angles: Scalars,
+    flight_path_angles: Scalars,
+    roll_angles: Scalars,
+    azimuth_angles: Scalars,
+    thrusts: Scalars,
+    attack_angle_rates: Scalars,
+    roll_angle_rates: Scalars,
+    velocity_mins: Scalars,
+    velocity_maxs: Scalars,
+    azimuth_rate_mins: Scalars,
+    azimuth_rate_maxs: Scalars,
+    attack_angle_mins: Scalars,
+    attack_angle_maxs: Scalars,
+    params: Params,
+) -> tuple[Vectors, Vectors, Scalars, Scalars, Scalars, Scalars, Scalars]:
+    return integrate(
+        steps,
+        positions,
+        velocities,
+        attack_angles,
+        flight_path_angles,
+        roll_angles,
+        azimuth_angles,
+        thrusts,
+        attack_angle_rates,
+        roll_angle_rates,
+        velocity_mins,
+        velocity_maxs,
+        azimuth_rate_mins,
+        azimuth_rate_maxs,
+        attack_angle_mins,
+        attack_angle_maxs,
+        params,
+    )
@@ -1,17 +1,59 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, NamedTuple
 import numpy as np
 from numpy.typing import NDArray
-from numba import njit
+from numba import njit, prange
 
 from configs import mdp as MDPConfig
-from configs import simulation as SimulationConfig
+from simulation.kinematics import step_agent
+from simulation.params import action_table, configured_params
+from simulation.primitives import (
+    MotionPrimitives,
+    no_primitives,
+    primitive_cell,
+    primitive_motion,
+)
+from simulation.spatial import nearest_neighbours, range_steps
 
 if TYPE_CHECKING:
+    from simulation.params import Params
     from simulation.simulation import Vectors, Scalars, Vector
 
 
 type Action = NDArray[np.float64]
+type Actions = NDArray[np.float64]
+type Mask = NDArray[np.bool_]
+type Indices = NDArray[np.int64]
+type Opponents = NDArray[np.int64]
+
+
+class PlannerState(NamedTuple):
+    # per-agent state the planners keep between decisions, updated in place by
+    # find_actions_into
+
+    # random stream state for planners that sample, see next_uniform
+    seeds: NDArray[np.uint64]
+    # the warm-start planner's last action, as indices into the three action
+    # axes (-1 before the first), its reward and decisions since a full scan
+    previous: NDArray[np.int64]
+    previous_rewards: NDArray[np.float64]
+    since_rescan: NDArray[np.int64]
+    # decisions the warm-start planner took from the local search, and those
+    # that scanned the whole grid
+    hits: NDArray[np.int64]
+    rescans: NDArray[np.int64]
+
+
+class PlannerScratch(NamedTuple):
+    # per-agent rows the planners work in within a decision, see planner_scratch
+
+    # the cross-entropy search's action box (low, high) and distribution
+    # (mean, spread) on each axis, its samples this round, their rewards, and
+    # the best of them in ascending order of reward
+    boxes: NDArray[np.float64]
+    candidates: NDArray[np.float64]
+    scores: NDArray[np.float64]
+    elites: NDArray[np.int64]
 
 
 class MDP:
@@ -40,6 +82,7 @@ class MDP:
         attack_angle_maxs: Scalars,
     ):
         self.i = i
+        self.params = configured_params()
         self.actions: NDArray[np.float64] = np.array(
             [
                 [
@@ -75,54 +118,36 @@ class MDP:
         self.attack_angle_maxs = attack_angle_maxs
 
     def find_action(self) -> Action:
-        from simulation.simulation import forward_project
+        N = self.positions.shape[0]
+        active = np.zeros(N, dtype=np.bool_)
+        active[self.i] = True
 
-        # Exclude self from other agents
-        other_projected_positions = np.delete(self.projected_positions, self.i, axis=0)
-        other_projected_velocities = np.delete(
-            self.projected_velocities, self.i, axis=0
-        )
-
-        # Forward project self agent for each actions
-        num_actions = self.actions.shape[0]
-        rewards = np.zeros(num_actions)
-        for i in range(num_actions):
-            # Choose action
-            action = self.actions[i]
-
-            # Project self agent forward with that action
-            results = forward_project(
-                MDPConfig.FORWARD_PROJECTION_STEPS,
-                self.positions[self.i : self.i + 1],
-                self.velocities[self.i : self.i + 1],
-                self.attack_angles[self.i : self.i + 1],
-                self.flight_path_angles[self.i : self.i + 1],
-                self.roll_angles[self.i : self.i + 1],
-                self.azimuth_angles[self.i : self.i + 1],
-                action[0:1],
-                action[1:2],
-                action[2:3],
-                self.velocity_mins[self.i : self.i + 1],
-                self.velocity_maxs[self.i : self.i + 1],
-                self.azimuth_rate_mins[self.i : self.i + 1],
-                self.azimuth_rate_maxs[self.i : self.i + 1],
-                self.attack_angle_mins[self.i : self.i + 1],
-                self.attack_angle_maxs[self.i : self.i + 1],
-            )
-            self_projected_position = results[0][0]
-            self_projected_velocity = results[1][0]
-
-            # Calculate reward from resulting position
-            rewards[i] = self.calculate_reward(
-                self_projected_position,
-                self_projected_velocity,
-                other_projected_positions,
-                other_projected_velocities,
-            )
-
-        # Choose best action
-        best_action = self.actions[np.argmax(rewards)]
-        return best_action
+        # self.actions already has this agent's ratios applied
+        return find_actions(
+            np.ones((N, 3), dtype=np.float64),
+            self.positions,
+            self.velocities,
+            self.attack_angles,
+            self.flight_path_angles,
+            self.roll_angles,
+            self.azimuth_angles,
+            self.projected_positions,
+            self.projected_velocities,
+            find_opponents(
+                self.projected_positions,
+                self.params.nearest_opponents,
+                np.zeros(N, dtype=np.int64),
+            ),
+            self.velocity_mins,
+            self.velocity_maxs,
+            self.azimuth_rate_mins,
+            self.azimuth_rate_maxs,
+            self.attack_angle_mins,
+            self.attack_angle_maxs,
+            active,
+            # self.actions is a table rather than a product of axes
+            self.params._replace(actions=self.actions, planner=0),
+        )[self.i]
 
     def calculate_reward(
         self,
@@ -131,24 +156,1005 @@ class MDP:
         other_positions: Vectors,
         other_velocities: Vectors,
     ) -> float:
-        best_positive_reward = positive_maximum(
-            self_position, self_velocity, other_positions, other_velocities
+        return calculate_reward(
+            self_position,
+            self_velocity,
+            other_positions,
+            other_velocities,
+            np.arange(other_positions.shape[0]),
+            self.params,
         )
-        best_negative_reward = negative_maximum(
-            self_position, other_positions, other_velocities
+
+    def hard_deck_penalty(self, z: float) -> float:
+        return hard_deck_penalty(z, self.params)
+
+
+def find_opponents(
+    projected_positions: Vectors,
+    k: int,
+    groups: Indices,
+    table: Opponents | None = None,
+    live: Mask | None = None,
+) -> Opponents:
+    # Row i lists the agents agent i is scored against, -1 padded: every other
+    # live agent in its group (episode), or with k > 0 only its k nearest by
+    # projected position. Every agent is live unless live says otherwise, and
+    # table is group_opponents(groups, live) when the caller keeps it between
+    # steps; it is only built when every opponent is scored
+    if live is None:
+        live = np.ones(projected_positions.shape[0], dtype=np.bool_)
+    if scores_nearest(k, groups, live):
+        return nearest_neighbours(projected_positions, live, groups, k)
+    return group_opponents(groups, live) if table is None else table
+
+
+def scores_nearest(k: int, groups: Indices, live: Mask) -> bool:
+    # Whether find_opponents lists only the k nearest opponents, as k > 0 is
+    # fewer than the most opponents any live agent has
+    return 0 < k < np.bincount(groups[live], minlength=1).max() - 1
+
+
+@njit(cache=True)
+def group_opponents(groups: Indices, live: Mask) -> Opponents:
+    # Row i lists the other live agents in live agent i's group, -1 padded to
+    # the largest group's live agents, so captured agents drop out and the
+    # table narrows as groups thin out
+    N = groups.shape[0]
+    order = np.argsort(groups, kind="mergesort")
+    order = order[live[order]]
+    sizes = np.bincount(groups[order], minlength=groups.max() + 1)
+    opponents = np.full((N, max(sizes.max() - 1, 0)), -1, dtype=np.int64)
+
+    start = 0
+    for size in sizes:
+        members = order[start : start + size]
+        for a in range(size):
+            column = 0
+            for b in range(size):
+                if a != b:
+                    opponents[members[a], column] = members[b]
+                    column += 1
+        start += size
+    return opponents
+
+
+@njit(cache=True)
+def drop_opponents(opponents: Opponents, groups: Indices, dropped: Mask) -> None:
+    # Removes the dropped agents from a group_opponents table in place, both as
+    # opponents, the rest keeping their order and -1 padding, and as rows,
+    # which are emptied. Only rows in groups that lost an agent are touched
+    lost = np.zeros(groups.max() + 1, dtype=np.bool_)
+    for i in range(groups.shape[0]):
+        if dropped[i]:
+            lost[groups[i]] = True
+    for i in range(opponents.shape[0]):
+        if not lost[groups[i]]:
+            continue
+        kept = 0
+        for column in range(opponents.shape[1]):
+            j = opponents[i, column]
+            if j < 0:
+                break
+            if not dropped[i] and not dropped[j]:
+                opponents[i, kept] = j
+                kept += 1
+        for column in range(kept, opponents.shape[1]):
+            if opponents[i, column] < 0:
+                break
+            opponents[i, column] = -1
+
+
+def find_actions(
+    action_ratios: Vectors,
+    positions: Vectors,
+    velocities: Scalars,
+    attack_angles: Scalars,
+    flight_path_angles: Scalars,
+    roll_angles: Scalars,
+    azimuth_angles: Scalars,
+    projected_positions: Vectors,
+    projected_velocities: Vectors,
+    opponents: Opponents,
+    velocity_mins: Scalars,
+    velocity_maxs: Scalars,
+    azimuth_rate_mins: Scalars,
+    azimuth_rate_maxs: Scalars,
+    attack_angle_mins: Scalars,
+    attack_angle_maxs: Scalars,
+    active: Mask,
+    params: Params,
+    primitives: MotionPrimitives | None = None,
+) -> Actions:
+    # find_actions_into fresh arrays, plain Python as kinematics.integrate is
+    N = positions.shape[0]
+    best_actions = np.zeros((N, 3), dtype=np.float64)
+    projected_directions = np.empty((N, 3), dtype=np.float64)
+    unit_vectors_into(projected_velocities, projected_directions)
+    find_actions_into(
+        action_ratios,
+        positions,
+        velocities,
+        attack_angles,
+        flight_path_angles,
+        roll_angles,
+        azimuth_angles,
+        projected_positions,
+        projected_directions,
+        opponents,
+        velocity_mins,
+        velocity_maxs,
+        azimuth_rate_mins,
+        azimuth_rate_maxs,
+        attack_angle_mins,
+        attack_angle_maxs,
+        active,
+        best_actions,
+        np.zeros(N, dtype=np.float64),
+        np.zeros(N, dtype=np.int64),
+        seed_planner_state(N, params.seed),
+        planner_scratch(N, max(params.cem_samples, 1)),
+        no_primitives(N) if primitives is None else primitives,
+        params,
+    )
+    return best_actions
+
+
+@njit(cache=True, parallel=True)
+def find_actions_into(
+    action_ratios: Vectors,
+    positions: Vectors,
+    velocities: Scalars,
+    attack_angles: Scalars,
+    flight_path_angles: Scalars,
+    roll_angles: Scalars,
+    azimuth_angles: Scalars,
+    projected_positions: Vectors,
+    projected_directions: Vectors,
+    opponents: Opponents,
+    velocity_mins: Scalars,
+    velocity_maxs: Scalars,
+    azimuth_rate_mins: Scalars,
+    azimuth_rate_maxs: Scalars,
+    attack_angle_mins: Scalars,
+    attack_angle_maxs: Scalars,
+    active: Mask,
+    out: Actions,
+    rewards: Scalars,
+    evaluations: Indices,
+    planner_state: PlannerState,
+    scratch: PlannerScratch,
+    primitives: MotionPrimitives,
+    params: Params,
+) -> None:
+    # Writes each active agent's best action into out, with its reward and how
+    # many actions the planner scored to find it, and zeros for the rest, with
+    # grid actions looked up in the motion primitives if params say so.
+    # scratch holds at least cem_samples samples if the planner is "cem".
+    # Opponents' projected velocities come as unit vectors (unit_vectors_into),
+    # so every action scored reuses them. Deciding agents are independent, so
+    # threads split them
+    state = (
+        positions,
+        velocities,
+        attack_angles,
+        flight_path_angles,
+        roll_angles,
+        azimuth_angles,
+    )
+    bounds = (
+        velocity_mins,
+        velocity_maxs,
+        azimuth_rate_mins,
+        azimuth_rate_maxs,
+        attack_angle_mins,
+        attack_angle_maxs,
+    )
+
+    for i in prange(positions.shape[0]):
+        if not active[i]:
+            out[i, 0], out[i, 1], out[i, 2] = 0.0, 0.0, 0.0
+            rewards[i], evaluations[i] = 0.0, 0
+            continue
+        cell = primitive_cell(
+            i,
+            velocities[i],
+            attack_angles[i],
+            flight_path_angles[i],
+            roll_angles[i],
+            azimuth_angles[i],
+            primitives,
+            params,
         )
+        if params.planner == 1:
+            rewards[i], evaluations[i] = search_coarse_to_fine(
+                i,
+                action_ratios,
+                state,
+                bounds,
+                cell,
+                primitives,
+                projected_positions,
+                projected_directions,
+                opponents[i],
+                out,
+                params,
+            )
+        elif params.planner == 2:
+            rewards[i], evaluations[i] = search_cem(
+                i,
+                action_ratios,
+                state,
+                bounds,
+                cell,
+                primitives,
+                projected_positions,
+                projected_directions,
+                opponents[i],
+                out,
+                planner_state.seeds,
+                scratch,
+                params,
+            )
+        elif params.planner == 3:
+            rewards[i], evaluations[i] = search_warm_start(
+                i,
+                action_ratios,
+                state,
+                bounds,
+                cell,
+                primitives,
+                projected_positions,
+                projected_directions,
+                opponents[i],
+                out,
+                planner_state,
+                params,
+            )
+        else:
+            rewards[i], evaluations[i] = search_exhaustive(
+                i,
+                action_ratios,
+                state,
+                bounds,
+                cell,
+                primitives,
+                projected_positions,
+                projected_directions,
+                opponents[i],
+                out,
+                params,
+            )
 
-        total_reward = best_positive_reward - best_negative_reward
-        total_reward -= self.hard_deck_penalty(self_position[2])
-        return total_reward
 
-    def hard_deck_penalty(self, z: float) -> float:
-        hard_deck = SimulationConfig.HARD_DECK
-        if z <= hard_deck:
-            return SimulationConfig.PENALTY
-        return 0.0
+@njit(cache=True)
+def search_exhaustive(
+    i: int,
+    action_ratios: Vectors,
+    state: tuple,
+    bounds: tuple,
+    cell: tuple,
+    primitives: MotionPrimitives,
+    projected_positions: Vectors,
+    projected_directions: Vectors,
+    opponents: Indices,
+    out: Actions,
+    params: Params,
+) -> tuple[float, int]:
+    # Scores every action in params.actions, writing agent i's best into out
+    actions = params.actions
+    best = 0
+    best_reward = -np.inf
+    for a in range(actions.shape[0]):
+        reward = score_action(
+            i,
+            a,
+            actions[a, 0] * action_ratios[i, 0],
+            actions[a, 1] * action_ratios[i, 1],
+            actions[a, 2] * action_ratios[i, 2],
+            state,
+            bounds,
+            cell,
+            primitives,
+            projected_positions,
+            projected_directions,
+            opponents,
+            params,
+        )
+
+        # Same choice as np.argmax: the first maximum, or the first nan
+        if not np.isnan(best_reward) and (reward > best_reward or np.isnan(reward)):
+            best = a
+            best_reward = reward
+
+    for k in range(3):
+        out[i, k] = actions[best, k] * action_ratios[i, k]
+    return best_reward, actions.shape[0]
+
+
+@njit(cache=True)
+def search_coarse_to_fine(
+    i: int,
+    action_ratios: Vectors,
+    state: tuple,
+    bounds: tuple,
+    cell: tuple,
+    primitives: MotionPrimitives,
+    projected_positions: Vectors,
+    projected_directions: Vectors,
+    opponents: Indices,
+    out: Actions,
+    params: Params,
+) -> tuple[float, int]:
+    # Lattice search over indices into the three action axes: scores the middle
+    # action, then its 26 neighbours on a lattice a power of two grid steps apart
+    # along each axis, moves to the best and halves the spacing until it is
+    # refine_stride. Assumes the reward is smooth enough over the grid that the
+    # best action lies near the best lattice point
+    thrusts = params.action_thrusts
+    attack_angle_rates = params.action_attack_angle_rates
+    roll_angle_rates = params.action_roll_angle_rates
+    n0 = thrusts.shape[0]
+    n1 = attack_angle_rates.shape[0]
+    n2 = roll_angle_rates.shape[0]
+    refine_stride = max(params.refine_stride, 1)
+
+    s0, s1, s2 = 1, 1, 1
+    while 2 * s0 <= n0 // 2:
+        s0 *= 2
+    while 2 * s1 <= n1 // 2:
+        s1 *= 2
+    while 2 * s2 <= n2 // 2:
+        s2 *= 2
+
+    b0, b1, b2 = (n0 - 1) // 2, (n1 - 1) // 2, (n2 - 1) // 2
+    best_reward = score_action(
+        i,
+        (b0 * n1 + b1) * n2 + b2,
+        thrusts[b0] * action_ratios[i, 0],
+        attack_angle_rates[b1] * action_ratios[i, 1],
+        roll_angle_rates[b2] * action_ratios[i, 2],
+        state,
+        bounds,
+        cell,
+        primitives,
+        projected_positions,
+        projected_directions,
+        opponents,
+        params,
+    )
+    evaluations = 1
+
+    while True:
+        # the lattice is centred on the best action at the start of each level
+        c0, c1, c2 = b0, b1, b2
+        # neighbours past the edge of the grid are clipped to it, and skipped
+        # where that puts them back on the centre, so none is scored twice
+        for d0 in range(-1, 2):
+            j0 = min(max(c0 + d0 * s0, 0), n0 - 1)
+            if d0 != 0 and j0 == c0:
+                continue
+            for d1 in range(-1, 2):
+                j1 = min(max(c1 + d1 * s1, 0), n1 - 1)
+                if d1 != 0 and j1 == c1:
+                    continue
+                for d2 in range(-1, 2):
+                    j2 = min(max(c2 + d2 * s2, 0), n2 - 1)
+                    if d2 != 0 and j2 == c2:
+                        continue
+                    if d0 == 0 and d1 == 0 and d2 == 0:
+                        continue
+                    reward = score_action(
+                        i,
+                        (j0 * n1 + j1) * n2 + j2,
+                        thrusts[j0] * action_ratios[i, 0],
+                        attack_angle_rates[j1] * action_ratios[i, 1],
+                        roll_angle_rates[j2] * action_ratios[i, 2],
+                        state,
+                        bounds,
+                        cell,
+                        primitives,
+                        projected_positions,
+                        projected_directions,
+                        opponents,
+                        params,
+                    )
+                    evaluations += 1
+
+                    # the exhaustive search's rule, over the actions scored
+                    if not np.isnan(best_reward) and (
+                        reward > best_reward or np.isnan(reward)
+                    ):
+                        b0, b1, b2 = j0, j1, j2
+                        best_reward = reward
+
+        if s0 <= refine_stride and s1 <= refine_stride and s2 <= refine_stride:
+            break
+        s0, s1, s2 = max(s0 // 2, 1), max(s1 // 2, 1), max(s2 // 2, 1)
+
+    out[i, 0] = thrusts[b0] * action_ratios[i, 0]
+    out[i, 1] = attack_angle_rates[b1] * action_ratios[i, 1]
+    out[i, 2] = roll_angle_rates[b2] * action_ratios[i, 2]
+    return best_reward, evaluations
+
+
+@njit(cache=True)
+def search_cem(
+    i: int,
+    action_ratios: Vectors,
+    state: tuple,
+    bounds: tuple,
+    cell: tuple,
+    primitives: MotionPrimitives,
+    projected_positions: Vectors,
+    projected_directions: Vectors,
+    opponents: Indices,
+    out: Actions,
+    seeds: NDArray[np.uint64],
+    scratch: PlannerScratch,
+    params: Params,
+) -> tuple[float, int]:
+    # Cross-entropy search over the continuous box the action axes span: each
+    # round samples cem_samples actions from a normal distribution, clipped to
+    # the box, and refits the distribution to the best cem_elites of them. The
+    # best action sampled in any round is agent i's, so the cost is a fixed
+    # cem_iterations * cem_samples scores however fine the grid. Works in
+    # agent i's rows of scratch
+    axes = (
+        params.action_thrusts,
+        params.action_attack_angle_rates,
+        params.action_roll_angle_rates,
+    )
+    iterations = max(params.cem_iterations, 1)
+    samples = max(params.cem_samples, 1)
+    elites = min(max(params.cem_elites, 1), samples)
+
+    low, high, mean, spread = (
+        scratch.boxes[i, 0],
+        scratch.boxes[i, 1],
+        scratch.boxes[i, 2],
+        scratch.boxes[i, 3],
+    )
+    for k in range(3):
+        a = axes[k].min() * action_ratios[i, k]
+        b = axes[k].max() * action_ratios[i, k]
+        low[k], high[k] = min(a, b), max(a, b)
+        mean[k] = 0.5 * (low[k] + high[k])
+        spread[k] = 0.5 * (high[k] - low[k])
+
+    candidates = scratch.candidates[i]
+    scores = scratch.scores[i]
+    best = scratch.elites[i]
+    best_reward = -np.inf
+    for _ in range(iterations):
+        for c in range(samples):
+            for k in range(3):
+                candidates[c, k] = min(
+                    max(mean[k] + spread[k] * next_normal(seeds, i), low[k]),
+                    high[k],
+                )
+            scores[c] = score_action(
+                i,
+                -1,
+                candidates[c, 0],
+                candidates[c, 1],
+                candidates[c, 2],
+                state,
+                bounds,
+                cell,
+                primitives,
+                projected_positions,
+                projected_directions,
+                opponents,
+                params,
+            )
+
+            # the exhaustive search's rule, over the actions sampled
+            if not np.isnan(best_reward) and (
+                scores[c] > best_reward or np.isnan(scores[c])
+            ):
+                best_reward = scores[c]
+                out[i, 0], out[i, 1], out[i, 2] = (
+                    candidates[c, 0],
+                    candidates[c, 1],
+                    candidates[c, 2],
+                )
+
+        # keep the best elites in ascending order of reward, nans counting
+        # above everything as they do above, by insertion into best
+        kept = 0
+        for c in range(samples):
+            if kept == elites:
+                if not ranks_above(scores[c], scores[best[0]]):
+                    continue
+                for q in range(elites - 1):
+                    best[q] = best[q + 1]
+                kept -= 1
+            q = kept
+            while q > 0 and ranks_above(scores[best[q - 1]], scores[c]):
+                best[q] = best[q - 1]
+                q -= 1
+            best[q] = c
+            kept += 1
+
+        # refit to the elites, summing in that order
+        for k in range(3):
+            total = 0.0
+            for q in range(elites):
+                total += candidates[best[q], k]
+            mean[k] = total / elites
+            squares = 0.0
+            for q in range(elites):
+                deviation = candidates[best[q], k] - mean[k]
+                squares += deviation * deviation
+            spread[k] = (squares / elites) ** 0.5
+
+    return best_reward, iterations * samples
+
+
+@njit(cache=True)
+def search_warm_start(
+    i: int,
+    action_ratios: Vectors,
+    state: tuple,
+    bounds: tuple,
+    cell: tuple,
+    primitives: MotionPrimitives,
+    projected_positions: Vectors,
+    projected_directions: Vectors,
+    opponents: Indices,
+    out: Actions,
+    planner_state: PlannerState,
+    params: Params,
+) -> tuple[float, int]:
+    # Scores the grid actions within local_radius grid steps of agent i's last
+    # action, falling back to the whole grid for its first decision, every
+    # rescan_interval decisions, or when the best local reward has fallen more
+    # than rescan_drop of the last reward's magnitude below it
+    n0 = params.action_thrusts.shape[0]
+    n1 = params.action_attack_angle_rates.shape[0]
+    n2 = params.action_roll_angle_rates.shape[0]
+    p0, p1, p2 = (
+        planner_state.previous[i, 0],
+        planner_state.previous[i, 1],
+        planner_state.previous[i, 2],
+    )
+
+    rescan = p0 < 0 or planner_state.since_rescan[i] + 1 >= params.rescan_interval
+    evaluations = 0
+    if not rescan:
+        r = params.local_radius
+        best_reward, b0, b1, b2, evaluations = search_grid(
+            i,
+            action_ratios,
+            state,
+            bounds,
+            cell,
+            primitives,
+            projected_positions,
+            projected_directions,
+            opponents,
+            max(p0 - r, 0),
+            min(p0 + r, n0 - 1),
+            max(p1 - r, 0),
+            min(p1 + r, n1 - 1),
+            max(p2 - r, 0),
+            min(p2 + r, n2 - 1),
+            params,
+        )
+        previous_reward = planner_state.previous_rewards[i]
+        rescan = previous_reward - best_reward > params.rescan_drop * abs(
+            previous_reward
+        )
+
+    if rescan:
+        best_reward, b0, b1, b2, scanned = search_grid(
+            i,
+            action_ratios,
+            state,
+            bounds,
+            cell,
+            primitives,
+            projected_positions,
+            projected_directions,
+            opponents,
+            0,
+            n0 - 1,
+            0,
+            n1 - 1,
+            0,
+            n2 - 1,
+            params,
+        )
+        evaluations += scanned
+        planner_state.since_rescan[i] = 0
+        planner_state.rescans[i] += 1
+    else:
+        planner_state.since_rescan[i] += 1
+        planner_state.hits[i] += 1
+
+    planner_state.previous[i, 0] = b0
+    planner_state.previous[i, 1] = b1
+    planner_state.previous[i, 2] = b2
+    planner_state.previous_rewards[i] = best_reward
+    out[i, 0] = params.action_thrusts[b0] * action_ratios[i, 0]
+    out[i, 1] = params.action_attack_angle_rates[b1] * action_ratios[i, 1]
+    out[i, 2] = params.action_roll_angle_rates[b2] * action_ratios[i, 2]
+    return best_reward, evaluations
+
+
+@njit(cache=True)
+def search_grid(
+    i: int,
+    action_ratios: Vectors,
+    state: tuple,
+    bounds: tuple,
+    cell: tuple,
+    primitives: MotionPrimitives,
+    projected_positions: Vectors,
+    projected_directions: Vectors,
+    opponents: Indices,
+    low0: int,
+    high0: int,
+    low1: int,
+    high1: int,
+    low2: int,
+    high2: int,
+    params: Params,
+) -> tuple[float, int, int, int, int]:
+    # Scores every action whose axis indices lie in the given inclusive ranges,
+    # in action_table order, returning the best reward, its indices and the
+    # number scored. Over the whole grid this picks what search_exhaustive does
+    n1 = params.action_attack_angle_rates.shape[0]
+    n2 = params.action_roll_angle_rates.shape[0]
+    best_reward = -np.inf
+    b0, b1, b2 = low0, low1, low2
+    for j0 in range(low0, high0 + 1):
+        for j1 in range(low1, high1 + 1):
+            for j2 in range(low2, high2 + 1):
+                reward = score_action(
+                    i,
+                    (j0 * n1 + j1) * n2 + j2,
+                    params.action_thrusts[j0] * action_ratios[i, 0],
+                    params.action_attack_angle_rates[j1] * action_ratios[i, 1],
+                    params.action_roll_angle_rates[j2] * action_ratios[i, 2],
+                    state,
+                    bounds,
+                    cell,
+                    primitives,
+                    projected_positions,
+                    projected_directions,
+                    opponents,
+                    params,
+                )
+                if not np.isnan(best_reward) and (
+                    reward > best_reward or np.isnan(reward)
+                ):
+                    b0, b1, b2 = j0, j1, j2
+                    best_reward = reward
+    evaluations = (high0 - low0 + 1) * (high1 - low1 + 1) * (high2 - low2 + 1)
+    return best_reward, b0, b1, b2, evaluations
+
+
+@njit(cache=True)
+def seed_planner_state(N: int, seed: int) -> PlannerState:
+    # independent random streams for N agents from one seed, and no agent
+    # having decided yet
+    seeds = np.empty(N, dtype=np.uint64)
+    for i in range(N):
+        seeds[i] = np.uint64(seed) * np.uint64(0x100000000) + np.uint64(i)
+    return PlannerState(
+        seeds,
+        np.full((N, 3), -1, dtype=np.int64),
+        np.zeros(N, dtype=np.float64),
+        np.zeros(N, dtype=np.int64),
+        np.zeros(N, dtype=np.int64),
+        np.zeros(N, dtype=np.int64),
+    )
+
+
+@njit(cache=True)
+def planner_scratch(N: int, samples: int) -> PlannerScratch:
+    # scratch rows for N agents, holding up to samples cross-entropy samples
+    return PlannerScratch(
+        np.zeros((N, 4, 3), dtype=np.float64),
+        np.zeros((N, samples, 3), dtype=np.float64),
+        np.zeros((N, samples), dtype=np.float64),
+        np.zeros((N, samples), dtype=np.int64),
+    )
+
+
+@njit(cache=True)
+def ranks_above(a: float, b: float) -> bool:
+    # a > b, with nan above every number
+    return a > b or (np.isnan(a) and not np.isnan(b))
+
+
+@njit(cache=True)
+def next_uniform(seeds: NDArray[np.uint64], i: int) -> float:
+    # splitmix64 step of agent i's stream, as a float in [0, 1). Each agent
+    # owns its stream, so draws don't depend on how threads split the agents
+    seeds[i] += np.uint64(0x9E3779B97F4A7C15)
+    z = seeds[i]
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@njit(cache=True)
+def next_normal(seeds: NDArray[np.uint64], i: int) -> float:
+    # standard normal draw from agent i's stream (Box-Muller)
+    u = 1.0 - next_uniform(seeds, i)
+    v = next_uniform(seeds, i)
+    return np.sqrt(-2.0 * np.log(u)) * np.cos(2.0 * np.pi * v)
+
+
+@njit(cache=True)
+def score_action(
+    i: int,
+    a: int,
+    thrust: float,
+    attack_angle_rate: float,
+    roll_angle_rate: float,
+    state: tuple,
+    bounds: tuple,
+    cell: tuple,
+    primitives: MotionPrimitives,
+    projected_positions: Vectors,
+    projected_directions: Vectors,
+    opponents: Indices,
+    params: Params,
+) -> float:
+    # Reward for agent i holding one action over the forward projection,
+    # projected on scalars against its opponents' zero-input projections. The
+    # motion of grid action a (an action_table index, -1 off the grid) is looked
+    # up in the motion primitives where agent i's cell lies within them
+    (
+        positions,
+        velocities,
+        attack_angles,
+        flight_path_angles,
+        roll_angles,
+        azimuth_angles,
+    ) = state
+    (
+        velocity_mins,
+        velocity_maxs,
+        azimuth_rate_mins,
+        azimuth_rate_maxs,
+        attack_angle_mins,
+        attack_angle_maxs,
+    ) = bounds
+
+    x, y, z = positions[i, 0], positions[i, 1], positions[i, 2]
+    if a >= 0 and cell[0]:
+        dx, dy, dz, vx, vy, vz = primitive_motion(a, cell, primitives)
+        return calculate_reward_scalars(
+            x + dx,
+            y + dy,
+            z + dz,
+            vx,
+            vy,
+            vz,
+            projected_positions,
+            projected_directions,
+            opponents,
+            params,
+        )
+
+    vx, vy, vz = 0.0, 0.0, 0.0
+    velocity = velocities[i]
+    attack_angle = attack_angles[i]
+    flight_path_angle = flight_path_angles[i]
+    roll_angle = roll_angles[i]
+    azimuth_angle = azimuth_angles[i]
+    for _ in range(params.forward_projection_steps):
+        (
+            x,
+            y,
+            z,
+            vx,
+            vy,
+            vz,
+            velocity,
+            attack_angle,
+            flight_path_angle,
+            roll_angle,
+            azimuth_angle,
+        ) = step_agent(
+            x,
+            y,
+            z,
+            velocity,
+            attack_angle,
+            flight_path_angle,
+            roll_angle,
+            azimuth_angle,
+            thrust,
+            attack_angle_rate,
+            roll_angle_rate,
+            velocity_mins[i],
+            velocity_maxs[i],
+            azimuth_rate_mins[i],
+            azimuth_rate_maxs[i],
+            attack_angle_mins[i],
+            attack_angle_maxs[i],
+            params,
+        )
+
+    return calculate_reward_scalars(
+        x,
+        y,
+        z,
+        vx,
+        vy,
+        vz,
+        projected_positions,
+        projected_directions,
+        opponents,
+        params,
+    )
+
+
+@njit(cache=True)
+def schedule_decisions_into(
+    separations: Scalars,
+    live: Mask,
+    deciding: Mask,
+    countdown: Indices,
+    ticks: int,
+    params: Params,
+) -> None:
+    # Ticks each live agent holds its action before deciding again, after a
+    # step of ticks ticks, given its distance to its nearest live opponent:
+    # none within decision_near_range, decision_interval beyond
+    # decision_far_range, and in proportion between. An agent that is holding
+    # waits no longer than its current range allows, so it decides sooner when
+    # an opponent closes in
+    for i in range(live.shape[0]):
+        if not live[i]:
+            countdown[i] = 0
+            continue
+        wait = (
+            range_steps(
+                separations[i],
+                params.decision_interval,
+                params.decision_near_range,
+                params.decision_far_range,
+            )
+            - ticks
+        )
+        if not deciding[i]:
+            wait = min(countdown[i] - ticks, wait)
+        countdown[i] = max(wait, 0)
+
+
+@njit(cache=True, error_model="numpy")
+def unit_vectors_into(vectors: Vectors, out: Vectors) -> None:
+    # Each row of vectors scaled to unit length, written into out (numpy error
+    # model so a zero vector gives nan rather than raising)
+    for j in range(vectors.shape[0]):
+        length = np.sqrt(vectors[j, 0] ** 2 + vectors[j, 1] ** 2 + vectors[j, 2] ** 2)
+        out[j, 0] = vectors[j, 0] / length
+        out[j, 1] = vectors[j, 1] / length
+        out[j, 2] = vectors[j, 2] / length
+
+
+@njit(cache=True)
+def calculate_reward(
+    self_position: Vector,
+    self_velocity: Vector,
+    positions: Vectors,
+    velocities: Vectors,
+    opponents: Indices,
+    params: Params,
+) -> float:
+    directions = np.empty_like(velocities)
+    unit_vectors_into(velocities, directions)
+    return calculate_reward_scalars(
+        self_position[0],
+        self_position[1],
+        self_position[2],
+        self_velocity[0],
+        self_velocity[1],
+        self_velocity[2],
+        positions,
+        directions,
+        opponents,
+        params,
+    )
+
+
+@njit(cache=True, error_model="numpy")
+def calculate_reward_scalars(
+    x: float,
+    y: float,
+    z: float,
+    vx: float,
+    vy: float,
+    vz: float,
+    positions: Vectors,
+    directions: Vectors,
+    opponents: Indices,
+    params: Params,
+) -> float:
+    # positive_maximum - negative_maximum - hard_deck_penalty in one pass over
+    # the opponents, without temporary arrays, given the opponents' velocities
+    # as unit vectors (numpy error model so coincident agents give nan like the
+    # array version rather than raising)
+    speed = np.sqrt(vx**2 + vy**2 + vz**2)
+    self_vx = vx / speed
+    self_vy = vy / speed
+    self_vz = vz / speed
+
+    best_positive_reward = -np.inf
+    best_negative_reward = -np.inf
+    for j in opponents:
+        if j < 0:
+            break
+        rx = positions[j, 0] - x
+        ry = positions[j, 1] - y
+        rz = positions[j, 2] - z
+        d = np.sqrt(rx**2 + ry**2 + rz**2)
+        rx, ry, rz = rx / d, ry / d, rz / d
+
+        # Self pointing toward enemy, and we are in enemy's rear hemisphere
+        pursuit_alignment = rx * self_vx + ry * self_vy + rz * self_vz
+        aspect_alignment = (
+            rx * directions[j, 0] + ry * directions[j, 1] + rz * directions[j, 2]
+        )
+        best_positive_reward = max(
+            best_positive_reward, (pursuit_alignment + aspect_alignment) / d
+        )
+
+        # Enemy pointing toward us is the same alignment seen from their side
+        best_negative_reward = max(
+            best_negative_reward, max(0.0, -aspect_alignment) / d
+        )
+
+    total_reward = best_positive_reward - best_negative_reward
+    total_reward -= hard_deck_penalty(z, params)
+    return total_reward
+
+
+@njit(cache=True)
+def calculate_rewards(
+    self_positions: Vectors,
+    self_velocities: Vectors,
+    positions: Vectors,
+    velocities: Vectors,
+    opponents: Indices,
+    out: Scalars,
+    params: Params,
+) -> Scalars:
+    # calculate_reward for a batch of candidate self states, written into out,
+    # the opponents' velocities made unit vectors once for all of them
+    directions = np.empty_like(velocities)
+    unit_vectors_into(velocities, directions)
+    for c in range(self_positions.shape[0]):
+        out[c] = calculate_reward_scalars(
+            self_positions[c, 0],
+            self_positions[c, 1],
+            self_positions[c, 2],
+            self_velocities[c, 0],
+            self_velocities[c, 1],
+            self_velocities[c, 2],
+            positions,
+            directions,
+            opponents,
+            params,
+        )
+    return out
+
+
+@njit(cache=True)
+def hard_deck_penalty(z: float, params: Params) -> float:
+    if z <= params.hard_deck:
+        return params.penalty
+    return 0.0
 
 
+@njit(cache=True)
 def positive_maximum(
     self_position: Vector,
     self_velocity: Vector,
@@ -156,16 +1162,16 @@ def positive_maximum(
     other_velocities: Vectors,
 ) -> float:
     r = other_positions - self_position
-    d = np.linalg.norm(r, axis=1)
+    d = np.sqrt(np.sum(r**2, axis=1))
     r_hat = r / d[:, np.newaxis]
 
     # Self pointing toward enemy
-    self_v_hat = self_velocity / np.linalg.norm(self_velocity)
-    pursuit_alignment = np.dot(r_hat, self_v_hat)
+    self_v_hat = self_velocity / np.sqrt(np.sum(self_velocity**2))
+    pursuit_alignment = np.sum(r_hat * self_v_hat, axis=1)
 
     # We are in enemy's rear hemisphere
     enemy_v_hat = (
-        other_velocities / np.linalg.norm(other_velocities, axis=1)[:, np.newaxis]
+        other_velocities / np.sqrt(np.sum(other_velocities**2, axis=1))[:, np.newaxis]
     )
     r_from_enemy = -r_hat  # vector from enemy to self
     aspect_alignment = -np.sum(r_from_enemy * enemy_v_hat, axis=1)
@@ -175,17 +1181,18 @@ def positive_maximum(
     return np.max(score)
 
 
+@njit(cache=True)
 def negative_maximum(
     self_position: np.ndarray,
     other_positions: np.ndarray,
     other_velocities: np.ndarray,
 ) -> float:
     r = other_positions - self_position
-    d = np.linalg.norm(r, axis=1)
+    d = np.sqrt(np.sum(r**2, axis=1))
     r_hat = r / d[:, np.newaxis]
 
     enemy_v_hat = (
-        other_velocities / np.linalg.norm(other_velocities, axis=1)[:, np.newaxis]
+        other_velocities / np.sqrt(np.sum(other_velocities**2, axis=1))[:, np.newaxis]
     )
 
     # Calculate alignment
@@ -193,6 +1200,6 @@ def negative_maximum(
 
     # CLAMP: Only penalize if the enemy is actually pointing towards us (alignment > 0).
     # If they are perpendicular or pointing away, the threat is 0.
-    threat_score = np.maximum(0, alignment) / d
+    threat_score = np.maximum(0.0, alignment) / d
 
     return np.max(threat_score)
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+from typing import NamedTuple, get_type_hints
+import numpy as np
+import numpy.typing as npt
+
+from configs import mdp as MDPConfig
+from configs import simulation as SimulationConfig
+
+
+class Params(NamedTuple):
+    # settings the compiled kernels read, passed to them rather than compiled in
+
+    dt: float
+    g: float
+    max_gs: float
+    corner_velocity: float
+    k_drag: float
+    # index into INTEGRATORS
+    integrator: int
+    # 1 to project, step and plan with the kernels' fastmath variants, see
+    # fastmath.py
+    fastmath: int
+    hard_deck: float
+    penalty: float
+    capture_radius: float
+    capture_point_steps: int
+    max_step_ticks: int
+    step_near_range: float
+    step_far_range: float
+    forward_projection_steps: int
+    nearest_opponents: int
+    # index into PLANNERS and each planner's settings, see configs/mdp.py
+    planner: int
+    refine_stride: int
+    cem_iterations: int
+    cem_samples: int
+    cem_elites: int
+    seed: int
+    local_radius: int
+    rescan_interval: int
+    rescan_drop: float
+    decision_interval: int
+    decision_near_range: float
+    decision_far_range: float
+    # 1 to look grid actions up in the motion primitive tables, see primitives.py
+    motion_primitives: int
+    # index into POLICIES, and where the distilled policy defers to the planner
+    policy: int
+    distilled_fallback_range: float
+    # decisions the cache keeps (0 for none) and how it quantises situations
+    decision_cache_size: int
+    cache_range_ratio: float
+    cache_speed_step: float
+    cache_angle_step: float
+    cache_opponents: int
+    # (thrust, attack angle rate, roll angle rate) grid, before agent ratios,
+    # as every combination and as the three axes it is the product of
+    actions: npt.NDArray[np.float64]
+    action_thrusts: npt.NDArray[np.float64]
+    action_attack_angle_rates: npt.NDArray[np.float64]
+    action_roll_angle_rates: npt.NDArray[np.float64]
+
+
+# how find_actions picks each agent's action, see its searches in mdp.py
+PLANNERS = ("exhaustive", "coarse_to_fine", "cem", "warm_start")
+# what decides each agent's action, see configs/mdp.py
+POLICIES = ("planner", "distilled")
+# how steps are integrated, see configs/simulation.py
+INTEGRATORS = ("semi_implicit", "rk2", "rk4")
+
+
+def action_table() -> npt.NDArray[np.float64]:
+    # every (thrust, attack angle rate, roll angle rate) combination, before
+    # agent ratios
+    return np.array(
+        [
+            [thrust, attack_angle, roll_angle]
+            for thrust in MDPConfig.ACTION_THRUSTS
+            for attack_angle in MDPConfig.ACTION_ATTACK_ANGLE_RATES
+            for roll_angle in MDPConfig.ACTION_ROLL_ANGLE_RATES
+        ],
+        dtype=np.float64,
+    )
+
+
+def configured_params(**overrides) -> Params:
+    # Params from the config modules as they are now, with any fields overridden.
+    # The planner, policy and integrator may be given by name
+    params = Params(
+        dt=1.0 / SimulationConfig.STEPS_PER_SECOND,
+        g=SimulationConfig.G,
+        max_gs=SimulationConfig.MAX_GS,
+        corner_velocity=SimulationConfig.CORNER_VELOCITY,
+        k_drag=SimulationConfig.K_DRAG,
+        integrator=SimulationConfig.INTEGRATOR,
+        fastmath=SimulationConfig.FASTMATH,
+        hard_deck=SimulationConfig.HARD_DECK,
+        penalty=SimulationConfig.PENALTY,
+        capture_radius=SimulationConfig.CAPTURE_RADIUS,
+        capture_point_steps=SimulationConfig.CAPTURE_POINT_STEPS,
+        max_step_ticks=SimulationConfig.MAX_STEP_TICKS,
+        step_near_range=SimulationConfig.STEP_NEAR_RANGE,
+        step_far_range=SimulationConfig.STEP_FAR_RANGE,
+        forward_projection_steps=MDPConfig.FORWARD_PROJECTION_STEPS,
+        nearest_opponents=MDPConfig.NEAREST_OPPONENTS,
+        planner=MDPConfig.PLANNER,
+        refine_stride=MDPConfig.REFINE_STRIDE,
+        cem_iterations=MDPConfig.CEM_ITERATIONS,
+        cem_samples=MDPConfig.CEM_SAMPLES,
+        cem_elites=MDPConfig.CEM_ELITES,
+        seed=MDPConfig.PLANNER_SEED,
+        local_radius=MDPConfig.LOCAL_RADIUS,
+        rescan_interval=MDPConfig.RESCAN_INTERVAL,
+        rescan_drop=MDPConfig.RESCAN_DROP,
+        decision_interval=MDPConfig.DECISION_INTERVAL,
+        decision_near_range=MDPConfig.DECISION_NEAR_RANGE,
+        decision_far_range=MDPConfig.DECISION_FAR_RANGE,
+        motion_primitives=MDPConfig.MOTION_PRIMITIVES,
+        policy=MDPConfig.POLICY,
+        distilled_fallback_range=MDPConfig.DISTILLED_FALLBACK_RANGE,
+        decision_cache_size=MDPConfig.DECISION_CACHE_SIZE,
+        cache_range_ratio=MDPConfig.CACHE_RANGE_RATIO,
+        cache_speed_step=MDPConfig.CACHE_SPEED_STEP,
+        cache_angle_step=MDPConfig.CACHE_ANGLE_STEP,
+        cache_opponents=MDPConfig.CACHE_OPPONENTS,
+        actions=action_table(),
+        action_thrusts=MDPConfig.ACTION_THRUSTS,
+        action_attack_angle_rates=MDPConfig.ACTION_ATTACK_ANGLE_RATES,
+        action_roll_angle_rates=MDPConfig.ACTION_ROLL_ANGLE_RATES,
+    )._replace(**overrides)
+    if isinstance(params.planner, str):
+        params = params._replace(planner=PLANNERS.index(params.planner))
+    if isinstance(params.policy, str):
+        params = params._replace(policy=POLICIES.index(params.policy))
+    if isinstance(params.integrator, str):
+        params = params._replace(integrator=INTEGRATORS.index(params.integrator))
+
+    # fixed field types, so numba compiles the kernels once for all of them
+    types = get_type_hints(Params)
+    return Params(
+        **{
+            field: (
+                types[field](value)
+                if types[field] in (float, int)
+                else np.ascontiguousarray(value, dtype=np.float64)
+            )
+            for field, value in params._asdict().items()
+        }
+    )
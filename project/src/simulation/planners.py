@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, TypedDict
+import numpy as np
+
+from simulation.params import PLANNERS, POLICIES
+
+if TYPE_CHECKING:
+    from simulation.simulation import Simulation
+
+
+class PlannerReport(TypedDict):
+    decisions: int
+    disagreements: int
+    disagreement_rate: float
+    # exhaustive best reward less the planner's, averaged over decisions;
+    # negative where a continuous planner finds actions between grid points
+    mean_regret: float
+    mean_evaluations: float
+    mean_exhaustive_evaluations: float
+    # warm-start decisions taken from the local search, and full grid scans
+    hits: int
+    rescans: int
+
+
+class DistilledReport(TypedDict):
+    # decisions the distilled policy made, and those it left to the planner
+    # as the agent was near an opponent
+    decisions: int
+    fallbacks: int
+    agreements: int
+    agreement_rate: float
+    # how often the policy picks the planner's thrust, attack angle rate and
+    # roll angle rate
+    axis_agreement_rates: list[float]
+
+
+def compare_distilled(simulation: Simulation, steps: int) -> DistilledReport:
+    # Steps the simulation, set to use the distilled policy, for up to steps
+    # steps, first deciding each step with its planner aside too (see
+    # Simulation.decide_aside), and reports how often the policy's action
+    # matches the planner's
+    planner = simulation.params._replace(
+        policy=POLICIES.index("planner"), decision_cache_size=0
+    )
+    workspace = simulation.workspace
+
+    decisions = fallbacks = agreements = 0
+    axis_agreements = np.zeros(3, dtype=np.int64)
+    for _ in range(steps):
+        simulation.decide_aside(planner)
+        best_actions = workspace.actions.copy()
+
+        simulation.decide()
+        chosen = workspace.distilled
+        matches = workspace.actions[chosen] == best_actions[chosen]
+        decisions += int(chosen.sum())
+        fallbacks += int(np.count_nonzero(workspace.deciding & ~chosen))
+        agreements += int(np.all(matches, axis=1).sum())
+        axis_agreements += matches.sum(axis=0)
+
+        simulation.step(decided=True)
+        if np.sum(simulation.active) <= 1:
+            break
+
+    return {
+        "decisions": decisions,
+        "fallbacks": fallbacks,
+        "agreements": agreements,
+        "agreement_rate": agreements / max(decisions, 1),
+        "axis_agreement_rates": (axis_agreements / max(decisions, 1)).tolist(),
+    }
+
+
+class CacheReport(TypedDict):
+    decisions: int
+    # decisions reused from the cache, the lookups that found none, and the
+    # situations evicted to make room
+    hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+    # reused decisions the planner would not have made
+    divergences: int
+    divergence_rate: float
+
+
+def compare_cached(simulation: Simulation, steps: int) -> CacheReport:
+    # Steps the simulation, set to use the decision cache, for up to steps
+    # steps, first deciding each step with its planner alone aside too (see
+    # Simulation.decide_aside), and reports how often the cache answers and
+    # how often its answer differs from the planner's
+    planner = simulation.params._replace(decision_cache_size=0)
+    workspace = simulation.workspace
+    cache = simulation.decision_cache
+    hits, misses, evictions = (
+        (cache.hits, cache.misses, cache.evictions) if cache else (0, 0, 0)
+    )
+
+    decisions = divergences = 0
+    for _ in range(steps):
+        simulation.decide_aside(planner)
+        best_actions = workspace.actions.copy()
+
+        simulation.step()
+        cached = workspace.cached
+        decisions += int(workspace.deciding.sum())
+        divergences += int(
+            np.any(workspace.actions[cached] != best_actions[cached], axis=1).sum()
+        )
+
+        if np.sum(simulation.active) <= 1:
+            break
+
+    cache = simulation.decision_cache
+    hits, misses, evictions = (
+        (cache.hits - hits, cache.misses - misses, cache.evictions - evictions)
+        if cache
+        else (0, 0, 0)
+    )
+    return {
+        "decisions": decisions,
+        "hits": hits,
+        "misses": misses,
+        "evictions": evictions,
+        "hit_rate": hits / max(hits + misses, 1),
+        "divergences": divergences,
+        "divergence_rate": divergences / max(hits, 1),
+    }
+
+
+def compare_planners(simulation: Simulation, steps: int) -> PlannerReport:
+    # Steps the simulation with its configured planner for up to steps steps,
+    # first deciding each step with the exhaustive search aside too (see
+    # Simulation.decide_aside), integrating every action, and reports how often
+    # the planner's action differs from the exhaustive argmax. With motion
+    # primitives on, this includes where looking actions up rather than
+    # integrating them changes the choice
+    exhaustive = simulation.params._replace(
+        planner=PLANNERS.index("exhaustive"), motion_primitives=0, decision_cache_size=0
+    )
+    workspace = simulation.workspace
+    hits = int(workspace.planner_state.hits.sum())
+    rescans = int(workspace.planner_state.rescans.sum())
+
+    decisions = disagreements = evaluations = exhaustive_evaluations = 0
+    regret = 0.0
+    for _ in range(steps):
+        simulation.decide_aside(exhaustive)
+        deciding = workspace.deciding.copy()
+        best_actions = workspace.actions[deciding]
+        best_rewards = workspace.rewards[deciding]
+        exhaustive_evaluations += int(workspace.evaluations[deciding].sum())
+
+        simulation.step()
+        decisions += int(deciding.sum())
+        disagreements += int(
+            np.any(workspace.actions[deciding] != best_actions, axis=1).sum()
+        )
+        regret += float(np.nansum(best_rewards - workspace.rewards[deciding]))
+        evaluations += int(workspace.evaluations[deciding].sum())
+
+        if np.sum(simulation.active) <= 1:
+            break
+
+    return {
+        "decisions": decisions,
+        "disagreements": disagreements,
+        "disagreement_rate": disagreements / max(decisions, 1),
+        "mean_regret": regret / max(decisions, 1),
+        "mean_evaluations": evaluations / max(decisions, 1),
+        "mean_exhaustive_evaluations": exhaustive_evaluations / max(decisions, 1),
+        "hits": int(workspace.planner_state.hits.sum()) - hits,
+        "rescans": int(workspace.planner_state.rescans.sum()) - rescans,
+    }
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import TYPE_CHECKING, NamedTuple
+import numpy as np
+from numpy.typing import NDArray
+from numba import njit, prange
+
+from configs import mdp as MDPConfig
+from simulation.kinematics import step_agent
+
+if TYPE_CHECKING:
+    from simulation.params import Params
+    from simulation.simulation import Vectors, Scalars
+
+# bump when the table layout changes, so cached tables are rebuilt
+TABLE_VERSION = 1
+# flight path angles the kinematics clips to
+FLIGHT_PATH_LIMIT = 1.4
+
+# tables already loaded or built in this process, by primitive_key
+_tables: dict[str, NDArray[np.float32]] = {}
+
+
+class MotionPrimitives(NamedTuple):
+    """
+    Where each grid action takes an agent over the forward projection, from a
+    grid of speeds, flight path angles, roll angles and attack angles, one table
+    per kind of agent (action ratios and bounds). Heading and position only
+    rotate and translate the motion, so the tables start every agent at the
+    origin heading along x, and store its displacement and final velocity in the
+    frame of its initial flight path.
+    """
+
+    # each agent's kind, -1 for none
+    kinds: NDArray[np.int64]
+    # per kind, the first speed, flight path, roll and attack angle tabulated,
+    # and the spacing between them (roll angles wrap around a full turn)
+    lows: NDArray[np.float64]
+    spacings: NDArray[np.float64]
+    # kind x speed x flight path x roll x attack angle x action x (displacement,
+    # final velocity)
+    table: NDArray[np.float32]
+
+
+def no_primitives(N: int) -> MotionPrimitives:
+    # no tables, so every action is integrated
+    return MotionPrimitives(
+        np.full(N, -1, dtype=np.int64),
+        np.zeros((0, 4), dtype=np.float64),
+        np.zeros((0, 4), dtype=np.float64),
+        np.zeros((0, 1, 1, 1, 1, 1, 6), dtype=np.float32),
+    )
+
+
+def primitive_grid(
+    kind: NDArray[np.float64], shape: tuple[int, int, int, int]
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    # (lows, spacings) of the grid for a kind, a row of action ratios then the
+    # six bounds as Simulation.bounds orders them
+    velocity_min, velocity_max = kind[3], kind[4]
+    attack_angle_min, attack_angle_max = kind[7], kind[8]
+    lows = np.array([velocity_min, -FLIGHT_PATH_LIMIT, 0.0, attack_angle_min])
+    spans = np.array(
+        [
+            velocity_max - velocity_min,
+            2 * FLIGHT_PATH_LIMIT,
+            2 * np.pi,
+            attack_angle_max - attack_angle_min,
+        ]
+    )
+    # the roll axis wraps, so its last point is the first
+    intervals = np.array([shape[0] - 1, shape[1] - 1, shape[2], shape[3] - 1])
+    return lows, spans / np.maximum(intervals, 1)
+
+
+def primitive_key(
+    kind: NDArray[np.float64], shape: tuple[int, int, int, int], params: Params
+) -> str:
+    # Identifies a kind's table: the kind, the grid and every setting the
+    # forward projection depends on
+    digest = hashlib.sha256()
+    digest.update(np.array([TABLE_VERSION, *shape], dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(kind, dtype=np.float64).tobytes())
+    digest.update(
+        np.array(
+            [
+                params.dt,
+                params.g,
+                params.max_gs,
+                params.corner_velocity,
+                params.k_drag,
+                params.integrator,
+                params.forward_projection_steps,
+            ],
+            dtype=np.float64,
+        ).tobytes()
+    )
+    for axis in (
+        params.action_thrusts,
+        params.action_attack_angle_rates,
+        params.action_roll_angle_rates,
+    ):
+        digest.update(np.ascontiguousarray(axis, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def load_primitives(
+    action_ratios: Vectors,
+    bounds: tuple[Scalars, ...],
+    params: Params,
+    shape: tuple[int, int, int, int] | None = None,
+    directory: str | None = None,
+) -> MotionPrimitives:
+    # Motion primitives for every kind of agent, loaded from directory where
+    # they were tabulated before and tabulated (and saved there) otherwise.
+    # shape and directory default to PRIMITIVE_GRID and PRIMITIVE_DIRECTORY,
+    # and a directory of "" keeps tables in this process only
+    shape = MDPConfig.PRIMITIVE_GRID if shape is None else shape
+    directory = MDPConfig.PRIMITIVE_DIRECTORY if directory is None else directory
+    agents = np.column_stack([action_ratios, *bounds]).astype(np.float64)
+    kinds, agent_kinds = np.unique(agents, axis=0, return_inverse=True)
+
+    lows = np.empty((kinds.shape[0], 4), dtype=np.float64)
+    spacings = np.empty((kinds.shape[0], 4), dtype=np.float64)
+    table = np.empty(
+        (kinds.shape[0], *shape, params.actions.shape[0], 6), dtype=np.float32
+    )
+    for k, kind in enumerate(kinds):
+        lows[k], spacings[k] = primitive_grid(kind, shape)
+        key = primitive_key(kind, shape, params)
+        path = os.path.join(directory, f"{key}.npy") if directory else ""
+        if key not in _tables:
+            if path and os.path.exists(path):
+                _tables[key] = np.load(path)
+            else:
+                _tables[key] = np.empty(table.shape[1:], dtype=np.float32)
+                tabulate_primitives_into(
+                    kind, lows[k], spacings[k], _tables[key], params
+                )
+                if path:
+                    os.makedirs(directory, exist_ok=True)
+                    np.save(path, _tables[key])
+        table[k] = _tables[key]
+
+    return MotionPrimitives(
+        agent_kinds.reshape(-1).astype(np.int64), lows, spacings, table
+    )
+
+
+@njit(cache=True, parallel=True)
+def tabulate_primitives_into(
+    kind: NDArray[np.float64],
+    lows: NDArray[np.float64],
+    spacings: NDArray[np.float64],
+    out: NDArray[np.float32],
+    params: Params,
+) -> None:
+    # Integrates every grid action from every grid state for the forward
+    # projection, writing each one's displacement and final velocity, in the
+    # frame of the initial flight path, into out. Grid states are independent,
+    # so threads split them
+    n0, n1, n2, n3 = out.shape[0], out.shape[1], out.shape[2], out.shape[3]
+    actions = params.actions
+    for cell in prange(n0 * n1 * n2 * n3):
+        j0 = cell // (n1 * n2 * n3)
+        j1 = cell // (n2 * n3) % n1
+        j2 = cell // n3 % n2
+        j3 = cell % n3
+        flight_path_angle = lows[1] + j1 * spacings[1]
+        cos_flight_path = np.cos(flight_path_angle)
+        sin_flight_path = np.sin(flight_path_angle)
+
+        for a in range(actions.shape[0]):
+            x, y, z = 0.0, 0.0, 0.0
+            vx, vy, vz = 0.0, 0.0, 0.0
+            velocity = lows[0] + j0 * spacings[0]
+            attack_angle = lows[3] + j3 * spacings[3]
+            path_angle = flight_path_angle
+            roll_angle = lows[2] + j2 * spacings[2]
+            azimuth_angle = 0.0
+            for _ in range(params.forward_projection_steps):
+                (
+                    x,
+                    y,
+                    z,
+                    vx,
+                    vy,
+                    vz,
+                    velocity,
+                    attack_angle,
+                    path_angle,
+                    roll_angle,
+                    azimuth_angle,
+                ) = step_agent(
+                    x,
+                    y,
+                    z,
+                    velocity,
+                    attack_angle,
+                    path_angle,
+                    roll_angle,
+                    azimuth_angle,
+                    actions[a, 0] * kind[0],
+                    actions[a, 1] * kind[1],
+                    actions[a, 2] * kind[2],
+                    kind[3],
+                    kind[4],
+                    kind[5],
+                    kind[6],
+                    kind[7],
+                    kind[8],
+                    params,
+                )
+
+            row = out[j0, j1, j2, j3, a]
+            row[0] = x * cos_flight_path + z * sin_flight_path
+            row[1] = y
+            row[2] = z * cos_flight_path - x * sin_flight_path
+            row[3] = vx * cos_flight_path + vz * sin_flight_path
+            row[4] = vy
+            row[5] = vz * cos_flight_path - vx * sin_flight_path
+
+
+@njit(cache=True)
+def grid_position(
+    value: float, low: float, spacing: float, n: int, wraps: bool
+) -> tuple[int, float, bool]:
+    # The grid point at or below value along one axis of n points, the
+    # fraction of the way to the next, and whether value lies on the axis
+    position = (value - low) / spacing if spacing > 0.0 else 0.0
+    if wraps:
+        position = position % n
+        corner = min(int(position), n - 1)
+        return corner, position - corner, True
+    # bar rounding
+    inside = -1e-9 <= position <= n - 1 + 1e-9
+    position = min(max(position, 0.0), n - 1)
+    corner = min(int(position), max(n - 2, 0))
+    return corner, position - corner, inside
+
+
+@njit(cache=True)
+def primitive_cell(
+    i: int,
+    velocity: float,
+    attack_angle: float,
+    flight_path_angle: float,
+    roll_angle: float,
+    azimuth_angle: float,
+    primitives: MotionPrimitives,
+    params: Params,
+) -> tuple:
+    # Where agent i's state lies in its kind's table: whether params look
+    # actions up and the state lies within the table, the kind, the grid
+    # cell's lower corner and the fractions of the way to its upper corner
+    # along each axis, and the cosines and sines of the flight path angle and
+    # heading that turn the table's motion into the world frame
+    k = primitives.kinds[i]
+    shape = primitives.table.shape
+    inside = (
+        params.motion_primitives != 0
+        and 0 <= k < shape[0]
+        and shape[5] == params.actions.shape[0]
+    )
+    corners = (0, 0, 0, 0)
+    fractions = (0.0, 0.0, 0.0, 0.0)
+    if inside:
+        lows = primitives.lows[k]
+        spacings = primitives.spacings[k]
+        j0, f0, inside0 = grid_position(velocity, lows[0], spacings[0], shape[1], False)
+        j1, f1, inside1 = grid_position(
+            flight_path_angle, lows[1], spacings[1], shape[2], False
+        )
+        j2, f2, _ = grid_position(roll_angle, lows[2], spacings[2], shape[3], True)
+        j3, f3, inside3 = grid_position(
+            attack_angle, lows[3], spacings[3], shape[4], False
+        )
+        inside = inside0 and inside1 and inside3
+        corners = (j0, j1, j2, j3)
+        fractions = (f0, f1, f2, f3)
+    return (
+        inside,
+        k,
+        corners,
+        fractions,
+        np.cos(flight_path_angle),
+        np.sin(flight_path_angle),
+        np.cos(azimuth_angle),
+        np.sin(azimuth_angle),
+    )
+
+
+@njit(cache=True)
+def primitive_motion(
+    a: int, cell: tuple, primitives: MotionPrimitives
+) -> tuple[float, float, float, float, float, float]:
+    # Displacement and final velocity, in the world frame, of grid action a
+    # from the state primitive_cell placed in cell, interpolated between the
+    # 16 grid states around it
+    _, k, corners, fractions, cos_path, sin_path, cos_azimuth, sin_azimuth = cell
+    table = primitives.table
+    m0 = m1 = m2 = m3 = m4 = m5 = 0.0
+    for c0 in range(2):
+        w0 = fractions[0] if c0 else 1.0 - fractions[0]
+        j0 = min(corners[0] + c0, table.shape[1] - 1)
+        for c1 in range(2):
+            w1 = w0 * (fractions[1] if c1 else 1.0 - fractions[1])
+            j1 = min(corners[1] + c1, table.shape[2] - 1)
+            for c2 in range(2):
+                w2 = w1 * (fractions[2] if c2 else 1.0 - fractions[2])
+                j2 = (corners[2] + c2) % table.shape[3]
+                for c3 in range(2):
+                    w = w2 * (fractions[3] if c3 else 1.0 - fractions[3])
+                    j3 = min(corners[3] + c3, table.shape[4] - 1)
+                    row = table[k, j0, j1, j2, j3, a]
+                    m0 += w * row[0]
+                    m1 += w * row[1]
+                    m2 += w * row[2]
+                    m3 += w * row[3]
+                    m4 += w * row[4]
+                    m5 += w * row[5]
+
+    # out of the initial flight path's frame, then onto the heading
+    x = m0 * cos_path - m2 * sin_path
+    z = m0 * sin_path + m2 * cos_path
+    vx = m3 * cos_path - m5 * sin_path
+    vz = m3 * sin_path + m5 * cos_path
+    return (
+        x * cos_azimuth - m1 * sin_azimuth,
+        x * sin_azimuth + m1 * cos_azimuth,
+        z,
+        vx * cos_azimuth - m4 * sin_azimuth,
+        vx * sin_azimuth + m4 * cos_azimuth,
+        vz,
+    )
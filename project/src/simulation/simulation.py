@@ -1,17 +1,49 @@
 from __future__ import annotations
 
+import copy
+from io import BytesIO
 from logging import Logger
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING, Callable, Mapping
 import numpy as np
 import numpy.typing as npt
 from collections import deque
-from numba import njit, prange
 from typing import TypedDict
 
 from configs import simulation as SimulationConfig
 from configs import visualisation as VisualisationConfig
-from configs import mdp as MDPConfig
-from simulation.mdp import MDP
+from simulation.kinematics import (
+    forward_project,
+    integrate_into,
+    set_threads,
+    step_agents,
+    velocity_angles_scalars_to_vectors,
+)
+from simulation.mdp import (
+    Opponents,
+    drop_opponents,
+    find_actions_into,
+    group_opponents,
+    schedule_decisions_into,
+    scores_nearest,
+    unit_vectors_into,
+)
+from simulation.cache import DecisionCache, decision_keys
+from simulation.capturing import detect_captures_into
+from simulation.distilled import (
+    DistilledPolicy,
+    action_indices,
+    load_policy,
+    policy_actions,
+)
+from simulation.fastmath import kernel_for
+from simulation.params import POLICIES, Params, configured_params
+from simulation.primitives import load_primitives
+from simulation.spatial import (
+    nearest_neighbours,
+    nearest_opponent_distances_into,
+    range_steps,
+)
+from simulation.workspace import Workspace
 
 if TYPE_CHECKING:
     from configs.parameters import SimulationParams
@@ -22,160 +54,6 @@ type Vectors = npt.NDArray[np.float64]
 type Scalars = npt.NDArray[np.float64]
 
 
-@njit
-def velocity_angles_scalars_to_vectors(
-    velocities: Scalars, flight_path_angles: Scalars, azimuth_angles: Scalars
-) -> Vectors:
-    vx = velocities * np.cos(flight_path_angles) * np.cos(azimuth_angles)
-    vy = velocities * np.cos(flight_path_angles) * np.sin(azimuth_angles)
-    vz = velocities * np.sin(flight_path_angles)
-
-    return np.stack((vx, vy, vz), axis=-1)
-
-
-@njit
-def step_agents(
-    positions: Vectors,
-    velocities: Scalars,
-    attack_angles: Scalars,
-    flight_path_angles: Scalars,
-    roll_angles: Scalars,
-    azimuth_angles: Scalars,
-    thrusts: Scalars,
-    attack_angle_rates: Scalars,
-    roll_angle_rates: Scalars,
-    velocity_mins: Scalars,
-    velocity_maxs: Scalars,
-    azimuth_rate_mins: Scalars,
-    azimuth_rate_maxs: Scalars,
-    attack_angle_mins: Scalars,
-    attack_angle_maxs: Scalars,
-) -> tuple[Vectors, Vectors, Scalars, Scalars, Scalars, Scalars, Scalars]:
-    dt = 1.0 / SimulationConfig.STEPS_PER_SECOND
-    g = SimulationConfig.G
-
-    attack_angles = np.clip(
-        attack_angles + attack_angle_rates * dt,
-        attack_angle_mins,
-        attack_angle_maxs,
-    )
-    roll_angles = roll_angles + roll_angle_rates * dt
-
-    # Change 1: Calculate how many 'Gs' the plane can actually pull at this speed
-    # (This stops the "infinite turn" bug at low speeds)
-    v_ratio = velocities / SimulationConfig.CORNER_VELOCITY
-    max_g_at_speed = np.minimum(
-        SimulationConfig.MAX_GS, SimulationConfig.MAX_GS * (v_ratio**2)
-    )
-
-    # Change 2: Redefine nf as the actual G-load being pulled
-    # Your 'attack_angles' now acts as a 0.0 to 1.0 multiplier for those Gs
-    nf = attack_angles * max_g_at_speed
-
-    # Change 3: Update velocity rate to include "Turn Drag" (Induced Drag)
-    # This makes the agent lose speed when it turns hard
-    turn_drag = SimulationConfig.K_DRAG * (nf**2)
-    velocities_rates = g * (thrusts - turn_drag - np.sin(flight_path_angles))
-
-    velocities = np.clip(
-        velocities + velocities_rates * dt,
-        velocity_mins,
-        velocity_maxs,
-    )
-
-    flight_path_angles_rates = (g / velocities) * (
-        nf * np.cos(roll_angles) - np.cos(flight_path_angles)
-    )
-    flight_path_angles = np.clip(
-        flight_path_angles + flight_path_angles_rates * dt,
-        -1.4,
-        1.4,
-    )
-
-    azimuth_angles_rates = np.clip(
-        (g * nf * np.sin(roll_angles))
-        / (velocities * np.maximum(np.cos(flight_path_angles), 1e-3)),
-        azimuth_rate_mins,
-        azimuth_rate_maxs,
-    )
-    azimuth_angles = azimuth_angles + azimuth_angles_rates * dt
-
-    velocities_vectors = velocity_angles_scalars_to_vectors(
-        velocities, flight_path_angles, azimuth_angles
-    )
-    positions = positions + velocities_vectors * dt
-
-    return (
-        positions,
-        velocities_vectors,
-        velocities,
-        attack_angles,
-        flight_path_angles,
-        roll_angles,
-        azimuth_angles,
-    )
-
-
-@njit
-def forward_project(
-    steps: int,
-    positions: Vectors,
-    velocities: Scalars,
-    attack_angles: Scalars,
-    flight_path_angles: Scalars,
-    roll_angles: Scalars,
-    azimuth_angles: Scalars,
-    thrusts: Scalars,
-    attack_angle_rates: Scalars,
-    roll_angle_rates: Scalars,
-    velocity_mins: Scalars,
-    velocity_maxs: Scalars,
-    azimuth_rate_mins: Scalars,
-    azimuth_rate_maxs: Scalars,
-    attack_angle_mins: Scalars,
-    attack_angle_maxs: Scalars,
-) -> tuple[Vectors, Vectors, Scalars, Scalars, Scalars, Scalars, Scalars]:
-    # forward project
-    velocities_vectors = np.zeros_like(positions, dtype=np.float64)
-
-    for _ in prange(steps):
-        (
-            positions,
-            velocities_vectors,
-            velocities,
-            attack_angles,
-            flight_path_angles,
-            roll_angles,
-            azimuth_angles,
-        ) = step_agents(
-            positions,
-            velocities,
-            attack_angles,
-            flight_path_angles,
-            roll_angles,
-            azimuth_angles,
-            thrusts,
-            attack_angle_rates,
-            roll_angle_rates,
-            velocity_mins,
-            velocity_maxs,
-            azimuth_rate_mins,
-            azimuth_rate_maxs,
-            attack_angle_mins,
-            attack_angle_maxs,
-        )
-
-    return (
-        positions,
-        velocities_vectors,
-        velocities,
-        attack_angles,
-        flight_path_angles,
-        roll_angles,
-        azimuth_angles,
-    )
-
-
 class Simulation:
     def __init__(
         self,
@@ -191,13 +69,25 @@ class Simulation:
         thrust_ratio: list[float],
         attack_angle_ratio: list[float],
         roll_angle_ratio: list[float],
+        params: Params | None = None,
+        dtype: npt.DTypeLike | None = None,
     ):
         self.N = N
+        # ticks (nominal steps of 1 / STEPS_PER_SECOND s) simulated, and steps
+        # taken to simulate them, see MAX_STEP_TICKS
         self.timestep = 0
+        self.steps = 0
+        # physics, capture and MDP settings, the config modules' by default
+        self.params = configured_params() if params is None else params
+        # precision agent state is stored in, STATE_DTYPE by default
+        self.dtype = np.dtype(SimulationConfig.STATE_DTYPE if dtype is None else dtype)
 
         self.thrust_ratio = thrust_ratio
         self.attack_angle_ratio = attack_angle_ratio
         self.roll_angle_ratio = roll_angle_ratio
+        self.action_ratios: Vectors = np.array(
+            [thrust_ratio, attack_angle_ratio, roll_angle_ratio], dtype=np.float64
+        ).T.copy()
 
         self.velocity_mins: Scalars = np.array(velocity_mins)
         self.velocity_maxs: Scalars = np.array(velocity_maxs)
@@ -205,52 +95,69 @@ class Simulation:
         self.azimuth_rate_maxs: Scalars = np.array(azimuth_rate_maxs)
         self.attack_angle_mins: Scalars = np.array(attack_angle_mins)
         self.attack_angle_maxs: Scalars = np.array(attack_angle_maxs)
-        self.positions: Vectors = np.array(positions, dtype=np.float64)
+        self.positions: Vectors = np.array(positions, dtype=self.dtype)
 
-        self.speeds = np.zeros(N, dtype=np.float64) + 0.001
-        self.velocities = np.zeros((N, 3), dtype=np.float64)
-        self.attack_angles: Scalars = np.zeros(N, dtype=np.float64)
-        self.flight_path_angles: Scalars = np.zeros(N, dtype=np.float64)
-        self.roll_angles: Scalars = np.zeros(N, dtype=np.float64)
+        self.speeds = np.full(N, 0.001, dtype=self.dtype)
+        self.velocities = np.zeros((N, 3), dtype=self.dtype)
+        self.attack_angles: Scalars = np.zeros(N, dtype=self.dtype)
+        self.flight_path_angles: Scalars = np.zeros(N, dtype=self.dtype)
+        self.roll_angles: Scalars = np.zeros(N, dtype=self.dtype)
         # self.roll_angles: Scalars = np.array([np.pi / 2, -np.pi / 2])
-        self.azimuth_angles: Scalars = np.array(headings, dtype=np.float64)
+        self.azimuth_angles: Scalars = np.array(headings, dtype=self.dtype)
         # agent inputs
-        self.thrusts: Scalars = np.zeros(N, dtype=np.float64)
-        self.attack_angle_rates: Scalars = np.zeros(N, dtype=np.float64)
-        self.roll_angle_rates: Scalars = np.zeros(N, dtype=np.float64)
+        self.thrusts: Scalars = np.zeros(N, dtype=self.dtype)
+        self.attack_angle_rates: Scalars = np.zeros(N, dtype=self.dtype)
+        self.roll_angle_rates: Scalars = np.zeros(N, dtype=self.dtype)
         self.chosen_actions: Vectors = np.zeros((N, 3), dtype=np.float64)
+        # actions chosen so far, one per agent per decision
+        self.decisions = 0
+
+        # episode each agent belongs to, agents only interact within an episode
+        self.groups = np.zeros(N, dtype=np.int64)
+        self.running: npt.NDArray[np.bool_] = np.ones(N, dtype=bool)
 
         # capturing
         self.active: npt.NDArray[np.bool_] = np.ones(N, dtype=bool)
-        self.capture_buffer: Vectors = np.zeros((self.N, self.N), dtype=int)
-        self.distance_check: Vectors = np.zeros((self.N, self.N), dtype=bool)
-        self.nose_check: Vectors = np.zeros((self.N, self.N), dtype=bool)
-        self.asymmetry_check: Vectors = np.zeros((self.N, self.N), dtype=bool)
-
-    def step(self) -> list[tuple[int, int]]:
-        new_thrusts = np.zeros(self.N, dtype=np.float64)
-        new_attack_angle_rates = np.zeros(self.N, dtype=np.float64)
-        new_roll_angle_rates = np.zeros(self.N, dtype=np.float64)
-
-        (
-            projected_positions,
-            projected_velocities,
-            _,
-            _,
-            _,
-            _,
-            _,
-        ) = forward_project(
-            MDPConfig.FORWARD_PROJECTION_STEPS,
-            self.positions,
-            self.speeds,
-            self.attack_angles,
-            self.flight_path_angles,
-            self.roll_angles,
-            self.azimuth_angles,
-            new_thrusts,
-            new_attack_angle_rates,
-            new_roll_angle_rates,
+        # sparse capture buffer, see detect_captures
+        self.capture_keys: npt.NDArray[np.int64] = np.zeros(0, dtype=np.int64)
+        self.capture_counts: npt.NDArray[np.int64] = np.zeros(0, dtype=np.int64)
+        # (pursuer, evader) pairs in capture range, with their nose/asymmetry checks
+        self.capture_pairs: npt.NDArray[np.int64] = np.zeros((0, 2), dtype=np.int64)
+        self.capture_checks: npt.NDArray[np.bool_] = np.zeros((0, 2), dtype=bool)
+
+        # state arrays are updated in place, with scratch space from here
+        self.workspace = Workspace(N, self.params.seed)
+        # the distilled policy, loaded from DISTILLED_POLICY on first use, and
+        # the decision cache, made on first use
+        self.policy: DistilledPolicy | None = None
+        self.decision_cache: DecisionCache | None = None
+
+    @property
+    def groups(self) -> npt.NDArray[np.int64]:
+        return self._groups
+
+    @groups.setter
+    def groups(self, groups: npt.NDArray[np.int64]):
+        # every agent's opponents are built on first use (see opponent_table)
+        self._groups = groups
+        self.opponents: Opponents | None = None
+        self.opponents_live = np.ones(groups.shape[0], dtype=bool)
+
+    def opponent_table(self, live: npt.NDArray[np.bool_]) -> Opponents:
+        # Every live agent's live opponents (see group_opponents), built on
+        # first use, as only scoring every opponent needs them, so captured
+        # agents and finished episodes are neither projected against nor
+        # scored. Agents that stop being live are dropped from it in place; it
+        # is only rebuilt if agents become live again (on restore)
+        if self.opponents is None or (live & ~self.opponents_live).any():
+            self.opponents = group_opponents(self.groups, live)
+        elif not np.array_equal(live, self.opponents_live):
+            drop_opponents(self.opponents, self.groups, self.opponents_live & ~live)
+        np.copyto(self.opponents_live, live)
+        return self.opponents
+
+    def bounds(self) -> tuple[Scalars, ...]:
+        return (
             self.velocity_mins,
             self.velocity_maxs,
             self.azimuth_rate_mins,
@@ -259,159 +166,418 @@ class Simulation:
             self.attack_angle_maxs,
         )
 
-        # determine each agent's action via MDP
-        for i in range(self.N):
-            if not self.active[i]:
-                continue
-            mdp = MDP(
-                i,
-                self.thrust_ratio[i],
-                self.attack_angle_ratio[i],
-                self.roll_angle_ratio[i],
-                self.positions,
-                self.speeds,
-                self.attack_angles,
-                self.flight_path_angles,
-                self.roll_angles,
-                self.azimuth_angles,
-                self.thrusts,
-                self.attack_angle_rates,
-                self.roll_angle_rates,
-                projected_positions,
-                projected_velocities,
-                # self.positions.copy(),
-                # self.velocities.copy(),
-                self.velocity_mins,
-                self.velocity_maxs,
-                self.azimuth_rate_mins,
-                self.azimuth_rate_maxs,
-                self.attack_angle_mins,
-                self.attack_angle_maxs,
+    def decide(self, params: Params | None = None):
+        # Projects every live agent and writes the action, reward and
+        # evaluation count of each active one due to decide into the workspace,
+        # with self.params or the given planner settings. Agents the distilled
+        # policy decides for are marked in workspace.distilled, and those
+        # reusing a cached decision in workspace.cached; neither scores any
+        # actions (no reward, no evaluations)
+        params = self.params if params is None else params
+        workspace = self.workspace
+        np.logical_and(self.active, self.running, out=workspace.live)
+        np.less_equal(workspace.countdown, 0, out=workspace.deciding)
+        np.logical_and(workspace.deciding, workspace.live, out=workspace.deciding)
+        workspace.distilled.fill(False)
+        workspace.cached.fill(False)
+        if not workspace.deciding.any():
+            # every agent holds its action, so there is nothing to project for
+            workspace.actions.fill(0.0)
+            workspace.rewards.fill(0.0)
+            workspace.evaluations.fill(0)
+            return
+
+        kernel_for(integrate_into, params)(
+            params.forward_projection_steps,
+            workspace.live,
+            self.positions,
+            self.speeds,
+            self.attack_angles,
+            self.flight_path_angles,
+            self.roll_angles,
+            self.azimuth_angles,
+            workspace.no_input,
+            workspace.no_input,
+            workspace.no_input,
+            *self.bounds(),
+            workspace.projected_positions,
+            workspace.projected_velocities,
+            *workspace.projected_scalars,
+            params,
+        )
+        unit_vectors_into(
+            workspace.projected_velocities, workspace.projected_directions
+        )
+
+        if params.motion_primitives and workspace.primitive_params is not params:
+            # the tables for these settings, tabulated on first use
+            workspace.primitives = load_primitives(
+                self.action_ratios, self.bounds(), params
             )
-            action = mdp.find_action()
-            self.chosen_actions[i] = action
-            new_thrusts[i] = action[0]
-            new_attack_angle_rates[i] = action[1]
-            new_roll_angle_rates[i] = action[2]
-
-        # update all agents with their chosen action
-        self.thrusts = new_thrusts
-        self.attack_angle_rates = new_attack_angle_rates
-        self.roll_angle_rates = new_roll_angle_rates
-
-        # step each agent with their action and update the state
-        self.positions, self.velocities, self.speeds, self.attack_angles, self.flight_path_angles, self.roll_angles, self.azimuth_angles = (  # type: ignore
-            step_agents(
-                self.positions,
-                self.speeds,
-                self.attack_angles,
-                self.flight_path_angles,
-                self.roll_angles,
-                self.azimuth_angles,
-                self.thrusts,
-                self.attack_angle_rates,
-                self.roll_angle_rates,
-                self.velocity_mins,
-                self.velocity_maxs,
-                self.azimuth_rate_mins,
-                self.azimuth_rate_maxs,
-                self.attack_angle_mins,
-                self.attack_angle_maxs,
+            workspace.primitive_params = params
+
+        # the distilled policy decides for agents clear of every opponent,
+        # leaving the planner those near one
+        planning = workspace.deciding
+        if params.policy == POLICIES.index("distilled"):
+            self.separating()
+            np.greater_equal(
+                workspace.separations,
+                params.distilled_fallback_range,
+                out=workspace.distilled,
+            )
+            np.logical_and(
+                workspace.distilled, workspace.deciding, out=workspace.distilled
+            )
+            planning = workspace.deciding & ~workspace.distilled
+
+        # agents in a situation the cache holds a decision for reuse it
+        keys: list[bytes] = []
+        if params.decision_cache_size > 0:
+            cache = self.decision_cache
+            if cache is None or cache.size != params.decision_cache_size:
+                cache = self.decision_cache = DecisionCache(params.decision_cache_size)
+            agents = np.flatnonzero(planning)
+            keys = decision_keys(self, agents, params)
+            hits = [cache.get(key) for key in keys]
+            workspace.cached[agents] = [indices is not None for indices in hits]
+            planning = planning & ~workspace.cached
+
+        # determine every planned agent's action in one pass, against only the
+        # nearest opponents if NEAREST_OPPONENTS says so (see find_opponents)
+        if scores_nearest(params.nearest_opponents, self.groups, workspace.live):
+            opponents = nearest_neighbours(
+                workspace.projected_positions,
+                workspace.live,
+                self.groups,
+                params.nearest_opponents,
             )
+        else:
+            opponents = self.opponent_table(workspace.live)
+        kernel_for(find_actions_into, params)(
+            self.action_ratios,
+            self.positions,
+            self.speeds,
+            self.attack_angles,
+            self.flight_path_angles,
+            self.roll_angles,
+            self.azimuth_angles,
+            workspace.projected_positions,
+            workspace.projected_directions,
+            opponents,
+            *self.bounds(),
+            planning,
+            workspace.actions,
+            workspace.rewards,
+            workspace.evaluations,
+            workspace.planner_state,
+            workspace.scratch_for(params),
+            workspace.primitives,
+            params,
         )
 
-        self.timestep += 1
-        # return -1
-        return self.capturing()
-
-    def capturing(self) -> list[tuple[int, int]]:
-        captures: list[tuple[int, int]] = []
-        captured_evaders: set[int] = set()
-
-        for pursuer in range(self.N):
-            if not self.active[pursuer]:
-                continue
-            for evader in range(self.N):
-                if (
-                    pursuer == evader
-                    or not self.active[evader]
-                    or evader in captured_evaders
-                ):
-                    continue
-
-                # Distance check
-                r_pe = self.positions[evader] - self.positions[pursuer]
-                d = np.linalg.norm(r_pe)
-                distance_check = d < SimulationConfig.CAPTURE_RADIUS
-
-                # Nose directions from flight path, attack and azimuth angles
-                pursuer_nose = np.array(
-                    [
-                        np.cos(
-                            self.flight_path_angles[pursuer]
-                            + self.attack_angles[pursuer]
-                        )
-                        * np.cos(self.azimuth_angles[pursuer]),
-                        np.cos(
-                            self.flight_path_angles[pursuer]
-                            + self.attack_angles[pursuer]
-                        )
-                        * np.sin(self.azimuth_angles[pursuer]),
-                        np.sin(
-                            self.flight_path_angles[pursuer]
-                            + self.attack_angles[pursuer]
-                        ),
-                    ]
-                )
-                evader_nose = np.array(
-                    [
-                        np.cos(
-                            self.flight_path_angles[evader] + self.attack_angles[evader]
-                        )
-                        * np.cos(self.azimuth_angles[evader]),
-                        np.cos(
-                            self.flight_path_angles[evader] + self.attack_angles[evader]
+        if keys:
+            # cached decisions are reused, and new ones remembered
+            axes = (
+                params.action_thrusts,
+                params.action_attack_angle_rates,
+                params.action_roll_angle_rates,
+            )
+            planned = action_indices(
+                workspace.actions[agents], self.action_ratios[agents], params
+            )
+            for row, (i, key, indices) in enumerate(zip(agents, keys, hits)):
+                if indices is None:
+                    cache.put(key, tuple(int(index) for index in planned[row]))
+                else:
+                    workspace.actions[i] = [
+                        axis[index] * ratio
+                        for axis, index, ratio in zip(
+                            axes, indices, self.action_ratios[i]
                         )
-                        * np.sin(self.azimuth_angles[evader]),
-                        np.sin(
-                            self.flight_path_angles[evader] + self.attack_angles[evader]
-                        ),
                     ]
-                )
 
-                r_pe_hat = r_pe / d
-                r_ep_hat = -r_pe_hat
+        if workspace.distilled.any():
+            if self.policy is None:
+                self.policy = load_policy()
+            agents = np.flatnonzero(workspace.distilled)
+            workspace.actions[agents] = policy_actions(
+                self.policy, self, agents, params
+            )
 
-                # Pursuer nose pointing at evader within 50 degrees
-                pursuer_alignment = np.dot(pursuer_nose, r_pe_hat)
-                nose_check = pursuer_alignment >= np.cos(np.deg2rad(50))
+    def decide_aside(self, params: Params):
+        # decide() with other settings, to compare against, leaving the
+        # planners' state as it was so the run goes on as if it never happened.
+        # Give settings without the decision cache (decision_cache_size 0), so
+        # it is neither consulted nor changed
+        planner_state = [array.copy() for array in self.workspace.planner_state]
+        self.decide(params)
+        for array, saved in zip(self.workspace.planner_state, planner_state):
+            np.copyto(array, saved)
+
+    def step(self, decided: bool = False) -> list[tuple[int, int]]:
+        # only live agents (active and running) are projected, stepped and
+        # checked for captures. decided says the workspace already holds this
+        # step's decision, from decide() since the last step, so it is not
+        # made again
+        workspace = self.workspace
+        if not decided:
+            self.decide()
+        np.copyto(
+            self.chosen_actions, workspace.actions, where=workspace.deciding[:, None]
+        )
+        self.decisions += int(np.count_nonzero(workspace.deciding))
+
+        # update the deciding agents with their chosen action, the others that
+        # are live hold theirs and the rest have no input
+        np.logical_not(workspace.live, out=workspace.update)
+        np.logical_or(workspace.update, workspace.deciding, out=workspace.update)
+        np.copyto(self.thrusts, workspace.actions[:, 0], where=workspace.update)
+        np.copyto(
+            self.attack_angle_rates, workspace.actions[:, 1], where=workspace.update
+        )
+        np.copyto(
+            self.roll_angle_rates, workspace.actions[:, 2], where=workspace.update
+        )
 
-                # Pursuer has meaningfully better alignment than evader
-                evader_alignment = np.dot(evader_nose, r_ep_hat)
-                asymmetry_check = pursuer_alignment > evader_alignment + 0.2
+        # distances to opponents set how many ticks this step integrates, but
+        # no further than the end of the run
+        params = self.params
+        separation = np.inf
+        if params.max_step_ticks > 1:
+            separation = self.separating()
+        ticks = range_steps(
+            separation,
+            params.max_step_ticks,
+            params.step_near_range,
+            params.step_far_range,
+        )
+        ticks = max(min(ticks, SimulationConfig.MAX_TIMESTEPS - self.timestep), 1)
+        if ticks > 1:
+            params = params._replace(dt=ticks * params.dt)
 
-                self.distance_check[pursuer][evader] = distance_check
-                self.nose_check[pursuer][evader] = nose_check
-                self.asymmetry_check[pursuer][evader] = asymmetry_check
+        # step each agent with their action, in place
+        state = (
+            self.positions,
+            self.speeds,
+            self.attack_angles,
+            self.flight_path_angles,
+            self.roll_angles,
+            self.azimuth_angles,
+        )
+        kernel_for(integrate_into, params)(
+            1,
+            workspace.live,
+            *state,
+            self.thrusts,
+            self.attack_angle_rates,
+            self.roll_angle_rates,
+            *self.bounds(),
+            state[0],
+            self.velocities,
+            *state[1:],
+            params,
+        )
+        # and, from where the agents now are, how long deciding agents hold
+        # their actions
+        if params.decision_interval > 1:
+            self.separating()
+        schedule_decisions_into(
+            workspace.separations,
+            workspace.live,
+            workspace.deciding,
+            workspace.countdown,
+            ticks,
+            self.params,
+        )
 
-                if distance_check and nose_check and asymmetry_check:
-                    self.capture_buffer[evader][pursuer] += 1
-                else:
-                    self.capture_buffer[evader][pursuer] = 0
+        self.timestep += ticks
+        self.steps += 1
+        # return -1
+        return self.capturing(ticks)
 
-                if (
-                    self.capture_buffer[evader][pursuer]
-                    >= SimulationConfig.CAPTURE_POINT_STEPS
-                ):
-                    captures.append((evader, pursuer))
-                    captured_evaders.add(evader)
+    def separating(self) -> float:
+        # Each live agent's distance to its nearest live opponent, into the
+        # workspace's separations, and the least of them
+        workspace = self.workspace
+        return nearest_opponent_distances_into(
+            self.positions,
+            workspace.live,
+            self.groups,
+            workspace.cells,
+            workspace.head,
+            workspace.following,
+            workspace.nearest_opponent,
+            workspace.separations,
+        )
 
-        for evader, _ in captures:
-            self.active[evader] = False
-            self.capture_buffer[evader] = 0
-            self.capture_buffer[:, evader] = 0
+    @property
+    def capture_buffer(self) -> dict[tuple[int, int], int]:
+        # (evader, pursuer) pairs in position, with the ticks they have been
+        return {
+            (int(key // self.N), int(key % self.N)): int(count)
+            for key, count in zip(self.capture_keys, self.capture_counts)
+        }
+
+    def capturing(self, ticks: int = 1) -> list[tuple[int, int]]:
+        # capture_keys, capture_counts, capture_pairs and capture_checks are
+        # views into the workspace, valid until the next call
+        workspace = self.workspace
+        np.logical_and(self.active, self.running, out=workspace.live)
+        while True:
+            pair_count, count, entries = detect_captures_into(
+                self.positions,
+                self.flight_path_angles,
+                self.attack_angles,
+                self.azimuth_angles,
+                workspace.live,
+                self.groups,
+                self.capture_keys,
+                self.capture_counts,
+                workspace.cells,
+                workspace.head,
+                workspace.following,
+                workspace.pairs,
+                workspace.checks,
+                workspace.captures,
+                workspace.captured,
+                workspace.keys[workspace.side],
+                workspace.counts[workspace.side],
+                ticks,
+                self.params,
+            )
+            if pair_count <= workspace.pairs.shape[0]:
+                break
+            workspace.grow_pairs(2 * pair_count)
+
+        self.capture_keys = workspace.keys[workspace.side, :entries]
+        self.capture_counts = workspace.counts[workspace.side, :entries]
+        workspace.side = 1 - workspace.side
+        self.capture_pairs = workspace.pairs[:pair_count]
+        self.capture_checks = workspace.checks[:pair_count]
+
+        captures = workspace.captures[:count]
+        if count:
+            self.active[captures[:, 0]] = False
+        return [(int(evader), int(pursuer)) for evader, pursuer in captures]
+
+    # state arrays a snapshot holds, beside the counters, planner state, params
+    # and decision cache
+    SNAPSHOT_ARRAYS = (
+        "action_ratios",
+        "velocity_mins",
+        "velocity_maxs",
+        "azimuth_rate_mins",
+        "azimuth_rate_maxs",
+        "attack_angle_mins",
+        "attack_angle_maxs",
+        "positions",
+        "speeds",
+        "velocities",
+        "attack_angles",
+        "flight_path_angles",
+        "roll_angles",
+        "azimuth_angles",
+        "thrusts",
+        "attack_angle_rates",
+        "roll_angle_rates",
+        "chosen_actions",
+        "groups",
+        "running",
+        "active",
+        "capture_keys",
+        "capture_counts",
+        "capture_pairs",
+        "capture_checks",
+    )
 
-        return captures
+    def snapshot_arrays(self) -> dict[str, npt.NDArray]:
+        # Everything stepping on from here depends on, as arrays: the state
+        # arrays, timestep and counters, when each agent next decides, the
+        # planners' state, params and the decision cache's entries in
+        # least recently used order
+        arrays = {name: getattr(self, name) for name in self.SNAPSHOT_ARRAYS}
+        arrays["counters"] = np.array([self.timestep, self.steps, self.decisions])
+        arrays["countdown"] = self.workspace.countdown
+        for field, value in self.workspace.planner_state._asdict().items():
+            arrays[f"planner_{field}"] = value
+        for field, value in self.params._asdict().items():
+            arrays[f"params_{field}"] = np.asarray(value)
+
+        cache = self.decision_cache
+        keys = [] if cache is None else list(cache.entries)
+        arrays["cache"] = np.array(
+            [-1, 0, 0, 0]
+            if cache is None
+            else [cache.size, cache.hits, cache.misses, cache.evictions]
+        )
+        arrays["cache_keys"] = np.frombuffer(b"".join(keys), dtype=np.uint8)
+        arrays["cache_key_lengths"] = np.array([len(key) for key in keys], dtype=int)
+        arrays["cache_indices"] = np.array(
+            [] if cache is None else list(cache.entries.values()), dtype=int
+        ).reshape(-1, 3)
+        return arrays
+
+    def restore_arrays(self, arrays: Mapping[str, npt.NDArray]):
+        # Sets this simulation to the state snapshot_arrays gave, which must
+        # have been of as many agents
+        if arrays["positions"].shape[0] != self.N:
+            raise ValueError(
+                f"snapshot of {arrays['positions'].shape[0]} agents, not {self.N}"
+            )
+        for name in self.SNAPSHOT_ARRAYS:
+            setattr(self, name, arrays[name].copy())
+        self.dtype = self.positions.dtype
+        self.thrust_ratio, self.attack_angle_ratio, self.roll_angle_ratio = (
+            self.action_ratios.T.tolist()
+        )
+        self.timestep, self.steps, self.decisions = (int(n) for n in arrays["counters"])
+        self.params = configured_params(
+            **{field: arrays[f"params_{field}"] for field in Params._fields}
+        )
+
+        workspace = self.workspace
+        np.copyto(workspace.countdown, arrays["countdown"])
+        for field, value in workspace.planner_state._asdict().items():
+            np.copyto(value, arrays[f"planner_{field}"])
+        workspace.primitive_params = None
+
+        size, hits, misses, evictions = (int(n) for n in arrays["cache"])
+        self.decision_cache = None
+        if size >= 0:
+            cache = self.decision_cache = DecisionCache(size)
+            ends = np.cumsum(arrays["cache_key_lengths"])
+            keys = arrays["cache_keys"].tobytes()
+            for end, length, indices in zip(
+                ends, arrays["cache_key_lengths"], arrays["cache_indices"]
+            ):
+                cache.entries[keys[end - length : end]] = tuple(  # type: ignore
+                    int(index) for index in indices
+                )
+            cache.hits, cache.misses, cache.evictions = hits, misses, evictions
+
+    def snapshot(self) -> bytes:
+        # snapshot_arrays as one uncompressed npz blob, for restore
+        buffer = BytesIO()
+        np.savez(buffer, **self.snapshot_arrays())
+        return buffer.getvalue()
+
+    def restore(self, snapshot: bytes):
+        # Sets this simulation to the state a snapshot of a simulation of as
+        # many agents (of the same class) was taken in, so stepping on repeats
+        # what the snapshotted one did
+        with np.load(BytesIO(snapshot), allow_pickle=False) as arrays:
+            self.restore_arrays(arrays)
+
+    def fork(self, params: Params | None = None) -> Simulation:
+        # A copy of this simulation that steps on independently, with params if
+        # given. Only what no step writes to is shared: the params, motion
+        # primitive tables and distilled policy
+        shared = (self.params, self.workspace.primitives, self.policy)
+        fork = copy.deepcopy(self, {id(value): value for value in shared})
+        if params is not None:
+            fork.params = params
+        return fork
 
 
 class SimulationManager:
@@ -422,6 +588,9 @@ class SimulationManager:
         self.logger = logger
 
     def setup(self, parameters: "SimulationParams"):
+        # numba thread counts are per calling thread, so set it where we step
+        threads = set_threads(SimulationConfig.THREADS)
+        self.logger.info(f"Stepping on {threads} thread(s).")
         self.simulation = Simulation(SimulationConfig.AGENTS, **parameters)  # type: ignore
 
     def run(
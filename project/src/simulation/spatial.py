@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+import numpy as np
+import numpy.typing as npt
+from numba import njit
+
+if TYPE_CHECKING:
+    from simulation.simulation import Vectors
+
+type Indices = npt.NDArray[np.int64]
+type Pairs = npt.NDArray[np.int64]
+
+
+@njit(cache=True)
+def cell_hash(x: int, y: int, z: int, group: int, table_size: int) -> int:
+    # table_size is a power of two, so the mask keeps negative cells in range
+    return ((x * 73856093) ^ (y * 19349663) ^ (z * 83492791) ^ (group * 50331653)) & (
+        table_size - 1
+    )
+
+
+@njit(cache=True)
+def bucket_count(N: int) -> int:
+    # hash table buckets for N agents, a power of two at least 2N
+    size = 1
+    while size < 2 * N:
+        size *= 2
+    return size
+
+
+@njit(cache=True)
+def build_grid_into(
+    positions: Vectors,
+    active: npt.NDArray[np.bool_],
+    groups: Indices,
+    cell_size: float,
+    cells: Pairs,
+    head: Indices,
+    following: Indices,
+) -> None:
+    # Uniform grid as a hashed cell list: head[bucket] is the first agent in the
+    # bucket and following[agent] the next one, -1 ending both. Agents in
+    # different groups (episodes) never share a cell
+    head[:] = -1
+    following[:] = -1
+    for i in range(positions.shape[0]):
+        for axis in range(3):
+            cells[i, axis] = np.int64(np.floor(positions[i, axis] / cell_size))
+        if not active[i]:
+            continue
+        bucket = cell_hash(
+            cells[i, 0], cells[i, 1], cells[i, 2], groups[i], head.shape[0]
+        )
+        following[i] = head[bucket]
+        head[bucket] = i
+
+
+@njit(cache=True)
+def build_grid(
+    positions: Vectors,
+    active: npt.NDArray[np.bool_],
+    groups: Indices,
+    cell_size: float,
+) -> tuple[Pairs, Indices, Indices]:
+    N = positions.shape[0]
+    cells = np.empty((N, 3), dtype=np.int64)
+    head = np.empty(bucket_count(N), dtype=np.int64)
+    following = np.empty(N, dtype=np.int64)
+    build_grid_into(positions, active, groups, cell_size, cells, head, following)
+    return cells, head, following
+
+
+@njit(cache=True)
+def pairs_within_into(
+    positions: Vectors,
+    active: npt.NDArray[np.bool_],
+    groups: Indices,
+    radius: float,
+    cells: Pairs,
+    head: Indices,
+    following: Indices,
+    pairs: Pairs,
+) -> int:
+    # Ordered (i, j) pairs of active agents in the same group closer than radius,
+    # sorted by i then j, found by searching the 27 grid cells around each agent.
+    # Returns how many there are; if that is more than pairs holds, pairs is
+    # incomplete and the caller should retry with a bigger one
+    build_grid_into(positions, active, groups, radius, cells, head, following)
+    table = head.shape[0]
+    capacity = pairs.shape[0]
+
+    count = 0
+    for i in range(positions.shape[0]):
+        if not active[i]:
+            continue
+        start = count
+        for dx in range(-1, 2):
+            for dy in range(-1, 2):
+                for dz in range(-1, 2):
+                    cx = cells[i, 0] + dx
+                    cy = cells[i, 1] + dy
+                    cz = cells[i, 2] + dz
+                    j = head[cell_hash(cx, cy, cz, groups[i], table)]
+                    while j != -1:
+                        # buckets can be shared, so check the cell really matches
+                        if (
+                            j != i
+                            and groups[j] == groups[i]
+                            and cells[j, 0] == cx
+                            and cells[j, 1] == cy
+                            and cells[j, 2] == cz
+                        ):
+                            rx = positions[j, 0] - positions[i, 0]
+                            ry = positions[j, 1] - positions[i, 1]
+                            rz = positions[j, 2] - positions[i, 2]
+                            if np.sqrt(rx**2 + ry**2 + rz**2) < radius:
+                                if count < capacity:
+                                    pairs[count, 0] = i
+                                    pairs[count, 1] = j
+                                count += 1
+                        j = following[j]
+
+        # insertion sort i's few neighbours by j
+        if count <= capacity:
+            for a in range(start + 1, count):
+                j = pairs[a, 1]
+                b = a
+                while b > start and pairs[b - 1, 1] > j:
+                    pairs[b, 1] = pairs[b - 1, 1]
+                    b -= 1
+                pairs[b, 1] = j
+
+    return count
+
+
+@njit(cache=True)
+def pairs_within(
+    positions: Vectors,
+    active: npt.NDArray[np.bool_],
+    groups: Indices,
+    radius: float,
+) -> Pairs:
+    N = positions.shape[0]
+    cells = np.empty((N, 3), dtype=np.int64)
+    head = np.empty(bucket_count(N), dtype=np.int64)
+    following = np.empty(N, dtype=np.int64)
+
+    pairs = np.empty((max(N, 1), 2), dtype=np.int64)
+    count = pairs_within_into(
+        positions, active, groups, radius, cells, head, following, pairs
+    )
+    if count > pairs.shape[0]:
+        pairs = np.empty((count, 2), dtype=np.int64)
+        pairs_within_into(
+            positions, active, groups, radius, cells, head, following, pairs
+        )
+    return pairs[:count]
+
+
+@njit(cache=True)
+def nearest_neighbours_into(
+    queries: Vectors,
+    positions: Vectors,
+    active: npt.NDArray[np.bool_],
+    groups: Indices,
+    cells: Pairs,
+    head: Indices,
+    following: Indices,
+    neighbours: Indices,
+    distances: npt.NDArray[np.float64],
+) -> None:
+    # Row i of neighbours holds the k (its width) other active agents in active
+    # agent i's group whose positions are nearest to queries[i], nearest first,
+    # and row i of distances their squared distances, -1 and inf padded (as are
+    # the rows of agents that aren't active). Found by searching grid shells
+    # outward until no unsearched cell can hold anything nearer than the current
+    # k-th neighbour
+    k = neighbours.shape[1]
+    neighbours[:] = -1
+    distances[:] = np.inf
+    agents = np.flatnonzero(active)
+    if agents.shape[0] < 2 or k < 1:
+        return
+
+    # cells sized for roughly one agent of each group over the occupied box
+    span = 0.0
+    for axis in range(3):
+        extent = positions[agents, axis].max() - positions[agents, axis].min()
+        span = max(span, extent)
+    group_size = agents.shape[0] / np.unique(groups[agents]).shape[0]
+    cell_size = max(span / group_size ** (1 / 3), 1.0)
+    build_grid_into(positions, active, groups, cell_size, cells, head, following)
+    table_size = head.shape[0]
+    max_shell = 0
+    for axis in range(3):
+        low = cells[agents[0], axis]
+        high = low
+        for i in agents:
+            query = np.int64(np.floor(queries[i, axis] / cell_size))
+            low = min(low, cells[i, axis], query)
+            high = max(high, cells[i, axis], query)
+        max_shell = max(max_shell, high - low)
+
+    for i in agents:
+        qx = np.int64(np.floor(queries[i, 0] / cell_size))
+        qy = np.int64(np.floor(queries[i, 1] / cell_size))
+        qz = np.int64(np.floor(queries[i, 2] / cell_size))
+        for shell in range(max_shell + 1):
+            for dx in range(-shell, shell + 1):
+                for dy in range(-shell, shell + 1):
+                    for dz in range(-shell, shell + 1):
+                        if max(abs(dx), abs(dy), abs(dz)) != shell:
+                            continue
+                        cx = qx + dx
+                        cy = qy + dy
+                        cz = qz + dz
+                        j = head[cell_hash(cx, cy, cz, groups[i], table_size)]
+                        while j != -1:
+                            if (
+                                j != i
+                                and groups[j] == groups[i]
+                                and cells[j, 0] == cx
+                                and cells[j, 1] == cy
+                                and cells[j, 2] == cz
+                            ):
+                                d = (
+                                    (positions[j, 0] - queries[i, 0]) ** 2
+                                    + (positions[j, 1] - queries[i, 1]) ** 2
+                                    + (positions[j, 2] - queries[i, 2]) ** 2
+                                )
+                                # insert into the sorted k nearest so far
+                                slot = k
+                                while slot > 0 and d < distances[i, slot - 1]:
+                                    slot -= 1
+                                if slot < k:
+                                    for s in range(k - 1, slot, -1):
+                                        distances[i, s] = distances[i, s - 1]
+                                        neighbours[i, s] = neighbours[i, s - 1]
+                                    distances[i, slot] = d
+                                    neighbours[i, slot] = j
+                            j = following[j]
+
+            # anything outside the searched shells is at least shell cells away
+            if distances[i, k - 1] <= (shell * cell_size) ** 2:
+                break
+
+
+@njit(cache=True)
+def nearest_neighbours(
+    positions: Vectors, active: npt.NDArray[np.bool_], groups: Indices, k: int
+) -> Indices:
+    # Row i holds the k active agents in its group nearest to active agent i,
+    # nearest first and -1 padded (see nearest_neighbours_into)
+    N = positions.shape[0]
+    cells = np.empty((N, 3), dtype=np.int64)
+    head = np.empty(bucket_count(N), dtype=np.int64)
+    following = np.empty(N, dtype=np.int64)
+    neighbours = np.empty((N, max(k, 0)), dtype=np.int64)
+    distances = np.empty((N, max(k, 0)), dtype=np.float64)
+    nearest_neighbours_into(
+        positions,
+        positions,
+        active,
+        groups,
+        cells,
+        head,
+        following,
+        neighbours,
+        distances,
+    )
+    return neighbours
+
+
+@njit(cache=True)
+def nearest_opponent_distances_into(
+    positions: Vectors,
+    live: npt.NDArray[np.bool_],
+    groups: Indices,
+    cells: Pairs,
+    head: Indices,
+    following: Indices,
+    nearest: Indices,
+    out: npt.NDArray[np.float64],
+) -> float:
+    # Writes each live agent's distance to its nearest live opponent (inf if it
+    # has none, and for agents that aren't live) into out, returning the least.
+    # nearest is (N, 1) scratch for nearest_neighbours_into
+    nearest_neighbours_into(
+        positions,
+        positions,
+        live,
+        groups,
+        cells,
+        head,
+        following,
+        nearest,
+        out.reshape((out.shape[0], 1)),
+    )
+    least = np.inf
+    for i in range(out.shape[0]):
+        out[i] = np.sqrt(out[i])
+        least = min(least, out[i])
+    return least
+
+
+@njit(cache=True)
+def range_steps(distance: float, longest: int, near: float, far: float) -> int:
+    # 1 within near of an opponent, longest beyond far, in proportion between
+    if longest <= 1 or distance <= near:
+        return 1
+    if distance >= far:
+        return longest
+    return 1 + int((longest - 1) * (distance - near) / (far - near))
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+from time import perf_counter
+from typing import TYPE_CHECKING, TypedDict
+import numpy as np
+import numpy.typing as npt
+
+from configs import simulation as SimulationConfig
+from configs.parameters import BASE
+from simulation.kinematics import forward_project
+from simulation.params import INTEGRATORS, Params, configured_params
+from simulation.simulation import Simulation
+from validation.scenarios import SCENARIOS, Scenario
+
+if TYPE_CHECKING:
+    from configs.parameters import SimulationParams
+
+
+class Run(TypedDict):
+    seconds: float
+    steps: int
+    captures: list[tuple[int, int, int]]
+
+
+class SteppingReport(TypedDict):
+    fixed: Run
+    adaptive: Run
+    # distance between the two runs' agents at the end, over agents still
+    # active in both
+    mean_position_error: float
+    max_position_error: float
+
+
+def run_for(
+    N: int, parameters: SimulationParams, params: Params, seconds: float
+) -> tuple[Simulation, Run]:
+    # Runs a simulation until seconds of simulated time have passed or at most
+    # one agent is left, timing it
+    simulation = Simulation(N, **parameters, params=params)  # type: ignore
+    ticks = int(round(seconds * SimulationConfig.STEPS_PER_SECOND))
+    captures: list[tuple[int, int, int]] = []
+
+    start = perf_counter()
+    while simulation.timestep < ticks:
+        for evader, pursuer in simulation.step():
+            captures.append((simulation.timestep, evader, pursuer))
+        if np.sum(simulation.active) <= 1:
+            break
+    elapsed = perf_counter() - start
+
+    return simulation, {
+        "seconds": elapsed,
+        "steps": simulation.steps,
+        "captures": captures,
+    }
+
+
+def compare_stepping(
+    N: int,
+    parameters: SimulationParams,
+    seconds: float,
+    params: Params | None = None,
+) -> SteppingReport:
+    # Runs the same scenario with fixed single-tick steps and with params'
+    # adaptive steps, reporting each run's cost and captures and how far apart
+    # the agents end up
+    params = configured_params() if params is None else params
+    fixed, fixed_run = run_for(
+        N, parameters, params._replace(max_step_ticks=1), seconds
+    )
+    adaptive, adaptive_run = run_for(N, parameters, params, seconds)
+
+    both = fixed.active & adaptive.active
+    errors = np.sqrt(
+        np.sum((fixed.positions[both] - adaptive.positions[both]) ** 2, axis=1)
+    )
+    return {
+        "fixed": fixed_run,
+        "adaptive": adaptive_run,
+        "mean_position_error": float(errors.mean()) if errors.size else 0.0,
+        "max_position_error": float(errors.max()) if errors.size else 0.0,
+    }
+
+
+class KinematicCase(TypedDict):
+    name: str
+    g: float
+    # x, y, z, speed, attack, flight path, roll and azimuth angle
+    state: tuple[float, float, float, float, float, float, float, float]
+    # thrust, attack angle rate and roll angle rate
+    controls: tuple[float, float, float]
+
+
+# tests/simulation/test_kinematics.py's cases, and a hard pulling roll like the
+# MDP's actions
+KINEMATIC_CASES: list[KinematicCase] = [
+    {
+        "name": "no_gravity_straight_flight",
+        "g": 0.0,
+        "state": (0.0, 0.0, 0.0, 100.0, 0.0, 0.0, 0.0, 0.0),
+        "controls": (0.0, 0.0, 0.0),
+    },
+    {
+        "name": "level_flight_with_thrust",
+        "g": 9.81,
+        "state": (0.0, 0.0, 1000.0, 0.0, 0.0, 0.0, 0.0, 0.0),
+        "controls": (0.0, 0.0, 0.0),
+    },
+    {
+        "name": "level_turn",
+        "g": 9.81,
+        "state": (0.0, 0.0, 1000.0, 100.0, 0.0, 0.0, np.deg2rad(30), 0.0),
+        "controls": (0.0, 0.0, 0.0),
+    },
+    {
+        "name": "climb",
+        "g": 9.81,
+        "state": (0.0, 0.0, 1000.0, 100.0, 0.0, np.deg2rad(10), 0.0, 0.0),
+        "controls": (np.sin(np.deg2rad(10)), 0.0, 0.0),
+    },
+    {
+        "name": "dive",
+        "g": 9.81,
+        "state": (0.0, 0.0, 1000.0, 100.0, 0.0, np.deg2rad(-10), 0.0, 0.0),
+        "controls": (np.sin(np.deg2rad(-10)), 0.0, 0.0),
+    },
+    {
+        "name": "pulling_roll",
+        "g": 9.81,
+        "state": (0.0, 0.0, 1000.0, 150.0, 0.3, 0.0, 0.0, 0.0),
+        "controls": (0.5, 0.1, 0.5),
+    },
+]
+
+
+class IntegratorError(TypedDict):
+    case: str
+    integrator: str
+    steps_per_second: int
+    # distance and speed difference from the reference at the end
+    position_error: float
+    speed_error: float
+
+
+def integrate_case(
+    case: KinematicCase, seconds: float, steps_per_second: int, params: Params
+) -> tuple[np.ndarray, float]:
+    # A case's position and speed after seconds at steps_per_second, with the
+    # test cases' permissive bounds
+    M = float(SimulationConfig.MACH)
+    x, y, z, speed, *angles = case["state"]
+    projected = forward_project(
+        int(round(seconds * steps_per_second)),
+        np.array([[x, y, z]]),
+        np.array([speed]),
+        *(np.array([angle]) for angle in angles),
+        *(np.array([control]) for control in case["controls"]),
+        np.array([1e-6]),
+        np.array([10.0 * M]),
+        np.array([-1e6]),
+        np.array([1e6]),
+        np.array([-np.pi / 2 + 1e-3]),
+        np.array([np.pi / 2 - 1e-3]),
+        params._replace(g=case["g"], dt=1.0 / steps_per_second),
+    )
+    return projected[0][0], float(projected[2][0])
+
+
+def integrator_errors(
+    seconds: float = 1.0,
+    rates: tuple[int, ...] = (20, 10, 5),
+    reference_rate: int = 1000,
+    cases: list[KinematicCase] = KINEMATIC_CASES,
+) -> list[IntegratorError]:
+    # Every integrator's error on every case at each rate, against RK4 at
+    # reference_rate steps per second
+    params = configured_params()
+    errors: list[IntegratorError] = []
+    for case in cases:
+        position, speed = integrate_case(
+            case,
+            seconds,
+            reference_rate,
+            params._replace(integrator=INTEGRATORS.index("rk4")),
+        )
+        for integrator, name in enumerate(INTEGRATORS):
+            for rate in rates:
+                stepped_position, stepped_speed = integrate_case(
+                    case, seconds, rate, params._replace(integrator=integrator)
+                )
+                errors.append(
+                    {
+                        "case": case["name"],
+                        "integrator": name,
+                        "steps_per_second": rate,
+                        "position_error": float(
+                            np.sqrt(np.sum((stepped_position - position) ** 2))
+                        ),
+                        "speed_error": abs(stepped_speed - speed),
+                    }
+                )
+    return errors
+
+
+class Drift(TypedDict):
+    scenario: str
+    # (timestep, captured, capturer) in the reference run and in the variant
+    reference_captures: list[tuple[int, int, int]]
+    variant_captures: list[tuple[int, int, int]]
+    # the same agents captured by the same pursuers in the same order, and
+    # the largest difference in when (ticks, -1 if the outcomes differ)
+    same_outcome: bool
+    max_timing_difference: int
+    # distance between the runs' agents, and the largest difference in any of
+    # their attack, flight path, roll or azimuth angles, over agents active in
+    # both, at their largest while both ran; and the first timestep the
+    # distance exceeded tolerance (-1 for never)
+    max_position_error: float
+    max_angle_error: float
+    divergence_timestep: int
+
+
+def scenario_simulation(
+    scenario: Scenario, params: Params, dtype: npt.DTypeLike
+) -> Simulation:
+    # A validation scenario with BASE's bounds and ratios, as validate.py sets
+    # it up
+    N = len(scenario["positions"])
+    parameters = {key: values[:1] * N for key, values in BASE.items()}
+    parameters["positions"] = scenario["positions"]
+    parameters["headings"] = scenario["azimuth_angles"]
+    simulation = Simulation(N, **parameters, params=params, dtype=dtype)  # type: ignore
+    simulation.speeds[:] = scenario["velocities"]
+    return simulation
+
+
+def scenario_drift(
+    scenario: Scenario,
+    reference: Simulation,
+    variant: Simulation,
+    ticks: int,
+    tolerance: float,
+) -> Drift:
+    # Steps two simulations of a scenario side by side for up to ticks ticks,
+    # each ending as SimulationManager.run does, and compares their captures
+    # and trajectories whenever they are at the same timestep
+    simulations = (reference, variant)
+    captures: list[list[tuple[int, int, int]]] = [[], []]
+    running = [True, True]
+    max_position_error = 0.0
+    max_angle_error = 0.0
+    divergence = -1
+    while any(running):
+        for k, simulation in enumerate(simulations):
+            if not running[k]:
+                continue
+            for evader, pursuer in simulation.step():
+                captures[k].append((simulation.timestep, evader, pursuer))
+            running[k] = simulation.timestep < ticks and np.sum(simulation.active) > 1
+
+        if reference.timestep != variant.timestep:
+            continue
+        both = reference.active & variant.active
+        if not both.any():
+            continue
+        position_error = float(
+            np.sqrt(
+                np.sum(
+                    (reference.positions[both] - variant.positions[both]) ** 2, axis=1
+                )
+            ).max()
+        )
+        angles = [
+            np.abs(np.angle(np.exp(1j * (mine[both] - theirs[both])))).max()
+            for mine, theirs in (
+                (reference.attack_angles, variant.attack_angles),
+                (reference.flight_path_angles, variant.flight_path_angles),
+                (reference.roll_angles, variant.roll_angles),
+                (reference.azimuth_angles, variant.azimuth_angles),
+            )
+        ]
+        max_position_error = max(max_position_error, position_error)
+        max_angle_error = max(max_angle_error, float(max(angles)))
+        if divergence < 0 and position_error > tolerance:
+            divergence = reference.timestep
+
+    same = [c[1:] for c in captures[0]] == [c[1:] for c in captures[1]]
+    return {
+        "scenario": scenario["name"],
+        "reference_captures": captures[0],
+        "variant_captures": captures[1],
+        "same_outcome": same,
+        "max_timing_difference": (
+            max((abs(a[0] - b[0]) for a, b in zip(*captures)), default=0)
+            if same
+            else -1
+        ),
+        "max_position_error": max_position_error,
+        "max_angle_error": max_angle_error,
+        "divergence_timestep": divergence,
+    }
+
+
+def precision_drift(
+    seconds: float = SimulationConfig.MAX_TIMESTEPS / SimulationConfig.STEPS_PER_SECOND,
+    scenarios: list[Scenario] = SCENARIOS,
+    tolerance: float = 1.0,
+    params: Params | None = None,
+) -> list[Drift]:
+    # Every scenario with float64 state (the reference) against float32 state,
+    # see scenario_drift
+    params = configured_params() if params is None else params
+    ticks = int(round(seconds * SimulationConfig.STEPS_PER_SECOND))
+    return [
+        scenario_drift(
+            scenario,
+            scenario_simulation(scenario, params, np.float64),
+            scenario_simulation(scenario, params, np.float32),
+            ticks,
+            tolerance,
+        )
+        for scenario in scenarios
+    ]
+
+
+def fastmath_drift(
+    seconds: float = SimulationConfig.MAX_TIMESTEPS / SimulationConfig.STEPS_PER_SECOND,
+    scenarios: list[Scenario] = SCENARIOS,
+    tolerance: float = 1.0,
+    params: Params | None = None,
+) -> list[Drift]:
+    # Every scenario with the exact kernels (the reference) against their
+    # fastmath variants, see scenario_drift
+    params = configured_params() if params is None else params
+    ticks = int(round(seconds * SimulationConfig.STEPS_PER_SECOND))
+    return [
+        scenario_drift(
+            scenario,
+            scenario_simulation(scenario, params._replace(fastmath=0), np.float64),
+            scenario_simulation(scenario, params._replace(fastmath=1), np.float64),
+            ticks,
+            tolerance,
+        )
+        for scenario in scenarios
+    ]
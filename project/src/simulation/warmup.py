@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+from numba.core.dispatcher import Dispatcher
+
+from configs.parameters import BASE, SimulationParams
+from simulation.capturing import detect_captures, detect_captures_into
+from simulation.fastmath import kernel_for
+from simulation.kinematics import forward_project, integrate_into, step_agents
+from simulation.mdp import find_actions, find_actions_into, group_opponents
+from simulation.params import Params, configured_params
+from simulation.primitives import load_primitives, tabulate_primitives_into
+from simulation.simulation import Simulation
+from simulation.spatial import nearest_neighbours, pairs_within
+
+# Every kernel is cached on disk (numba's cache=True, under __pycache__), so
+# after the first run a process loads them rather than compiling them. numba
+# only checks a cached kernel's own file for changes, so clear __pycache__
+# after editing a kernel that kernels in other modules call
+
+
+def cache_counts(kernels: list[Dispatcher]) -> tuple[int, int]:
+    # (cache hits, cache misses) over the kernels so far
+    return (
+        sum(sum(kernel.stats.cache_hits.values()) for kernel in kernels),
+        sum(sum(kernel.stats.cache_misses.values()) for kernel in kernels),
+    )
+
+
+def warmup(
+    params: Params | None = None, parameters: SimulationParams | None = None
+) -> list[tuple[str, float, str]]:
+    # Compiles, or loads from the cache, every kernel signature the simulation
+    # uses by running each entry point once on a tiny simulation, with the
+    # configured state dtype and params (so the fastmath variants if FASTMATH
+    # is on), and tabulates or loads the motion primitive tables for the
+    # agents in parameters (BASE by default) if params look actions up.
+    # Returns each entry point's (name, seconds, how its kernels were readied:
+    # "cached", "compiled", or "ready" if already in this process)
+    params = configured_params() if params is None else params
+    parameters = BASE if parameters is None else parameters
+    N = 3
+    simulations: list[Simulation] = []
+    # every agent with the first one's bounds and ratios, so the motion
+    # primitives it looks up are in the tables the run uses
+    kind = {
+        key: values[:1] * N
+        for key, values in parameters.items()
+        if key not in ("positions", "headings")
+    }
+
+    def build():
+        simulations.append(
+            Simulation(
+                N,
+                positions=[
+                    [0.0, 0.0, 1000.0],
+                    [200.0, 0.0, 1000.0],
+                    [5000.0, 0.0, 1000.0],
+                ],
+                headings=[0.0] * N,
+                **kind,  # type: ignore
+                params=params,
+            )
+        )
+
+    def state() -> tuple:
+        simulation = simulations[0]
+        return (
+            simulation.positions,
+            simulation.speeds,
+            simulation.attack_angles,
+            simulation.flight_path_angles,
+            simulation.roll_angles,
+            simulation.azimuth_angles,
+        )
+
+    def inputs() -> tuple:
+        simulation = simulations[0]
+        return (
+            simulation.thrusts,
+            simulation.attack_angle_rates,
+            simulation.roll_angle_rates,
+            *simulation.bounds(),
+        )
+
+    active = np.ones(N, dtype=bool)
+    phases: list[tuple[str, Callable[[], object], list[Dispatcher]]] = [
+        ("Simulation", build, []),
+        (
+            "Simulation.step",
+            lambda: simulations[0].step(),
+            [
+                kernel_for(integrate_into, params),
+                kernel_for(find_actions_into, params),
+                detect_captures_into,
+                group_opponents,
+            ],
+        ),
+        (
+            "nearest_neighbours",
+            lambda: nearest_neighbours(
+                simulations[0].positions, active, simulations[0].groups, 1
+            ),
+            [nearest_neighbours],
+        ),
+        (
+            "step_agents",
+            lambda: step_agents(*state(), *inputs(), params),
+            [integrate_into],
+        ),
+        (
+            "forward_project",
+            lambda: forward_project(1, *state(), *inputs(), params),
+            [integrate_into],
+        ),
+        (
+            "find_actions",
+            lambda: find_actions(
+                simulations[0].action_ratios,
+                *state(),
+                simulations[0].positions,
+                simulations[0].velocities,
+                group_opponents(simulations[0].groups, active),
+                *simulations[0].bounds(),
+                active,
+                params,
+            ),
+            [find_actions_into],
+        ),
+        (
+            "detect_captures",
+            lambda: detect_captures(
+                simulations[0].positions,
+                simulations[0].flight_path_angles,
+                simulations[0].attack_angles,
+                simulations[0].azimuth_angles,
+                active,
+                simulations[0].groups,
+                simulations[0].capture_keys,
+                simulations[0].capture_counts,
+                params,
+            ),
+            [detect_captures],
+        ),
+        (
+            "pairs_within",
+            lambda: pairs_within(
+                simulations[0].positions,
+                active,
+                simulations[0].groups,
+                params.capture_radius,
+            ),
+            [pairs_within],
+        ),
+    ]
+
+    if params.motion_primitives:
+        # every kind of agent's tables, before the step looks the first one's up
+        agents = Simulation(len(parameters["positions"]), **parameters, params=params)
+        phases.insert(
+            1,
+            (
+                "load_primitives",
+                lambda: load_primitives(agents.action_ratios, agents.bounds(), params),
+                [tabulate_primitives_into],
+            ),
+        )
+
+    report: list[tuple[str, float, str]] = []
+    for name, call, kernels in phases:
+        hits, misses = cache_counts(kernels)
+        start = perf_counter()
+        call()
+        seconds = perf_counter() - start
+        new_hits, new_misses = cache_counts(kernels)
+        if new_misses > misses:
+            how = "compiled"
+        elif new_hits > hits:
+            how = "cached"
+        else:
+            how = "ready"
+        report.append((name, seconds, how))
+    return report
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+import numpy as np
+import numpy.typing as npt
+
+from simulation.mdp import PlannerScratch, planner_scratch, seed_planner_state
+from simulation.params import PLANNERS
+from simulation.primitives import no_primitives
+from simulation.spatial import bucket_count
+
+if TYPE_CHECKING:
+    from simulation.params import Params
+
+
+class Workspace:
+    # scratch arrays an N-agent Simulation hands the kernels, and planner state
+
+    def __init__(self, N: int, seed: int = 0):
+        # agents both active and running, those of them deciding this step, and
+        # the agents whose inputs are set from this step's actions
+        self.live: npt.NDArray[np.bool_] = np.zeros(N, dtype=bool)
+        self.deciding: npt.NDArray[np.bool_] = np.zeros(N, dtype=bool)
+        self.update: npt.NDArray[np.bool_] = np.zeros(N, dtype=bool)
+        # ticks until each agent next decides, see schedule_decisions_into, and
+        # each agent's distance to its nearest opponent
+        self.countdown = np.zeros(N, dtype=np.int64)
+        self.separations = np.full(N, np.inf, dtype=np.float64)
+
+        # zero-input forward projection, and the speeds and angles it discards
+        self.no_input = np.zeros(N, dtype=np.float64)
+        self.projected_positions = np.zeros((N, 3), dtype=np.float64)
+        self.projected_velocities = np.zeros((N, 3), dtype=np.float64)
+        self.projected_scalars = np.zeros((5, N), dtype=np.float64)
+        # the projected velocities as unit vectors, shared by every action the
+        # planners score this step
+        self.projected_directions = np.zeros((N, 3), dtype=np.float64)
+
+        # deciding agents the distilled policy decides for, see POLICY, and
+        # those reusing a cached decision, see DECISION_CACHE_SIZE
+        self.distilled: npt.NDArray[np.bool_] = np.zeros(N, dtype=bool)
+        self.cached: npt.NDArray[np.bool_] = np.zeros(N, dtype=bool)
+        # chosen actions, their rewards and how many actions were scored
+        self.actions = np.zeros((N, 3), dtype=np.float64)
+        self.rewards = np.zeros(N, dtype=np.float64)
+        self.evaluations = np.zeros(N, dtype=np.int64)
+        # what the planners carry from one decision to the next, and the rows
+        # they work in within one (see scratch_for)
+        self.planner_state = seed_planner_state(N, seed)
+        self.planner_scratch = planner_scratch(N, 0)
+        # motion primitive tables, and the settings they were loaded for
+        self.primitives = no_primitives(N)
+        self.primitive_params: Params | None = None
+
+        # capture detection and nearest opponent grid, and capture results
+        self.cells = np.empty((N, 3), dtype=np.int64)
+        self.head = np.empty(bucket_count(N), dtype=np.int64)
+        self.following = np.empty(N, dtype=np.int64)
+        # each agent's nearest opponent, see nearest_opponent_distances_into
+        self.nearest_opponent = np.empty((N, 1), dtype=np.int64)
+        self.captures = np.empty((N, 2), dtype=np.int64)
+        self.captured = np.empty(N, dtype=bool)
+        self.grow_pairs(max(N, 1))
+
+    def scratch_for(self, params: Params) -> PlannerScratch:
+        # The planners' scratch, grown to hold params' cross-entropy samples
+        # when they search that way
+        samples = 0
+        if params.planner == PLANNERS.index("cem"):
+            samples = max(params.cem_samples, 1)
+        if self.planner_scratch.scores.shape[1] < samples:
+            self.planner_scratch = planner_scratch(self.live.shape[0], samples)
+        return self.planner_scratch
+
+    def grow_pairs(self, capacity: int):
+        self.pairs = np.empty((capacity, 2), dtype=np.int64)
+        self.checks = np.empty((capacity, 2), dtype=bool)
+        # the capture buffer is double buffered, as detection reads the last
+        # step's while writing this step's; side is the one to write next
+        self.keys = np.empty((2, capacity), dtype=np.int64)
+        self.counts = np.empty((2, capacity), dtype=np.int64)
+        self.side = 0
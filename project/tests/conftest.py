@@ -13,6 +13,7 @@ def make_simulation():
         return Simulation(
             N=N,
             positions=[[5000.0, 5000.0, 6500.0]] * N,
+            headings=[0.0] * N,
             velocity_mins=[0.1 * M] * N,
             velocity_maxs=[0.9 * M] * N,
             azimuth_rate_mins=[-0.5] * N,
@@ -0,0 +1,109 @@
+import numpy as np
+from simulation.simulation import Simulation
+from simulation.batch import BatchSimulation
+from simulation.distilled import fit_policy, record_decisions
+from simulation.params import configured_params
+from simulation.planners import compare_distilled
+from configs import simulation as SimulationConfig
+
+
+def make_episode(rng: np.random.Generator, N: int) -> dict:
+    M = SimulationConfig.MACH
+    return dict(
+        positions=rng.uniform([4000, 4000, 5000], [6000, 6000, 5500], (N, 3)).tolist(),
+        headings=rng.uniform(0, 2 * np.pi, N).tolist(),
+        velocity_mins=[0.1 * M] * N,
+        velocity_maxs=[0.3 * M] * N,
+        azimuth_rate_mins=[-1.3] * N,
+        azimuth_rate_maxs=[1.3] * N,
+        attack_angle_mins=[0.09] * N,
+        attack_angle_maxs=[0.52] * N,
+        thrust_ratio=[10.0] * N,
+        attack_angle_ratio=[1.5] * N,
+        roll_angle_ratio=[1.0] * N,
+    )
+
+
+def test_batch_matches_separate_simulations(monkeypatch):
+    monkeypatch.setattr(SimulationConfig, "MAX_TIMESTEPS", 150)
+    rng = np.random.default_rng(5)
+    N = 3
+    episodes = [make_episode(rng, N) for _ in range(3)]
+    # an already finished episode must not affect the others
+    episodes[1]["positions"] = [
+        [5000.0, 5000.0, 5000.0],
+        [5100.0, 5000.0, 5000.0],
+        [5200.0, 5000.0, 5000.0],
+    ]
+
+    batch = BatchSimulation(N, episodes)
+    assert batch.episode_view(batch.positions).shape == (3, N, 3)
+    results = batch.run()
+
+    for b, episode in enumerate(episodes):
+        simulation = Simulation(N, **episode)
+        captures = []
+        while simulation.timestep < SimulationConfig.MAX_TIMESTEPS:
+            step_captures = simulation.step()
+            captures += [(simulation.timestep, *c) for c in step_captures]
+            if np.sum(simulation.active) <= 1:
+                break
+
+        assert results[b] == (simulation.timestep, captures)
+        assert np.array_equal(
+            batch.episode_view(batch.positions)[b], simulation.positions
+        )
+        assert np.array_equal(batch.episode_view(batch.active)[b], simulation.active)
+
+
+def test_batch_restores_from_snapshot(monkeypatch):
+    monkeypatch.setattr(SimulationConfig, "MAX_TIMESTEPS", 150)
+    rng = np.random.default_rng(5)
+    N = 3
+    episodes = [make_episode(rng, N) for _ in range(2)]
+
+    batch = BatchSimulation(N, episodes)
+    for _ in range(40):
+        batch.step()
+    restored = BatchSimulation(N, episodes)
+    restored.restore(batch.snapshot())
+
+    assert restored.run() == batch.run()
+    assert np.array_equal(restored.positions, batch.positions)
+
+
+def test_distilled_tooling_runs_on_batches():
+    rng = np.random.default_rng(6)
+    N = 3
+    episodes = [make_episode(rng, N) for _ in range(2)]
+
+    batch = BatchSimulation(N, episodes)
+    features, labels = record_decisions(batch, 3, opponents=2)
+    assert labels.shape == (3 * 2 * N, 3)
+
+    params = configured_params(policy="distilled", distilled_fallback_range=1000.0)
+    batch = BatchSimulation(N, episodes, params=params)
+    batch.policy = fit_policy(features, labels, params, hidden=(8,), epochs=5)
+    report = compare_distilled(batch, 3)
+    assert report["decisions"] + report["fallbacks"] == 3 * 2 * N
+
+
+def test_batch_step_keeps_simulation_step_shape(monkeypatch):
+    monkeypatch.setattr(SimulationConfig, "MAX_TIMESTEPS", 60)
+    rng = np.random.default_rng(5)
+    N = 3
+    batch = BatchSimulation(N, [make_episode(rng, N) for _ in range(2)])
+    running = batch.running
+
+    captures = []
+    while not batch.finished.all():
+        captures += batch.step()
+    # global (evader, pursuer) ids as Simulation.step gives, and running is
+    # updated in place
+    assert batch.running is running
+    assert not running.any()
+    assert sorted((e // N, e % N, p % N) for e, p in captures) == sorted(
+        (b, captured, capturer)
+        for b, episode in enumerate(batch.captures)
+        for _, captured, capturer in episode
+    )
@@ -1,9 +1,22 @@
 import numpy as np
 import pytest
-from simulation.simulation import step_agents
+from simulation.simulation import forward_project, step_agents
+from simulation import kinematics
+from simulation.fastmath import fastmath_variant
+from simulation.kinematics import integrate_into, set_threads
+from simulation.params import configured_params
+from simulation.studies import KINEMATIC_CASES, integrator_errors
 from configs import simulation as SimulationConfig
 
 
+@pytest.fixture(autouse=True)
+def restore_lift():
+    """Tests here change the lift constant, so put it back for later tests."""
+    L = SimulationConfig.L
+    yield
+    SimulationConfig.L = L
+
+
 def make_bounds(N: int):
     """Return permissive no-op bounds for N agents so physics tests are not distorted."""
     M = float(SimulationConfig.MACH)
@@ -19,9 +32,8 @@ def make_bounds(N: int):
 
 def test_no_gravity_straight_flight():
     """With no gravity and no thrust, agents fly in straight lines at constant velocity."""
-    SimulationConfig.G = 0.0
+    params = configured_params(g=0.0)
     SimulationConfig.L = 0.0
-    step_agents.recompile()
 
     N = 2
     bounds = make_bounds(N)
@@ -55,6 +67,7 @@ def test_no_gravity_straight_flight():
             attack_angle_rates,
             roll_angle_rates,
             **bounds,
+            params=params,
         )
 
     assert np.allclose(positions[0], [100.0, 0.0, 0.0])
@@ -65,9 +78,8 @@ def test_no_gravity_straight_flight():
 
 def test_level_flight_with_thrust():
     """With thrust balancing gravity, the agent maintains altitude."""
-    SimulationConfig.G = 9.81
+    params = configured_params(g=9.81)
     SimulationConfig.L = 1.0
-    step_agents.recompile()
 
     N = 1
     bounds = make_bounds(N)
@@ -101,6 +113,7 @@ def test_level_flight_with_thrust():
             attack_angle_rates,
             roll_angle_rates,
             **bounds,
+            params=params,
         )
 
     assert np.allclose(positions[0, 2], 1000.0, atol=1e-1)
@@ -108,14 +121,13 @@ def test_level_flight_with_thrust():
 
 def test_level_turn():
     """A coordinated turn changes azimuth while preserving altitude and speed."""
-    SimulationConfig.G = 9.81
+    params = configured_params(g=9.81)
     SimulationConfig.L = 0.0
 
     v = 100.0
     roll_angle = np.deg2rad(30)
     nf = 1 / np.cos(roll_angle)
     SimulationConfig.L = nf
-    step_agents.recompile()
 
     N = 1
     bounds = make_bounds(N)
@@ -149,19 +161,20 @@ def test_level_turn():
             attack_angle_rates,
             roll_angle_rates,
             **bounds,
+            params=params,
         )
 
     assert np.allclose(positions[0, 2], 1000.0, atol=1e-1)
     assert np.allclose(velocities[0], v)
 
-    expected_azimuth_rate = SimulationConfig.G * np.tan(roll_angle) / v
+    expected_azimuth_rate = params.g * np.tan(roll_angle) / v
     expected_azimuth_change = expected_azimuth_rate * 1.0  # 1 second
     assert np.allclose(azimuth_angles[0], expected_azimuth_change, atol=1e-2)
 
 
 def test_climb():
     """A steady climb increases altitude while maintaining speed and flight path angle."""
-    SimulationConfig.G = 9.81
+    params = configured_params(g=9.81)
     SimulationConfig.L = 0.0
 
     v = 100.0
@@ -169,7 +182,6 @@ def test_climb():
 
     thrust = np.sin(flight_path_angle)
     SimulationConfig.L = np.cos(flight_path_angle)
-    step_agents.recompile()
 
     N = 1
     bounds = make_bounds(N)
@@ -203,6 +215,7 @@ def test_climb():
             attack_angle_rates,
             roll_angle_rates,
             **bounds,
+            params=params,
         )
 
     assert np.allclose(velocities[0], v)
@@ -214,7 +227,7 @@ def test_climb():
 
 def test_dive():
     """A steady dive decreases altitude while maintaining speed and flight path angle."""
-    SimulationConfig.G = 9.81
+    params = configured_params(g=9.81)
     SimulationConfig.L = 0.0
 
     v = 100.0
@@ -222,7 +235,6 @@ def test_dive():
 
     thrust = np.sin(flight_path_angle)
     SimulationConfig.L = np.cos(flight_path_angle)
-    step_agents.recompile()
 
     N = 1
     bounds = make_bounds(N)
@@ -256,6 +268,7 @@ def test_dive():
             attack_angle_rates,
             roll_angle_rates,
             **bounds,
+            params=params,
         )
 
     assert np.allclose(velocities[0], v)
@@ -263,3 +276,154 @@ def test_dive():
 
     expected_altitude_change = v * np.sin(flight_path_angle) * 1.0
     assert np.allclose(positions[0, 2] - 1000.0, expected_altitude_change, atol=1)
+
+
+def test_forward_project_matches_repeated_steps():
+    """Projecting per agent over many steps matches stepping every agent together."""
+    N = 6
+    rng = np.random.default_rng(0)
+    bounds = make_bounds(N)
+    state = (
+        rng.uniform(0.0, 1000.0, size=(N, 3)),
+        rng.uniform(100.0, 300.0, size=N),
+        rng.uniform(-0.2, 0.2, size=N),
+        rng.uniform(-0.2, 0.2, size=N),
+        rng.uniform(-1.0, 1.0, size=N),
+        rng.uniform(0.0, 2 * np.pi, size=N),
+    )
+    controls = (
+        rng.uniform(0.0, 1.0, size=N),
+        rng.uniform(-0.1, 0.1, size=N),
+        rng.uniform(-0.5, 0.5, size=N),
+    )
+
+    params = configured_params()
+    projected = forward_project(10, *state, *controls, **bounds, params=params)
+
+    positions, velocities, *angles = state
+    for _ in range(10):
+        positions, velocity_vectors, velocities, *angles = step_agents(
+            positions, velocities, *angles, *controls, **bounds, params=params
+        )
+
+    expected = (positions, velocity_vectors, velocities, *angles)
+    for projected_array, expected_array in zip(projected, expected):
+        assert np.array_equal(projected_array, expected_array)
+
+
+def drift_state(N: int, dtype: type) -> tuple:
+    """Return a varied state for N agents with the given float dtype, and
+    controls that keep them turning and climbing."""
+    rng = np.random.default_rng(1)
+    state = (
+        rng.uniform(0.0, 1000.0, size=(N, 3)) + [0.0, 0.0, 5000.0],
+        rng.uniform(100.0, 300.0, size=N),
+        rng.uniform(0.0, 0.2, size=N),
+        rng.uniform(-0.2, 0.2, size=N),
+        rng.uniform(-1.0, 1.0, size=N),
+        rng.uniform(0.0, 2 * np.pi, size=N),
+    )
+    controls = (
+        rng.uniform(0.0, 1.0, size=N),
+        rng.uniform(-0.05, 0.05, size=N),
+        rng.uniform(-0.2, 0.2, size=N),
+    )
+    return tuple(array.astype(dtype) for array in state), controls
+
+
+def test_float32_projection_tracks_float64():
+    """Projecting float32 state stays within a metre of float64 over 10 s,
+    compiling only the one float32 signature (the full simulation comparison,
+    test_float32_state_tracks_float64, is marked slow)."""
+    N = 4
+    bounds = make_bounds(N)
+    params = configured_params()
+    steps = 10 * SimulationConfig.STEPS_PER_SECOND
+    state, controls = drift_state(N, np.float64)
+    reference = forward_project(steps, *state, *controls, **bounds, params=params)
+    state, controls = drift_state(N, np.float32)
+    variant = forward_project(steps, *state, *controls, **bounds, params=params)
+
+    assert variant[0].dtype == np.float32
+    error = np.linalg.norm(variant[0] - reference[0], axis=1).max()
+    assert 0.0 < error < 1.0
+
+
+def test_fastmath_projection_tracks_exact(monkeypatch):
+    """The fastmath variant of integrate_into stays within a micrometre of the
+    exact kernel over 10 s (the full simulation comparison,
+    test_fastmath_variants_track_exact_kernels, is marked slow)."""
+    N = 4
+    bounds = make_bounds(N)
+    params = configured_params()
+    steps = 10 * SimulationConfig.STEPS_PER_SECOND
+    state, controls = drift_state(N, np.float64)
+    reference = forward_project(steps, *state, *controls, **bounds, params=params)
+    monkeypatch.setattr(kinematics, "integrate_into", fastmath_variant(integrate_into))
+    variant = forward_project(steps, *state, *controls, **bounds, params=params)
+
+    error = np.linalg.norm(variant[0] - reference[0], axis=1).max()
+    assert error < 1e-6
+
+
+def test_set_threads_respects_numba_limit():
+    """Thread counts are capped at NUMBA_NUM_THREADS, and 0 means all of them."""
+    import numba
+
+    limit = numba.config.NUMBA_NUM_THREADS
+    assert set_threads(0) == limit
+    assert set_threads(limit + 4) == limit
+    assert set_threads(1) == 1
+    assert numba.get_num_threads() == 1
+    set_threads(0)
+
+
+def test_params_change_without_recompiling():
+    """One compiled kernel serves every configuration passed to it."""
+    N = 1
+    bounds = make_bounds(N)
+    state = (
+        np.array([[0.0, 0.0, 1000.0]]),
+        np.array([100.0]),
+        np.zeros(N),
+        np.zeros(N),
+        np.zeros(N),
+        np.zeros(N),
+    )
+    controls = (np.zeros(N), np.zeros(N), np.zeros(N))
+
+    falling = forward_project(
+        20, *state, *controls, **bounds, params=configured_params(g=9.81)
+    )
+    signatures = len(integrate_into.signatures)
+    floating = forward_project(
+        20, *state, *controls, **bounds, params=configured_params(g=0.0)
+    )
+
+    assert len(integrate_into.signatures) == signatures
+    assert falling[0][0, 2] < 1000.0
+    assert np.allclose(
+        floating[0][0], [20 * 100.0 / SimulationConfig.STEPS_PER_SECOND, 0.0, 1000.0]
+    )
+
+
+def test_runge_kutta_is_accurate_at_lower_rates():
+    """RK4 at 5 Hz beats the semi-implicit step at 20 Hz, and each scheme
+    converges at its order as the rate rises."""
+    cases = [
+        case
+        for case in KINEMATIC_CASES
+        if case["name"] in ("level_turn", "pulling_roll")
+    ]
+    errors = {
+        (error["case"], error["integrator"], error["steps_per_second"]): error[
+            "position_error"
+        ]
+        for error in integrator_errors(1.0, (5, 10, 20), cases=cases)
+    }
+
+    for case in ("level_turn", "pulling_roll"):
+        assert errors[case, "rk4", 5] < errors[case, "semi_implicit", 20] / 100
+        for integrator, order in (("semi_implicit", 1), ("rk2", 2), ("rk4", 4)):
+            ratio = errors[case, integrator, 10] / errors[case, integrator, 20]
+            assert 0.8 * 2**order < ratio < 1.25 * 2**order
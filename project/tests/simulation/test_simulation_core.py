@@ -1,7 +1,31 @@
+import tracemalloc
 import numpy as np
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from simulation.simulation import SimulationManager, Simulation
+from simulation.cache import DecisionCache
+from simulation.distilled import (
+    fit_policy,
+    load_policy,
+    policy_indices,
+    record_decisions,
+    save_policy,
+)
+from simulation.planners import compare_cached, compare_distilled, compare_planners
+from simulation.params import configured_params
+from simulation.spatial import nearest_opponent_distances_into, pairs_within
+from simulation.workspace import Workspace
+from simulation.studies import fastmath_drift, precision_drift
+from validation.scenarios import SCENARIOS
+from configs import simulation as SimulationConfig
+
+
+def spread_out(make_simulation, offsets, **settings) -> Simulation:
+    # agents at the given x offsets (m), with settings in place of the configs'
+    simulation = make_simulation(N=len(offsets))
+    simulation.positions[:, 0] += offsets
+    simulation.params = configured_params(**settings)
+    return simulation
 
 
 def test_simulation_initialization(make_simulation):
@@ -16,14 +40,98 @@ def test_simulation_step(make_simulation):
     simulation = make_simulation(N=2)
     initial_positions = simulation.positions.copy()
 
-    with patch("simulation.simulation.MDP") as mock_mdp:
-        mock_mdp.return_value.find_action.return_value = np.array([1.0, 0.1, 0.1])
+    def choose(*args):
+        # find_actions_into writes the actions into out, then rewards,
+        # evaluations, planner state, planner scratch, motion primitives and params
+        args[-7][:] = [1.0, 0.1, 0.1]
+
+    with patch("simulation.simulation.find_actions_into", side_effect=choose):
         simulation.step()
 
     assert simulation.timestep == 1
     assert not np.array_equal(simulation.positions, initial_positions)
 
 
+def test_compare_planners(make_simulation):
+    simulation = spread_out(make_simulation, [0.0, 2000.0, 4000.0])
+    report = compare_planners(simulation, 3)
+    assert report["decisions"] == 9
+    assert report["disagreements"] == 0
+    assert report["mean_regret"] == 0.0
+
+    simulation = spread_out(
+        make_simulation, [0.0, 2000.0, 4000.0], planner="coarse_to_fine"
+    )
+    report = compare_planners(simulation, 3)
+    assert simulation.timestep == 3
+    assert report["mean_evaluations"] < report["mean_exhaustive_evaluations"] / 10
+    assert report["mean_regret"] >= 0.0
+
+
+def test_far_agents_decide_less_often(make_simulation):
+    simulation = spread_out(
+        make_simulation,
+        [0.0, 300.0, 20_000.0],
+        decision_interval=5,
+        decision_near_range=1000.0,
+        decision_far_range=5000.0,
+    )
+
+    thrusts = []
+    for _ in range(10):
+        simulation.step()
+        thrusts.append(simulation.thrusts[2])
+
+    # the close pair decides every step, the far agent every fifth
+    assert simulation.decisions == 2 * 10 + 2
+    assert thrusts[:5] == [thrusts[0]] * 5
+    assert thrusts[5:] == [thrusts[5]] * 5
+
+
+# far apart, agents hold for decision_interval ticks however many ticks each
+# step covers
+@pytest.mark.parametrize(
+    "max_step_ticks, steps, decisions", [(1, 16, 2 * 2), (4, 8, 2 * 4), (3, 8, 2 * 3)]
+)
+def test_decisions_hold_for_ticks_not_steps(
+    make_simulation, max_step_ticks, steps, decisions
+):
+    simulation = spread_out(
+        make_simulation,
+        [0.0, 30_000.0],
+        decision_interval=8,
+        decision_far_range=5000.0,
+        max_step_ticks=max_step_ticks,
+        step_far_range=10_000.0,
+    )
+    for _ in range(steps):
+        simulation.step()
+    assert simulation.timestep == steps * max_step_ticks
+    assert simulation.decisions == decisions
+
+
+def test_step_allocates_no_arrays(make_simulation):
+    simulation = make_simulation(N=3)
+    simulation.positions[:, 0] += [0.0, 200.0, 4000.0]
+    for _ in range(2):
+        simulation.step()
+    state = simulation.positions
+
+    tracemalloc.start()
+    try:
+        for _ in range(5):
+            simulation.step()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    arrays = snapshot.filter_traces(
+        [tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)]
+    )
+    assert len(arrays.traces) == 0
+    assert simulation.positions is state
+
+
 @patch("simulation.simulation.Simulation.step")
 def test_simulation_manager_run(mock_step: MagicMock, make_simulation):
     mock_logger = Mock()
@@ -46,3 +154,294 @@ def test_simulation_manager_run(mock_step: MagicMock, make_simulation):
 
     assert mock_callback.call_count == 5
     mock_callback.assert_called_with(manager.simulation)
+
+
+def test_capturing_requires_sustained_tail_position(make_simulation):
+    simulation = make_simulation(N=3)
+    # agent 0 sits 200 m behind agent 1, both heading along +x; agent 2 is far away
+    simulation.positions = np.array(
+        [[1000.0, 5000.0, 6500.0], [1200.0, 5000.0, 6500.0], [9000.0, 0.0, 6500.0]]
+    )
+
+    for _ in range(SimulationConfig.CAPTURE_POINT_STEPS - 1):
+        assert simulation.capturing() == []
+    assert simulation.capture_buffer == {
+        (1, 0): SimulationConfig.CAPTURE_POINT_STEPS - 1
+    }
+    # only the pair inside the capture radius is tested, from both sides
+    assert simulation.capture_pairs.tolist() == [[0, 1], [1, 0]]
+    assert simulation.capture_checks.tolist() == [[True, True], [False, False]]
+
+    assert simulation.capturing() == [(1, 0)]
+    assert list(simulation.active) == [True, False, True]
+    assert simulation.capture_buffer == {}
+
+
+def test_capture_timing_counts_ticks(make_simulation):
+    simulation = make_simulation(N=3)
+    simulation.positions = np.array(
+        [[1000.0, 5000.0, 6500.0], [1200.0, 5000.0, 6500.0], [9000.0, 0.0, 6500.0]]
+    )
+
+    # a capture takes as long in seconds whatever the steps are
+    steps, rest = divmod(SimulationConfig.CAPTURE_POINT_STEPS - 1, 3)
+    for ticks in [3] * steps + [rest] * (rest > 0):
+        assert simulation.capturing(ticks) == []
+    assert simulation.capture_buffer == {
+        (1, 0): SimulationConfig.CAPTURE_POINT_STEPS - 1
+    }
+    assert simulation.capturing(1) == [(1, 0)]
+
+
+def test_captured_agents_drop_out(make_simulation):
+    simulation = spread_out(make_simulation, [0.0, 2000.0, 4000.0, 6000.0])
+    simulation.step()
+    assert simulation.opponents.tolist() == [
+        [1, 2, 3],
+        [0, 2, 3],
+        [0, 1, 3],
+        [0, 1, 2],
+    ]
+
+    simulation.active[1] = False
+    captured = simulation.positions[1].copy()
+    simulation.step()
+    # no longer an opponent, projected or stepped, and ids are unchanged
+    assert simulation.opponents.tolist() == [
+        [2, 3, -1],
+        [-1, -1, -1],
+        [0, 3, -1],
+        [0, 2, -1],
+    ]
+    assert np.array_equal(simulation.positions[1], captured)
+    assert not np.array_equal(simulation.positions[0], captured)
+
+
+def test_nearest_opponents_build_no_opponent_table(make_simulation):
+    simulation = spread_out(
+        make_simulation, [0.0, 2000.0, 4000.0, 6000.0], nearest_opponents=1
+    )
+    simulation.step()
+    simulation.active[1] = False
+    simulation.step()
+    assert simulation.opponents is None
+
+
+@pytest.mark.slow
+def test_float32_state_tracks_float64():
+    scenario = [s for s in SCENARIOS if s["name"] == "asymmetric"]
+    (drift,) = precision_drift(seconds=2.0, scenarios=scenario)
+    assert drift["same_outcome"]
+    assert drift["divergence_timestep"] == -1
+    assert 0.0 < drift["max_position_error"] < 1.0
+
+
+@pytest.mark.slow
+def test_fastmath_variants_track_exact_kernels():
+    scenario = [s for s in SCENARIOS if s["name"] == "asymmetric"]
+    (drift,) = fastmath_drift(seconds=2.0, scenarios=scenario)
+    assert drift["same_outcome"]
+    assert drift["max_position_error"] < 1e-6
+    assert drift["max_angle_error"] < 1e-9
+
+
+# long steps while far apart, single ticks while close, and never past the end
+@pytest.mark.parametrize(
+    "separation, max_timesteps, timestep",
+    [(30_000.0, 4000, 12), (1000.0, 4000, 3), (30_000.0, 10, 10)],
+)
+def test_steps_lengthen_while_agents_are_far_apart(
+    make_simulation, monkeypatch, separation, max_timesteps, timestep
+):
+    monkeypatch.setattr(SimulationConfig, "MAX_TIMESTEPS", max_timesteps)
+    simulation = spread_out(
+        make_simulation,
+        [0.0, separation],
+        max_step_ticks=4,
+        step_near_range=2000.0,
+        step_far_range=10_000.0,
+    )
+    for _ in range(3):
+        simulation.step()
+    assert (simulation.timestep, simulation.steps) == (timestep, 3)
+
+
+def test_distilled_policy_defers_near_opponents(make_simulation, tmp_path):
+    simulation = spread_out(make_simulation, [0.0, 300.0, 20_000.0])
+    features, labels = record_decisions(simulation, 4, opponents=2)
+    assert features.shape == (12, 6 + 2 * 8)
+    assert labels.shape == (12, 3)
+
+    policy = fit_policy(
+        features,
+        labels,
+        simulation.params,
+        hidden=(16,),
+        epochs=500,
+        batch_size=12,
+        learning_rate=1e-2,
+    )
+    assert np.array_equal(policy_indices(policy, features), labels)
+    save_policy(policy, str(tmp_path / "policy.npz"))
+    policy = load_policy(str(tmp_path / "policy.npz"))
+    assert np.array_equal(policy_indices(policy, features), labels)
+
+    # the far agent follows the policy, the near ones the planner
+    simulation = spread_out(
+        make_simulation,
+        [0.0, 300.0, 20_000.0],
+        policy="distilled",
+        distilled_fallback_range=1000.0,
+    )
+    simulation.policy = policy
+    simulation.decide()
+    assert simulation.workspace.distilled.tolist() == [False, False, True]
+    assert simulation.workspace.evaluations.tolist() == [1000, 1000, 0]
+
+    report = compare_distilled(simulation, 4)
+    assert (report["decisions"], report["fallbacks"]) == (4, 8)
+    assert 0.0 <= report["agreement_rate"] <= min(report["axis_agreement_rates"])
+
+
+def test_decision_cache_reuses_decisions(make_simulation):
+    cache = DecisionCache(2)
+    cache.put(b"a", (0, 0, 0))
+    cache.put(b"b", (1, 1, 1))
+    assert cache.get(b"a") == (0, 0, 0)
+    # b is now the least recently used
+    cache.put(b"c", (2, 2, 2))
+    assert cache.get(b"b") is None
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+
+    first = spread_out(make_simulation, [0.0, 2000.0, 4000.0], decision_cache_size=100)
+    first.decide()
+    assert not first.workspace.cached.any()
+
+    # the same situations again are answered from the cache
+    second = spread_out(make_simulation, [0.0, 2000.0, 4000.0], decision_cache_size=100)
+    second.decision_cache = first.decision_cache
+    second.decide()
+    assert second.workspace.cached.all()
+    assert np.all(second.workspace.evaluations == 0)
+    assert np.array_equal(second.workspace.actions, first.workspace.actions)
+
+    report = compare_cached(second, 5)
+    assert report["hits"] + report["misses"] == report["decisions"] == 15
+    assert report["divergences"] <= report["hits"]
+
+
+def test_comparisons_leave_the_run_unchanged(make_simulation):
+    runs = []
+    for compare in (None, record_decisions, compare_cached, compare_planners):
+        simulation = spread_out(
+            make_simulation,
+            [0.0, 2000.0, 4000.0],
+            planner="warm_start",
+            decision_cache_size=100,
+        )
+        if compare is None:
+            for _ in range(5):
+                simulation.step()
+        else:
+            compare(simulation, 5)
+        runs.append(simulation.snapshot_arrays())
+
+    for run in runs[1:]:
+        assert run.keys() == runs[0].keys()
+        for name, array in run.items():
+            assert np.array_equal(array, runs[0][name], equal_nan=True), name
+
+
+def test_snapshot_restore_and_fork_repeat_steps(make_simulation):
+    def start() -> Simulation:
+        return spread_out(
+            make_simulation,
+            [0.0, 400.0, 3000.0],
+            planner="warm_start",
+            decision_cache_size=64,
+        )
+
+    simulation = start()
+    for _ in range(5):
+        simulation.step()
+    snapshot = simulation.snapshot()
+    fork = simulation.fork()
+    for _ in range(5):
+        simulation.step()
+
+    restored = start()
+    restored.restore(snapshot)
+    for _ in range(5):
+        restored.step()
+        fork.step()
+    for other in (restored, fork):
+        assert other.timestep == simulation.timestep
+        assert np.array_equal(other.positions, simulation.positions)
+        assert other.capture_buffer == simulation.capture_buffer
+        assert other.decision_cache.entries == simulation.decision_cache.entries
+        assert np.array_equal(
+            other.workspace.planner_state.previous,
+            simulation.workspace.planner_state.previous,
+        )
+
+    # forks step apart, with their own settings
+    exhaustive = simulation.fork(configured_params())
+    exhaustive.step()
+    assert (simulation.timestep, exhaustive.timestep) == (10, 11)
+    assert exhaustive.decision_cache.misses == simulation.decision_cache.misses
+
+    with pytest.raises(ValueError):
+        make_simulation(N=2).restore(snapshot)
+
+
+def test_pairs_within_matches_brute_force():
+    rng = np.random.default_rng(2)
+    positions = rng.uniform(-3000, 3000, size=(300, 3))
+    active = rng.random(300) > 0.1
+    groups = rng.integers(0, 2, 300)
+    radius = 500.0
+
+    d = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+    expected = [
+        [i, j]
+        for i in range(300)
+        for j in range(300)
+        if i != j
+        and active[i]
+        and active[j]
+        and groups[i] == groups[j]
+        and d[i, j] < radius
+    ]
+    assert pairs_within(positions, active, groups, radius).tolist() == expected
+
+
+def test_nearest_opponent_distances_match_brute_force():
+    rng = np.random.default_rng(3)
+    positions = rng.uniform(-3000, 3000, size=(300, 3))
+    live = rng.random(300) > 0.1
+    groups = rng.integers(0, 3, 300)
+    live[groups == 2] = np.arange(300)[groups == 2] == np.flatnonzero(groups == 2)[0]
+    workspace = Workspace(300)
+
+    separations = np.empty(300)
+    least = nearest_opponent_distances_into(
+        positions,
+        live,
+        groups,
+        workspace.cells,
+        workspace.head,
+        workspace.following,
+        workspace.nearest_opponent,
+        separations,
+    )
+
+    d = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+    d[~live] = np.inf
+    d[:, ~live] = np.inf
+    d[groups[:, None] != groups[None]] = np.inf
+    np.fill_diagonal(d, np.inf)
+    expected = d.min(axis=1)
+    # group 2 has a single live agent, with no opponent at all
+    assert np.isinf(expected[groups == 2]).all()
+    assert np.allclose(separations, expected)
+    assert least == expected.min()
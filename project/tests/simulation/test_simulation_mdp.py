@@ -1,6 +1,26 @@
 import numpy as np
 import pytest
-from simulation.mdp import MDP
+from simulation.mdp import (
+    MDP,
+    action_table,
+    calculate_reward,
+    calculate_rewards,
+    drop_opponents,
+    find_actions,
+    find_actions_into,
+    find_opponents,
+    group_opponents,
+    hard_deck_penalty,
+    seed_planner_state,
+    negative_maximum,
+    planner_scratch,
+    positive_maximum,
+    unit_vectors_into,
+)
+from simulation.kinematics import forward_project
+from simulation.params import configured_params
+from simulation.primitives import load_primitives, no_primitives
+from configs import mdp as MDPConfig
 from configs import simulation as SimulationConfig
 
 
@@ -61,3 +81,342 @@ def test_find_action():
     action = mdp.find_action()
     assert isinstance(action, np.ndarray)
     assert action.shape == (3,)
+
+
+def test_find_actions_matches_per_action_search():
+    N = 4
+    mdp = setup_mdp(N)
+    active = np.ones(N, dtype=bool)
+    active[2] = False
+    ratios = np.array([[10.0, 1.5, 1.5]] * N)
+    bounds = (
+        mdp.velocity_mins,
+        mdp.velocity_maxs,
+        mdp.azimuth_rate_mins,
+        mdp.azimuth_rate_maxs,
+        mdp.attack_angle_mins,
+        mdp.attack_angle_maxs,
+    )
+
+    params = configured_params()
+    actions = find_actions(
+        ratios,
+        mdp.positions,
+        mdp.velocities,
+        mdp.attack_angles,
+        mdp.flight_path_angles,
+        mdp.roll_angles,
+        mdp.azimuth_angles,
+        mdp.projected_positions,
+        mdp.projected_velocities,
+        find_opponents(mdp.projected_positions, 0, np.zeros(N, dtype=np.int64)),
+        *bounds,
+        active,
+        params,
+    )
+
+    assert np.all(actions[2] == 0.0)
+    for i in np.nonzero(active)[0]:
+        others = np.arange(N) != i
+        rewards = []
+        for action in action_table() * ratios[i]:
+            results = forward_project(
+                MDPConfig.FORWARD_PROJECTION_STEPS,
+                mdp.positions[i : i + 1],
+                mdp.velocities[i : i + 1],
+                mdp.attack_angles[i : i + 1],
+                mdp.flight_path_angles[i : i + 1],
+                mdp.roll_angles[i : i + 1],
+                mdp.azimuth_angles[i : i + 1],
+                action[0:1],
+                action[1:2],
+                action[2:3],
+                *(bound[i : i + 1] for bound in bounds),
+                params,
+            )
+            rewards.append(
+                mdp.calculate_reward(
+                    results[0][0],
+                    results[1][0],
+                    mdp.projected_positions[others],
+                    mdp.projected_velocities[others],
+                )
+            )
+        expected = (action_table() * ratios[i])[np.argmax(rewards)]
+        assert np.allclose(actions[i], expected)
+
+
+def decision_arguments(mdp: MDP, ratios: np.ndarray) -> tuple:
+    # find_actions_into's arguments up to out, every agent active
+    N = mdp.positions.shape[0]
+    directions = np.empty((N, 3))
+    unit_vectors_into(mdp.projected_velocities, directions)
+    return (
+        ratios,
+        mdp.positions,
+        mdp.velocities,
+        mdp.attack_angles,
+        mdp.flight_path_angles,
+        mdp.roll_angles,
+        mdp.azimuth_angles,
+        mdp.projected_positions,
+        directions,
+        find_opponents(mdp.projected_positions, 0, np.zeros(N, dtype=np.int64)),
+        mdp.velocity_mins,
+        mdp.velocity_maxs,
+        mdp.azimuth_rate_mins,
+        mdp.azimuth_rate_maxs,
+        mdp.attack_angle_mins,
+        mdp.attack_angle_maxs,
+        np.ones(N, dtype=bool),
+    )
+
+
+def test_coarse_to_fine_scores_fewer_actions():
+    N = 6
+    mdp = setup_mdp(N)
+    ratios = np.array([[10.0, 1.5, 1.5]] * N)
+    arguments = decision_arguments(mdp, ratios)
+
+    results = {}
+    for planner in ("exhaustive", "coarse_to_fine"):
+        actions = np.empty((N, 3))
+        rewards = np.empty(N)
+        evaluations = np.empty(N, dtype=np.int64)
+        find_actions_into(
+            *arguments,
+            actions,
+            rewards,
+            evaluations,
+            seed_planner_state(N, 0),
+            planner_scratch(N, 0),
+            no_primitives(N),
+            configured_params(planner=planner, refine_stride=1),
+        )
+        results[planner] = actions, rewards, evaluations
+
+    best_actions, best_rewards, exhaustive_evaluations = results["exhaustive"]
+    actions, rewards, evaluations = results["coarse_to_fine"]
+    assert np.all(exhaustive_evaluations == len(action_table()))
+    # the middle action and up to 26 lattice neighbours at spacings 4, 2 and 1
+    assert np.all(evaluations <= 1 + 3 * 26)
+    assert np.all(rewards <= best_rewards)
+    table = action_table() * ratios[0]
+    assert all(np.any(np.all(table == action, axis=1)) for action in actions)
+    same = np.all(actions == best_actions, axis=1)
+    assert np.all(rewards[same] == best_rewards[same])
+
+
+# no iterations still runs one, so every agent gets an action
+@pytest.mark.parametrize("iterations, budget", [(3, 30), (0, 10)])
+def test_cem_samples_within_budget_and_box(iterations, budget):
+    N = 6
+    mdp = setup_mdp(N)
+    ratios = np.array([[10.0, 1.5, 1.5]] * N)
+    params = configured_params(
+        planner="cem", cem_iterations=iterations, cem_samples=10, cem_elites=3, seed=7
+    )
+
+    results = []
+    for _ in range(2):
+        actions = np.empty((N, 3))
+        rewards = np.empty(N)
+        evaluations = np.empty(N, dtype=np.int64)
+        find_actions_into(
+            *decision_arguments(mdp, ratios),
+            actions,
+            rewards,
+            evaluations,
+            seed_planner_state(N, params.seed),
+            planner_scratch(N, params.cem_samples),
+            no_primitives(N),
+            params,
+        )
+        results.append((actions, rewards))
+
+        assert np.all(evaluations == budget)
+        table = action_table() * ratios[0]
+        assert np.all(actions >= table.min(axis=0))
+        assert np.all(actions <= table.max(axis=0))
+
+    # the same seed samples the same actions
+    assert np.array_equal(results[0][0], results[1][0])
+    assert np.array_equal(results[0][1], results[1][1])
+
+
+def test_warm_start_searches_near_last_action():
+    N = 5
+    mdp = setup_mdp(N)
+    ratios = np.array([[10.0, 1.5, 1.5]] * N)
+    params = configured_params(planner="warm_start", local_radius=1, rescan_interval=2)
+    state = seed_planner_state(N, 0)
+    best_actions = find_actions(
+        *decision_arguments(mdp, ratios)[:-1],
+        np.ones(N, dtype=bool),
+        configured_params(),
+    )
+
+    decisions = []
+    for _ in range(3):
+        actions = np.empty((N, 3))
+        rewards = np.empty(N)
+        evaluations = np.empty(N, dtype=np.int64)
+        find_actions_into(
+            *decision_arguments(mdp, ratios),
+            actions,
+            rewards,
+            evaluations,
+            state,
+            planner_scratch(N, 0),
+            no_primitives(N),
+            params,
+        )
+        decisions.append((actions, evaluations))
+
+    # the first decision scans the grid, the next searches around it and the
+    # third is due a rescan
+    for actions, _ in decisions:
+        assert np.array_equal(actions, best_actions)
+    assert np.all(decisions[0][1] == len(action_table()))
+    assert np.all(decisions[1][1] <= 27)
+    assert np.all(decisions[2][1] == len(action_table()))
+    assert state.hits.tolist() == [1] * N
+    assert state.rescans.tolist() == [2] * N
+
+
+def test_motion_primitives_match_integration():
+    N = 4
+    mdp = setup_mdp(N)
+    ratios = np.array([[10.0, 1.5, 1.5]] * N)
+    bounds = decision_arguments(mdp, ratios)[10:16]
+    params = configured_params(motion_primitives=1)
+    primitives = load_primitives(
+        ratios, bounds, params, shape=(3, 5, 8, 2), directory=""
+    )
+    assert primitives.kinds.tolist() == [0] * N
+
+    # grid states, headings and positions are only rotated and translated
+    speeds = np.array([0.0, 1.0, 2.0, 1.0]) * primitives.spacings[0, 0]
+    mdp.velocities[:] = mdp.velocity_mins + speeds
+    mdp.flight_path_angles[:] = [0.0, 0.7, -0.7, 0.0]
+    mdp.roll_angles[:] = [0.0, np.pi / 4, -np.pi / 2, 2 * np.pi]
+    mdp.attack_angles[:] = mdp.attack_angle_mins
+    mdp.azimuth_angles[:] = [0.0, 1.0, 2.0, -3.0]
+
+    results = {}
+    for lookup in (0, 1):
+        actions = np.empty((N, 3))
+        rewards = np.empty(N)
+        evaluations = np.empty(N, dtype=np.int64)
+        find_actions_into(
+            *decision_arguments(mdp, ratios),
+            actions,
+            rewards,
+            evaluations,
+            seed_planner_state(N, 0),
+            planner_scratch(N, 0),
+            primitives,
+            params._replace(motion_primitives=lookup),
+        )
+        results[lookup] = actions, rewards
+    assert np.allclose(results[1][1], results[0][1], rtol=1e-4)
+
+    # states off the table are integrated
+    mdp.attack_angles[:] = 0.0
+    integrated = find_actions(
+        *decision_arguments(mdp, ratios)[:-1], np.ones(N, dtype=bool), params
+    )
+    looked_up = find_actions(
+        *decision_arguments(mdp, ratios)[:-1],
+        np.ones(N, dtype=bool),
+        params,
+        primitives,
+    )
+    assert np.array_equal(looked_up, integrated)
+
+
+def test_calculate_reward_matches_separate_maxima():
+    rng = np.random.default_rng(1)
+    positions = rng.uniform(0, 10_000, size=(6, 3))
+    velocities = rng.uniform(-200, 200, size=(6, 3))
+    self_positions = rng.uniform(0, 10_000, size=(20, 3))
+    self_positions[0, 2] = SimulationConfig.HARD_DECK - 1.0
+    self_velocities = rng.uniform(-200, 200, size=(20, 3))
+    opponents = np.array([0, 2, 3, 5])
+    params = configured_params()
+
+    rewards = calculate_rewards(
+        self_positions,
+        self_velocities,
+        positions,
+        velocities,
+        opponents,
+        np.empty(20),
+        params,
+    )
+
+    for c in range(20):
+        expected = (
+            positive_maximum(
+                self_positions[c],
+                self_velocities[c],
+                positions[opponents],
+                velocities[opponents],
+            )
+            - negative_maximum(
+                self_positions[c], positions[opponents], velocities[opponents]
+            )
+            - hard_deck_penalty(self_positions[c, 2], params)
+        )
+        assert np.isclose(rewards[c], expected)
+        assert rewards[c] == calculate_reward(
+            self_positions[c],
+            self_velocities[c],
+            positions,
+            velocities,
+            opponents,
+            params,
+        )
+
+
+def test_find_opponents_nearest():
+    rng = np.random.default_rng(4)
+    positions = rng.uniform(0, 10_000, size=(200, 3))
+    positions[50] = positions[49]  # coincident agents are still neighbours
+
+    opponents = find_opponents(positions, 5, np.zeros(200, dtype=np.int64))
+
+    d = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+    np.fill_diagonal(d, np.inf)
+    assert opponents.shape == (200, 5)
+    assert np.allclose(
+        np.take_along_axis(d, opponents, axis=1), np.sort(d, axis=1)[:, :5]
+    )
+    assert find_opponents(positions[:4], 5, np.zeros(4, dtype=np.int64)).tolist() == [
+        [1, 2, 3],
+        [0, 2, 3],
+        [0, 1, 3],
+        [0, 1, 2],
+    ]
+
+
+def test_drop_opponents_matches_rebuilt_table():
+    rng = np.random.default_rng(5)
+    groups = rng.integers(0, 4, 60)
+    live = np.ones(60, dtype=bool)
+    opponents = group_opponents(groups, live)
+    for _ in range(3):
+        dropped = live & (rng.random(60) < 0.2)
+        live &= ~dropped
+        drop_opponents(opponents, groups, dropped)
+        rebuilt = group_opponents(groups, live)
+        assert np.array_equal(opponents[:, : rebuilt.shape[1]], rebuilt)
+        assert (opponents[:, rebuilt.shape[1] :] == -1).all()
+
+
+def test_unit_vectors_into_scales_rows():
+    vectors = np.array([[3.0, 0.0, 4.0], [0.0, -2.0, 0.0], [0.0, 0.0, 0.0]])
+    out = np.empty_like(vectors)
+    unit_vectors_into(vectors, out)
+    assert np.allclose(out[:2], [[0.6, 0.0, 0.8], [0.0, -1.0, 0.0]])
+    assert np.all(np.isnan(out[2]))
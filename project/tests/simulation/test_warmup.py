@@ -0,0 +1,37 @@
+import pytest
+from simulation.fastmath import fastmath_variant
+from simulation.kinematics import integrate_into
+from simulation.mdp import find_actions_into
+from simulation.capturing import detect_captures_into
+from simulation.params import configured_params
+from simulation.warmup import warmup
+from configs import mdp as MDPConfig
+
+
+def test_warmup_readies_step_kernels():
+    report = warmup()
+
+    assert [name for name, _, _ in report][:2] == ["Simulation", "Simulation.step"]
+    assert all(how in ("compiled", "cached", "ready") for _, _, how in report)
+    for kernel in (integrate_into, find_actions_into, detect_captures_into):
+        assert kernel.signatures
+
+    # a second warm-up finds everything already in the process
+    assert all(how == "ready" for _, _, how in warmup())
+
+
+@pytest.mark.slow
+def test_warmup_readies_configured_variants(monkeypatch, tmp_path):
+    monkeypatch.setattr(MDPConfig, "PRIMITIVE_DIRECTORY", str(tmp_path))
+    params = configured_params(fastmath=1, motion_primitives=1)
+    report = warmup(params)
+
+    assert [name for name, _, _ in report][:3] == [
+        "Simulation",
+        "load_primitives",
+        "Simulation.step",
+    ]
+    for kernel in (integrate_into, find_actions_into):
+        assert fastmath_variant(kernel).signatures
+    # the tables for the configured agents were tabulated and saved
+    assert list(tmp_path.iterdir())
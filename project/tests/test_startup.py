@@ -0,0 +1,50 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC = Path(__file__).parent.parent / "src"
+
+# seconds to import the headless entry point in a fresh interpreter, about
+# 0.5 s when measured (nearly all numpy and numba), with headroom for slow machines
+HEADLESS_IMPORT_BUDGET = 1.5
+
+OPTIONAL = ("matplotlib", "rich.layout", "rich.live", "pyvista", "PyQt5")
+
+
+def import_fresh(module: str) -> tuple[float, set[str]]:
+    """Import module in a new interpreter, returning the seconds it took and every module loaded."""
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=SRC,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    seconds, modules = result.stdout.splitlines()
+    return float(seconds), set(modules.split(","))
+
+
+@pytest.mark.parametrize("module", ["main", "headless"])
+def test_entry_points_defer_optional_imports(module: str):
+    _, modules = import_fresh(module)
+    loaded = [
+        name
+        for name in modules
+        if any(name == prefix or name.startswith(prefix + ".") for prefix in OPTIONAL)
+    ]
+    assert loaded == []
+
+
+def test_headless_import_budget():
+    seconds, modules = import_fresh("headless")
+    assert "rich" not in modules
+    assert seconds < HEADLESS_IMPORT_BUDGET